@@ -0,0 +1,188 @@
+import os
+import re
+import time
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+from dotenv import load_dotenv
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1024"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+# Minimum cosine similarity for a new question to reuse a cached answer
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+
+
+def normalize_question(question):
+    question = re.sub(r"\s+", " ", question.strip().lower())
+    return question.rstrip("?!. ")
+
+
+class AnswerCache:
+    """Two-tier answer cache: exact normalised question, then cosine similarity of question embeddings.
+
+    Entries expire after `ttl` seconds and are evicted least recently used first.
+    The whole cache is dropped when `version_fn()` (the index version) changes,
+    so answers never outlive the documents they were generated from. With a
+    `store` (a SharedStore), answers are also written there, tagged with the
+    index version, and entries other worker processes wrote are pulled in
+    before each lookup, so a question answered by one worker hits in all.
+    """
+
+    def __init__(
+        self,
+        version_fn=None,
+        max_entries=ANSWER_CACHE_SIZE,
+        ttl=ANSWER_CACHE_TTL,
+        threshold=SEMANTIC_CACHE_THRESHOLD,
+        store=None,
+    ):
+        self.version_fn = version_fn
+        self.store = store
+        # Last shared-store entry pulled into this process
+        self._seq = 0
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._vectors = None
+        self._valid = np.zeros(max_entries, dtype=bool)
+        self._slots = {}
+        self._slot_keys = [None] * max_entries
+        self._free = list(range(max_entries - 1, -1, -1))
+        self._version = None
+        self.metrics = {
+            "exact_hits": 0,
+            "exact_misses": 0,
+            "semantic_hits": 0,
+            "semantic_misses": 0,
+            "invalidations": 0,
+            "shared_pulls": 0,
+        }
+
+    def _check_version(self):
+        if self.version_fn is not None:
+            version = self.version_fn()
+            if version != self._version:
+                if self._entries:
+                    logger.info(f"Index version changed ({self._version} -> {version}), clearing answer cache")
+                    self.metrics["invalidations"] += 1
+                self._clear()
+                self._version = version
+                self._seq = 0
+        self._pull()
+
+    def _pull(self):
+        # Entries other workers wrote since the last lookup; ours come back too but are just refreshed
+        if self.store is None:
+            return
+        for seq, key, entry in self.store.since(self._seq, tag=self._version):
+            self._seq = seq
+            age = time.time() - entry["created"]
+            if key in self._entries or age > self.ttl:
+                continue
+            self._insert(key, entry["vector"], entry["value"], time.monotonic() - age)
+            self.metrics["shared_pulls"] += 1
+
+    def _clear(self):
+        self._entries.clear()
+        self._slots.clear()
+        self._valid[:] = False
+        self._free = list(range(self.max_entries - 1, -1, -1))
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        slot = self._slots.pop(key, None)
+        if slot is not None:
+            self._valid[slot] = False
+            self._free.append(slot)
+
+    def _expired(self, entry):
+        return time.monotonic() - entry["created"] > self.ttl
+
+    def get_exact(self, question):
+        key = normalize_question(question)
+        with self._lock:
+            self._check_version()
+            entry = self._entries.get(key)
+            if entry is None or self._expired(entry):
+                if entry is not None:
+                    self._remove(key)
+                self.metrics["exact_misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.metrics["exact_hits"] += 1
+            return entry["value"]
+
+    def get_semantic(self, vector):
+        with self._lock:
+            self._check_version()
+            if self._vectors is None or not self._valid.any():
+                self.metrics["semantic_misses"] += 1
+                return None
+            query = np.asarray(vector, dtype=np.float32)
+            query = query / max(float(np.linalg.norm(query)), 1e-12)
+            scores = np.where(self._valid, self._vectors @ query, -np.inf)
+            while True:
+                slot = int(np.argmax(scores))
+                if scores[slot] < self.threshold:
+                    self.metrics["semantic_misses"] += 1
+                    return None
+                key = self._slot_keys[slot]
+                entry = self._entries.get(key)
+                if entry is not None and not self._expired(entry):
+                    break
+                # Drop the expired entry so it doesn't shadow a valid, slightly less similar one
+                if entry is not None:
+                    self._remove(key)
+                scores[slot] = -np.inf
+            self._entries.move_to_end(key)
+            self.metrics["semantic_hits"] += 1
+            return entry["value"]
+
+    def put(self, question, vector, value):
+        key = normalize_question(question)
+        with self._lock:
+            self._check_version()
+            self._insert(key, vector, value, time.monotonic())
+            if self.store is not None:
+                vector = None if vector is None else np.asarray(vector, dtype=np.float32)
+                self.store.put(
+                    key, {"value": value, "vector": vector, "created": time.time()}, self.ttl, tag=self._version
+                )
+
+    def _insert(self, key, vector, value, created):
+        self._remove(key)
+        while len(self._entries) >= self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+        if vector is not None:
+            vector = np.asarray(vector, dtype=np.float32)
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+            slot = self._free.pop()
+            self._vectors[slot] = vector / max(float(np.linalg.norm(vector)), 1e-12)
+            self._valid[slot] = True
+            self._slots[key] = slot
+            self._slot_keys[slot] = key
+        self._entries[key] = {"value": value, "created": created}
+
+    def stats(self):
+        with self._lock:
+            hits = self.metrics["exact_hits"] + self.metrics["semantic_hits"]
+            # Every question is looked up in the exact tier first; the semantic tier only sees its misses
+            lookups = self.metrics["exact_hits"] + self.metrics["exact_misses"]
+            return {
+                **self.metrics,
+                "misses": max(lookups - hits, 0),
+                "entries": len(self._entries),
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "index_version": self._version,
+            }
@@ -0,0 +1,189 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+from dotenv import load_dotenv
+from RAG.reranker import RERANK_ENABLED
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Components loaded at startup instead of on the first request, e.g. "embeddings,backend,llm" or "all"
+WARMUP = os.getenv("WARMUP", "")
+# Models loaded once in the pre-fork server process and shared copy-on-write by its workers (see gunicorn.conf.py);
+# the cross-encoder only by default when reranking is on
+PRELOAD = os.getenv("PRELOAD", "embeddings,reranker" if RERANK_ENABLED else "embeddings")
+# Seconds between checks of the index version; on a change the local and BM25 indexes reload in the background. 0 disables
+INDEX_WATCH_INTERVAL = float(os.getenv("INDEX_WATCH_INTERVAL", "2"))
+
+_watcher = None
+
+
+def _warm_embeddings():
+    from RAG.vector_db import embeddings
+
+    embeddings.embed_query("warm up")
+
+
+def _warm_backend():
+    from RAG.vector_db import get_backend
+
+    get_backend()
+
+
+def _warm_sparse():
+    from RAG.vector_db import get_sparse_index
+
+    get_sparse_index()
+
+
+def _warm_reranker():
+    from RAG.vector_db import reranker
+
+    reranker.model
+
+
+def _warm_llm():
+    from RAG.llm import get_chain
+
+    get_chain()
+
+
+def _warm_mongo():
+    from auth.db import get_async_client
+
+    get_async_client()
+
+
+WARMERS = {
+    "embeddings": _warm_embeddings,
+    "backend": _warm_backend,
+    "sparse": _warm_sparse,
+    "reranker": _warm_reranker,
+    "llm": _warm_llm,
+    "mongo": _warm_mongo,
+}
+
+
+def warmup_components(spec=None):
+    spec = WARMUP if spec is None else spec
+    names = [name.strip() for name in spec.split(",") if name.strip()]
+    if names == ["all"]:
+        return list(WARMERS)
+    unknown = set(names) - set(WARMERS)
+    if unknown:
+        raise ValueError(f"Unknown WARMUP components: {', '.join(sorted(unknown))}")
+    return names
+
+
+def warm_up(names):
+    """Construct the named singletons now; returns milliseconds spent per component."""
+    timings = {}
+    for name in names:
+        start = time.perf_counter()
+        WARMERS[name]()
+        timings[name] = (time.perf_counter() - start) * 1000
+        logger.info(f"Warmed up {name} in {timings[name]:.0f}ms")
+    return timings
+
+
+def _load_embedding_model():
+    from RAG.vector_db import embeddings
+
+    if embeddings.backend == "onnx":
+        # An ONNX Runtime session starts its thread pool when it is created, and a fork would not carry
+        # that over: export here so workers don't race to, and let each worker open its own session
+        try:
+            embeddings.onnx_export()
+            return
+        except ImportError:
+            pass
+    embeddings.model
+
+
+# Only the model weights: nothing here may open a connection or start a thread before the fork
+PRELOADERS = {
+    "embeddings": _load_embedding_model,
+    "reranker": _warm_reranker,
+}
+
+
+def preload(spec=None):
+    """Load models in the server process before it forks workers; returns milliseconds per model.
+
+    Workers then share the weights' memory pages copy-on-write instead of each
+    loading its own copy. No inference runs here, so no thread pool exists yet
+    when the process forks.
+    """
+    spec = PRELOAD if spec is None else spec
+    names = [name.strip() for name in spec.split(",") if name.strip()]
+    unknown = set(names) - set(PRELOADERS)
+    if unknown:
+        raise ValueError(f"Unknown PRELOAD components: {', '.join(sorted(unknown))}")
+    timings = {}
+    for name in names:
+        start = time.perf_counter()
+        PRELOADERS[name]()
+        timings[name] = (time.perf_counter() - start) * 1000
+        logger.info(f"Preloaded {name} in {timings[name]:.0f}ms")
+    return timings
+
+
+def after_fork():
+    """In a freshly forked worker: replace SQLite connections inherited from the server process."""
+    vector_db = sys.modules.get("RAG.vector_db")
+    if vector_db is not None:
+        vector_db.registry.reopen()
+
+
+async def watch_index(interval):
+    """Reload the indexes off the request path whenever another process bumps the index version."""
+    from RAG.vector_db import registry, refresh_indexes
+
+    version = await asyncio.to_thread(registry.index_version)
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            current = await asyncio.to_thread(registry.index_version)
+            if current != version:
+                start = time.perf_counter()
+                await asyncio.to_thread(refresh_indexes)
+                logger.info(f"Index version {version} -> {current}, reloaded in {(time.perf_counter() - start) * 1000:.0f}ms")
+                version = current
+        except Exception as e:
+            logger.warning(f"Index watch failed: {e}")
+
+
+async def startup():
+    """Lifespan start: everything is lazy by default, WARMUP opts components into eager loading."""
+    global _watcher
+    names = warmup_components()
+    if names:
+        await asyncio.to_thread(warm_up, names)
+    if INDEX_WATCH_INTERVAL > 0:
+        _watcher = asyncio.create_task(watch_index(INDEX_WATCH_INTERVAL))
+
+
+async def shutdown():
+    """Lifespan end: stop ingestion workers and release whichever clients were created."""
+    global _watcher
+    from RAG.jobs import shutdown as shutdown_jobs
+
+    if _watcher is not None:
+        _watcher.cancel()
+        _watcher = None
+
+    shutdown_jobs(wait=False)
+
+    # Only tear down modules that were actually imported
+    vector_db = sys.modules.get("RAG.vector_db")
+    if vector_db is not None:
+        vector_db.close_backend()
+        vector_db.embedding_executor.shutdown(wait=False)
+    db = sys.modules.get("auth.db")
+    if db is not None:
+        await db.close()
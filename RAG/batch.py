@@ -0,0 +1,177 @@
+import os
+import json
+import asyncio
+import logging
+from dotenv import load_dotenv
+from RAG.llm import allm_inference
+from RAG.vector_db import embed_queries_once, retrieve_docs, retrieve_many, RETRIEVAL_MODE
+from RAG.answer_cache import normalize_question
+from RAG.context import build_context, cited_pages
+from RAG import telemetry
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# LLM calls of one batch that may be in flight at once
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))
+# Questions embedded and searched together; the first answers start while later groups are retrieved
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "64"))
+# Most questions one /query/batch request may carry
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "256"))
+
+
+def error_detail(e):
+    # Same split as the single-question endpoints: ValueErrors are the caller's, anything else is ours
+    return str(e) if isinstance(e, ValueError) else "Internal server error."
+
+
+def cached_result(cached):
+    return {"response": cached["response"], "images": cached["images"], "pages": cited_pages(cached["sources"])}
+
+
+async def answer_batch(questions, cache=None, k=5, concurrency=BATCH_LLM_CONCURRENCY, chunk_size=BATCH_CHUNK_SIZE):
+    """Answer several questions, yielding one result dict per question as it completes.
+
+    Results are {"index", "question", "response", "images", "pages", "cached"}
+    or, for a question that failed, {"index", "question", "error"}; a failure
+    never affects the other questions. Questions that normalise the same way
+    are answered once. Cache misses are embedded in one forward pass, searched
+    with one batched vector search per group of `chunk_size`, and answered by
+    at most `concurrency` concurrent LLM calls; retrieved passage sets that
+    several questions share are packed into a context once.
+    """
+    queue = asyncio.Queue()
+    # normalised question -> indices of the questions asking it
+    groups = {}
+    for index, question in enumerate(questions):
+        question = (question or "").strip()
+        if not question:
+            queue.put_nowait({"index": index, "question": question, "error": "Question cannot be empty."})
+        else:
+            groups.setdefault(normalize_question(question), []).append((index, question))
+
+    answered = set()
+
+    def emit(key, result):
+        answered.add(key)
+        for index, question in groups[key]:
+            queue.put_nowait({"index": index, "question": question, **result})
+
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    contexts = {}
+    stats = {"questions": len(questions), "unique": len(groups), "cached": 0, "errors": 0, "contexts_shared": 0}
+
+    async def answer(key, question, vector, related_docs):
+        try:
+            # Identical retrieved passages give an identical context; pack it once
+            context_key = json.dumps(related_docs, sort_keys=True, default=str)
+            if context_key in contexts:
+                stats["contexts_shared"] += 1
+            else:
+                contexts[context_key] = build_context(related_docs)
+            full_context, figures = contexts[context_key]
+            async with semaphore:
+                response = await allm_inference(question, full_context)
+            if cache is not None:
+                await asyncio.to_thread(
+                    cache.put, question, vector, {"response": response.content, "images": figures, "sources": related_docs}
+                )
+            emit(key, {"response": response.content, "images": figures, "pages": cited_pages(related_docs), "cached": False})
+        except Exception as e:
+            logger.error(f"Batch question {question[:50]!r} failed: {e}")
+            stats["errors"] += 1
+            emit(key, {"error": error_detail(e)})
+
+    async def retrieve(questions, vectors):
+        try:
+            return await asyncio.to_thread(retrieve_many, questions, k, vectors=vectors)
+        except Exception as e:
+            # Retry one by one, so only the questions that actually fail are reported as failed
+            logger.warning(f"Batch retrieval of {len(questions)} questions failed ({e}), retrying individually")
+            results = []
+            for question in questions:
+                try:
+                    results.append(await asyncio.to_thread(retrieve_docs, question, k))
+                except Exception as item_error:
+                    results.append(item_error)
+            return results
+
+    tasks = []
+
+    async def produce():
+        pending = list(groups)
+        vectors = {}
+        if cache is not None:
+            pending = []
+            # Cache lookups read SQLite (index version, shared entries), so they run off the event loop
+            lookups = await asyncio.to_thread(lambda: [cache.get_exact(groups[key][0][1]) for key in groups])
+            for key, cached in zip(groups, lookups):
+                if cached is None:
+                    pending.append(key)
+                else:
+                    stats["cached"] += 1
+                    emit(key, {**cached_result(cached), "cached": True})
+        if pending and (cache is not None or RETRIEVAL_MODE != "sparse"):
+            # One forward pass for every question still to answer, reused by the semantic cache and the search
+            with telemetry.span("embed", queries=len(pending)):
+                embedded = await asyncio.to_thread(embed_queries_once, [groups[key][0][1] for key in pending])
+            vectors = dict(zip(pending, embedded))
+            if cache is not None:
+                misses = []
+                lookups = await asyncio.to_thread(lambda: [cache.get_semantic(vectors[key]) for key in pending])
+                for key, cached in zip(pending, lookups):
+                    if cached is None:
+                        misses.append(key)
+                    else:
+                        stats["cached"] += 1
+                        emit(key, {**cached_result(cached), "cached": True})
+                pending = misses
+
+        for start in range(0, len(pending), max(1, chunk_size)):
+            keys = pending[start:start + chunk_size]
+            batch = [groups[key][0][1] for key in keys]
+            batch_vectors = [vectors[key] for key in keys] if vectors else None
+            for key, question, related_docs in zip(keys, batch, await retrieve(batch, batch_vectors)):
+                if isinstance(related_docs, Exception):
+                    stats["errors"] += 1
+                    emit(key, {"error": error_detail(related_docs)})
+                else:
+                    tasks.append(asyncio.create_task(answer(key, question, vectors.get(key), related_docs)))
+        await asyncio.gather(*tasks)
+
+    async def run():
+        try:
+            await produce()
+        except Exception as e:
+            # Whatever broke the batch as a whole, every question still gets exactly one result
+            logger.error(f"Batch failed: {e}", exc_info=True)
+            for task in tasks:
+                task.cancel()
+            for key in groups:
+                if key not in answered:
+                    stats["errors"] += 1
+                    emit(key, {"error": error_detail(e)})
+
+    producer = asyncio.create_task(run())
+    try:
+        for _ in range(len(questions)):
+            yield await queue.get()
+        await producer
+        logger.info(f"Batch answered: {stats}")
+    finally:
+        # The client went away before the end: stop retrieving and cancel queued LLM calls
+        producer.cancel()
+        for task in tasks:
+            task.cancel()
+
+
+def answer_questions(questions, **kwargs):
+    """Blocking answer_batch: the results of all `questions`, in question order."""
+
+    async def collect():
+        return [result async for result in answer_batch(questions, **kwargs)]
+
+    return sorted(asyncio.run(collect()), key=lambda result: result["index"])
@@ -0,0 +1,227 @@
+import os
+import re
+import math
+import pickle
+import logging
+import threading
+from array import array
+import numpy as np
+from dotenv import load_dotenv
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+BM25_INDEX_PATH = os.getenv("BM25_INDEX_PATH", "./cache/bm25.pkl")
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+# Compact postings once this fraction of indexed chunks are deleted
+BM25_COMPACT_RATIO = float(os.getenv("BM25_COMPACT_RATIO", "0.25"))
+
+# Keeps identifiers such as "1706.03762", "3.2" or "multi-head" as single terms
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[.\-_][a-z0-9]+)*")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has in is it its of on or that the this to was were will with".split()
+)
+
+
+def tokenize(text):
+    return [token for token in TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """Incremental BM25 inverted index with array-backed postings.
+
+    Each term owns two parallel arrays, uint32 chunk numbers and uint16 term
+    frequencies, so a posting costs 6 bytes. Removed chunks are tombstoned and
+    dropped from the postings when the index is compacted.
+    """
+
+    def __init__(self, path=BM25_INDEX_PATH, k1=BM25_K1, b=BM25_B):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._mtime = None
+        self._reset()
+        self._load()
+
+    def _reset(self):
+        self.vocab = {}
+        self.postings_docs = []
+        self.postings_tfs = []
+        self.chunk_ids = []
+        self.chunk_nums = {}
+        self.doc_lengths = array("I")
+        self.deleted = set()
+        self.total_length = 0
+
+    @property
+    def live_count(self):
+        return len(self.chunk_ids) - len(self.deleted)
+
+    # ---------- persistence ----------
+
+    def _read(self):
+        """(state, mtime) of the saved index if it differs from the loaded one, else None."""
+        if not self.path or not os.path.exists(self.path):
+            return None
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime == self._mtime:
+            return None
+        with open(self.path, "rb") as f:
+            state = pickle.load(f)
+        state["chunk_nums"] = {chunk_id: i for i, chunk_id in enumerate(state["chunk_ids"])}
+        return state, mtime
+
+    def _load(self):
+        loaded = self._read()
+        if loaded is not None:
+            state, self._mtime = loaded
+            self.__dict__.update(state)
+
+    def refresh(self):
+        """Pick up an index another process saved, unpickling it without blocking searches."""
+        seen = self._mtime
+        loaded = self._read()
+        if loaded is None:
+            return False
+        with self._lock:
+            # A search may have loaded it (or a newer one) meanwhile
+            if self._mtime != seen:
+                return False
+            state, self._mtime = loaded
+            self.__dict__.update(state)
+        return True
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            state = {
+                "vocab": self.vocab,
+                "postings_docs": self.postings_docs,
+                "postings_tfs": self.postings_tfs,
+                "chunk_ids": self.chunk_ids,
+                "doc_lengths": self.doc_lengths,
+                "deleted": self.deleted,
+                "total_length": self.total_length,
+            }
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+            self._mtime = os.stat(self.path).st_mtime_ns
+
+    # ---------- writes ----------
+
+    def add(self, ids, texts):
+        with self._lock:
+            self._load()
+            for chunk_id, text in zip(ids, texts):
+                if chunk_id in self.chunk_nums and self.chunk_nums[chunk_id] not in self.deleted:
+                    continue
+                num = len(self.chunk_ids)
+                self.chunk_ids.append(chunk_id)
+                self.chunk_nums[chunk_id] = num
+
+                counts = {}
+                tokens = tokenize(text)
+                for token in tokens:
+                    counts[token] = counts.get(token, 0) + 1
+                for token, tf in counts.items():
+                    term_id = self.vocab.get(token)
+                    if term_id is None:
+                        term_id = self.vocab[token] = len(self.postings_docs)
+                        self.postings_docs.append(array("I"))
+                        self.postings_tfs.append(array("H"))
+                    self.postings_docs[term_id].append(num)
+                    self.postings_tfs[term_id].append(min(tf, 65535))
+                self.doc_lengths.append(len(tokens))
+                self.total_length += len(tokens)
+
+    def remove(self, ids):
+        with self._lock:
+            self._load()
+            for chunk_id in ids:
+                num = self.chunk_nums.get(chunk_id)
+                if num is not None and num not in self.deleted:
+                    self.deleted.add(num)
+                    self.total_length -= self.doc_lengths[num]
+            if self.deleted and len(self.deleted) > BM25_COMPACT_RATIO * len(self.chunk_ids):
+                self.compact()
+
+    def compact(self):
+        with self._lock:
+            remap = {}
+            chunk_ids = []
+            doc_lengths = array("I")
+            for num, chunk_id in enumerate(self.chunk_ids):
+                if num not in self.deleted:
+                    remap[num] = len(chunk_ids)
+                    chunk_ids.append(chunk_id)
+                    doc_lengths.append(self.doc_lengths[num])
+
+            vocab, postings_docs, postings_tfs = {}, [], []
+            for term, term_id in self.vocab.items():
+                docs, tfs = array("I"), array("H")
+                for num, tf in zip(self.postings_docs[term_id], self.postings_tfs[term_id]):
+                    if num in remap:
+                        docs.append(remap[num])
+                        tfs.append(tf)
+                if docs:
+                    vocab[term] = len(postings_docs)
+                    postings_docs.append(docs)
+                    postings_tfs.append(tfs)
+
+            logger.info(f"Compacted BM25 index: dropped {len(self.deleted)} chunks, {len(self.vocab) - len(vocab)} terms")
+            self.vocab, self.postings_docs, self.postings_tfs = vocab, postings_docs, postings_tfs
+            self.chunk_ids, self.doc_lengths, self.deleted = chunk_ids, doc_lengths, set()
+            self.chunk_nums = {chunk_id: i for i, chunk_id in enumerate(chunk_ids)}
+
+    # ---------- reads ----------
+
+    def search(self, query, k):
+        """Return up to k (chunk_id, score) pairs, best first."""
+        with self._lock:
+            self._load()
+            live = self.live_count
+            if not live:
+                return []
+            avgdl = max(self.total_length / live, 1e-9)
+            lengths = np.frombuffer(self.doc_lengths, dtype=np.uint32)
+            scores = np.zeros(len(self.chunk_ids), dtype=np.float32)
+
+            for term in set(tokenize(query)):
+                term_id = self.vocab.get(term)
+                if term_id is None:
+                    continue
+                docs = np.frombuffer(self.postings_docs[term_id], dtype=np.uint32)
+                tfs = np.frombuffer(self.postings_tfs[term_id], dtype=np.uint16).astype(np.float32)
+                df = len(docs)
+                idf = math.log(1 + (live - df + 0.5) / (df + 0.5))
+                norm = self.k1 * (1 - self.b + self.b * lengths[docs] / avgdl)
+                scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + norm)
+
+            if self.deleted:
+                scores[list(self.deleted)] = 0
+            candidates = np.flatnonzero(scores > 0)
+            if not len(candidates):
+                return []
+            top = candidates[np.argsort(-scores[candidates])[:k]]
+            return [(self.chunk_ids[num], float(scores[num])) for num in top]
+
+    def stats(self):
+        with self._lock:
+            postings = sum(len(docs) for docs in self.postings_docs)
+            return {
+                "chunks": self.live_count,
+                "terms": len(self.vocab),
+                "postings": postings,
+                "postings_bytes": postings * 6,
+                "tombstones": len(self.deleted),
+            }
@@ -0,0 +1,135 @@
+import os
+import random
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Captioning limits (Groq vision endpoint)
+CAPTION_CONCURRENCY = int(os.getenv("CAPTION_CONCURRENCY", "8"))
+CAPTION_RATE_PER_SEC = float(os.getenv("CAPTION_RATE_PER_SEC", "4"))
+CAPTION_BURST = int(os.getenv("CAPTION_BURST", "4"))
+CAPTION_MAX_RETRIES = int(os.getenv("CAPTION_MAX_RETRIES", "4"))
+CAPTION_BACKOFF_BASE = float(os.getenv("CAPTION_BACKOFF_BASE", "1.0"))
+CAPTION_BACKOFF_MAX = float(os.getenv("CAPTION_BACKOFF_MAX", "30.0"))
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, bursts up to `capacity`."""
+
+    def __init__(self, rate, capacity=1):
+        if rate <= 0:
+            raise ValueError("Token bucket rate must be positive.")
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def _status_code(exc):
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status
+
+
+def is_retryable(exc):
+    status = _status_code(exc)
+    if status is not None:
+        return status == 429 or 500 <= status < 600
+    # Connection resets and timeouts carry no status code
+    return isinstance(exc, (ConnectionError, TimeoutError)) or type(exc).__name__ in (
+        "APIConnectionError",
+        "APITimeoutError",
+    )
+
+
+def _retry_after(exc):
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def call_with_retry(fn, *args, limiter=None, max_retries=CAPTION_MAX_RETRIES, backoff_base=CAPTION_BACKOFF_BASE):
+    for attempt in range(max_retries + 1):
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            return fn(*args)
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+            delay = _retry_after(e)
+            if delay is None:
+                # Exponential backoff with jitter
+                delay = backoff_base * (2 ** attempt) * (0.5 + random.random() / 2)
+            delay = min(delay, CAPTION_BACKOFF_MAX)
+            logger.warning(f"Retryable captioning error (status={_status_code(e)}), retrying in {delay:.2f}s: {e}")
+            time.sleep(delay)
+
+
+def caption_images(
+    paths,
+    caption_fn,
+    fallback=None,
+    concurrency=CAPTION_CONCURRENCY,
+    rate=CAPTION_RATE_PER_SEC,
+    burst=CAPTION_BURST,
+    max_retries=CAPTION_MAX_RETRIES,
+    backoff_base=CAPTION_BACKOFF_BASE,
+):
+    """Caption `paths` concurrently; results are returned in the same order as `paths`."""
+    paths = list(paths)
+    if not paths:
+        return []
+
+    limiter = TokenBucket(rate, burst) if rate else None
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="caption") as pool:
+        futures = [
+            pool.submit(
+                call_with_retry,
+                caption_fn,
+                path,
+                limiter=limiter,
+                max_retries=max_retries,
+                backoff_base=backoff_base,
+            )
+            for path in paths
+        ]
+
+        results = []
+        for path, future in zip(paths, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                logger.error(f"Error captioning image {path}: {e}")
+                if fallback is None:
+                    raise
+                results.append(fallback(path))
+
+    logger.info(f"Captioned {len(paths)} images in {time.perf_counter() - start:.2f}s (concurrency={concurrency})")
+    return results
@@ -0,0 +1,150 @@
+import os
+import re
+import logging
+from dotenv import load_dotenv
+from RAG.figure_store import figure_refs
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Prompt budget for retrieved context, in (estimated) LLM tokens
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "1500"))
+# Passages whose word-shingle Jaccard similarity with a kept passage reaches this are dropped
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.8"))
+# The Groq tokenizer isn't available locally; ~4 characters per token holds for English prose
+CHARS_PER_TOKEN = float(os.getenv("CHARS_PER_TOKEN", "4"))
+
+WORD_RE = re.compile(r"\w+")
+# Shortest text overlap worth merging when chunks carry no char offsets
+MIN_TEXT_OVERLAP = 50
+
+
+def estimate_tokens(text):
+    return max(1, int(len(text) / CHARS_PER_TOKEN))
+
+
+def truncate_tokens(text, max_tokens):
+    """`text` cut to about `max_tokens` tokens, at a word boundary where there is one."""
+    limit = int(max_tokens * CHARS_PER_TOKEN)
+    if len(text) <= limit:
+        return text
+    cut = text[:limit]
+    return cut[:cut.rfind(" ")] if " " in cut else cut
+
+
+def shingles(text, size=5):
+    words = WORD_RE.findall(text.lower())
+    if len(words) < size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+def text_overlap(a, b):
+    """Length of the longest suffix of `a` that is a prefix of `b` (at least MIN_TEXT_OVERLAP chars)."""
+    for size in range(min(len(a), len(b)), MIN_TEXT_OVERLAP - 1, -1):
+        if a.endswith(b[:size]):
+            return size
+    return 0
+
+
+def merge_adjacent(passages, max_tokens=None):
+    """Merge text passages of the same document that overlap or touch.
+
+    Uses the chunks' page-relative char offsets when one starts on the page the
+    other ends on, otherwise a literal suffix/prefix overlap. A merged passage
+    keeps the best (lowest) rank of its parts, and never grows past
+    `max_tokens`: the next part then starts a new passage.
+    """
+    by_doc = {}
+    for passage in passages:
+        by_doc.setdefault(passage.get("doc_id"), []).append(passage)
+
+    def last_page(passage):
+        return passage.get("page_end") or passage.get("page_number")
+
+    def fits(text):
+        return max_tokens is None or estimate_tokens(text) <= max_tokens
+
+    merged = []
+    for doc_passages in by_doc.values():
+        doc_passages.sort(
+            key=lambda p: (p.get("page_number") or 0, p.get("start_index") is None, p.get("start_index") or 0)
+        )
+        current = None
+        for passage in doc_passages:
+            if current is not None:
+                start, end = passage.get("start_index"), current.get("end_index")
+                if passage.get("page_number") != last_page(current):
+                    start = end = None
+                if start is not None and end is not None and start <= end + 2:
+                    # Offsets index the "\n\n"-joined text of the page
+                    skip = end - start
+                    tail = passage["content"][skip:] if skip >= 0 else "\n\n" + passage["content"]
+                    if fits(current["content"] + tail):
+                        current["content"] += tail
+                        if last_page(passage) == last_page(current):
+                            current["end_index"] = max(end, passage.get("end_index") or end)
+                        else:
+                            current["end_index"], current["page_end"] = passage.get("end_index"), last_page(passage)
+                        current["rank"] = min(current["rank"], passage["rank"])
+                        continue
+                overlap = text_overlap(current["content"], passage["content"]) if start is None or end is None else 0
+                if overlap and fits(current["content"] + passage["content"][overlap:]):
+                    current["content"] += passage["content"][overlap:]
+                    current["end_index"], current["page_end"] = passage.get("end_index"), last_page(passage)
+                    current["rank"] = min(current["rank"], passage["rank"])
+                    continue
+                merged.append(current)
+            current = dict(passage)
+        if current is not None:
+            merged.append(current)
+    return merged
+
+
+def pack_context(related_docs, max_tokens=None, threshold=None):
+    """Select and order passages for the prompt: merge overlaps, drop near-duplicates, fit the budget."""
+    max_tokens = CONTEXT_MAX_TOKENS if max_tokens is None else max_tokens
+    threshold = NEAR_DUPLICATE_THRESHOLD if threshold is None else threshold
+
+    passages = [{**doc, "rank": rank} for rank, doc in enumerate(related_docs) if doc.get("content")]
+    texts = merge_adjacent([p for p in passages if p.get("type") != "image"], max_tokens)
+    captions = [p for p in passages if p.get("type") == "image"]
+
+    packed, kept_shingles, used = [], [], 0
+    for passage in sorted(texts + captions, key=lambda p: p["rank"]):
+        passage_shingles = shingles(passage["content"])
+        if any(jaccard(passage_shingles, kept) >= threshold for kept in kept_shingles):
+            continue
+        tokens = estimate_tokens(passage["content"])
+        if used + tokens > max_tokens:
+            if packed:
+                # Keep trying: a shorter, less relevant passage may still fit
+                continue
+            # The top-ranked passage alone exceeds the budget: keep as much of it as fits
+            passage = {**passage, "content": truncate_tokens(passage["content"], max_tokens)}
+            tokens = estimate_tokens(passage["content"])
+        packed.append(passage)
+        kept_shingles.append(passage_shingles)
+        used += tokens
+
+    before = sum(estimate_tokens(doc["content"]) for doc in related_docs if doc.get("content"))
+    logger.info(f"Packed context: {len(related_docs)} passages -> {len(packed)}, ~{before} -> ~{used} tokens")
+    return packed
+
+
+def build_context(related_docs, max_tokens=None):
+    """Return (context string for the LLM, ids and URLs of the retrieved figures)."""
+    packed = pack_context(related_docs, max_tokens)
+    full_context = "\n\n".join(passage["content"] for passage in packed)
+    return full_context, figure_refs(related_docs)
+
+
+def cited_pages(related_docs):
+    return sorted({doc["page_number"] for doc in related_docs if doc.get("page_number") is not None})
@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import hashlib
+import logging
+import threading
+from dotenv import load_dotenv
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+DOC_REGISTRY_PATH = os.getenv("DOC_REGISTRY_PATH", "./cache/documents.sqlite")
+
+# Fixed namespace so document and chunk ids are stable across processes and restarts
+ID_NAMESPACE = uuid.UUID("6f1c2d9a-8b7e-4c1a-9f3e-2a5d7c4b1e80")
+
+
+def make_doc_id(filename):
+    return uuid.uuid5(ID_NAMESPACE, f"doc:{filename}").hex[:16]
+
+
+def file_hash(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_hash(doc):
+    digest = hashlib.sha256(doc.page_content.encode("utf-8"))
+    digest.update(json.dumps(doc.metadata, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def chunk_ids(doc_id, docs, seen=None):
+    """Deterministic chunk UUIDs from (doc id, chunk content hash, occurrence).
+
+    Keying on content rather than position keeps unchanged chunks on the same id
+    when an edit elsewhere in the document shifts chunk indexes. Pass the same
+    `seen` dict across calls when a document's chunks arrive in batches.
+    """
+    seen = {} if seen is None else seen
+    ids = []
+    for doc in docs:
+        content = chunk_hash(doc)
+        occurrence = seen.get(content, 0)
+        seen[content] = occurrence + 1
+        ids.append(str(uuid.uuid5(ID_NAMESPACE, f"{doc_id}:{content}:{occurrence}")))
+    return ids
+
+
+class DocumentRegistry:
+    """SQLite registry of indexed documents and the chunk ids stored for each.
+
+    `index_version()` increases on every save or delete, so caches of query
+    results can tell when the indexed corpus changed (also from other processes).
+    It also records the embedding model (and dimension) the chunks were
+    embedded with, so a process that loaded another model can refuse to use them.
+    """
+
+    def __init__(self, path=DOC_REGISTRY_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                "doc_id TEXT PRIMARY KEY, filename TEXT NOT NULL, content_hash TEXT NOT NULL, "
+                "chunk_count INTEGER NOT NULL, created REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                "chunk_id TEXT PRIMARY KEY, doc_id TEXT NOT NULL, chunk_index INTEGER NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_doc_id ON chunks (doc_id)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            self._conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('index_version', 0)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embedding_model ("
+                "id INTEGER PRIMARY KEY CHECK (id = 0), model TEXT NOT NULL, dim INTEGER NOT NULL)"
+            )
+
+    def reopen(self):
+        """Replace the connection, e.g. in a worker forked from the process that opened it."""
+        with self._lock:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+
+    def _bump_version(self):
+        self._conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'index_version'")
+
+    def index_version(self):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'index_version'").fetchone()
+        return row[0] if row else 0
+
+    def embedding_model(self):
+        """(model, dimension) the indexed chunks were embedded with; None while no document is indexed."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT model, dim FROM embedding_model WHERE EXISTS (SELECT 1 FROM documents)"
+            ).fetchone()
+
+    def claim_embedding_model(self, model, dim):
+        """Record `model` as the index's embedding model unless documents embedded with another one exist.
+
+        Returns the recorded (model, dimension), which differs from the arguments in that case.
+        """
+        with self._lock, self._conn:
+            if self._conn.execute("SELECT 1 FROM documents LIMIT 1").fetchone() is None:
+                # Nothing indexed yet (or any more), so any model may claim the index
+                self._conn.execute("INSERT OR REPLACE INTO embedding_model (id, model, dim) VALUES (0, ?, ?)", (model, dim))
+            else:
+                # Indexes from before the model was recorded are assumed to match the first claim
+                self._conn.execute("INSERT OR IGNORE INTO embedding_model (id, model, dim) VALUES (0, ?, ?)", (model, dim))
+            return self._conn.execute("SELECT model, dim FROM embedding_model").fetchone()
+
+    def get(self, doc_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT doc_id, filename, content_hash, chunk_count, created, updated FROM documents WHERE doc_id = ?",
+                (doc_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(["doc_id", "filename", "content_hash", "chunk_count", "created", "updated"], row))
+
+    def list(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT doc_id, filename, content_hash, chunk_count, created, updated FROM documents ORDER BY created"
+            ).fetchall()
+        return [dict(zip(["doc_id", "filename", "content_hash", "chunk_count", "created", "updated"], row)) for row in rows]
+
+    def is_current(self, doc_id, content_hash):
+        doc = self.get(doc_id)
+        return doc is not None and doc["content_hash"] == content_hash
+
+    def chunk_ids(self, doc_id):
+        with self._lock:
+            rows = self._conn.execute("SELECT chunk_id FROM chunks WHERE doc_id = ?", (doc_id,)).fetchall()
+        return {row[0] for row in rows}
+
+    def save(self, doc_id, filename, content_hash, ids):
+        now = time.time()
+        with self._lock, self._conn:
+            existing = self._conn.execute("SELECT created FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO documents (doc_id, filename, content_hash, chunk_count, created, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (doc_id, filename, content_hash, len(ids), existing[0] if existing else now, now),
+            )
+            self._conn.execute("DELETE FROM chunks WHERE doc_id = ?", (doc_id,))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks (chunk_id, doc_id, chunk_index) VALUES (?, ?, ?)",
+                [(chunk_id, doc_id, i) for i, chunk_id in enumerate(ids)],
+            )
+            self._bump_version()
+
+    def delete(self, doc_id):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM chunks WHERE doc_id = ?", (doc_id,))
+            deleted = self._conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,)).rowcount
+            if deleted:
+                self._bump_version()
+        return deleted > 0
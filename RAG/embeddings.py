@@ -0,0 +1,419 @@
+import os
+import re
+import copy
+import time
+import shutil
+import platform
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from dotenv import load_dotenv
+from RAG.mmap_matrix import MmapMatrix
+from RAG.file_lock import FileLock
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-mpnet-base-v2")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "./cache/embeddings")
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+# Inference runtime: "torch" (sentence-transformers on PyTorch) or "onnx" (ONNX Runtime)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+# Weights of the ONNX model: "int8" (dynamic quantization) or "fp32"
+EMBEDDING_QUANTIZATION = os.getenv("EMBEDDING_QUANTIZATION", "int8")
+# CPU the int8 kernels are tuned for: arm64 | avx2 | avx512 | avx512_vnni, or "auto" to detect it
+ONNX_QUANTIZATION_TARGET = os.getenv("ONNX_QUANTIZATION_TARGET", "auto")
+# Exported (and quantized) ONNX models, one directory per model
+ONNX_EXPORT_DIR = os.getenv("ONNX_EXPORT_DIR", "./cache/onnx")
+# Threads one forward pass may use; 0 leaves the runtime default (one per core)
+EMBEDDING_INTRA_OP_THREADS = int(os.getenv("EMBEDDING_INTRA_OP_THREADS", "0"))
+# Loaded instead when EMBEDDING_MODEL cannot be; an index built with another model refuses it
+EMBEDDING_FALLBACK_MODEL = os.getenv("EMBEDDING_FALLBACK_MODEL", "")
+
+
+def text_key(text, model_name):
+    return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+
+def model_slug(model_name):
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name)
+
+
+def quantization_target():
+    """ONNX_QUANTIZATION_TARGET, or the best int8 instruction set this CPU has when it is "auto"."""
+    if ONNX_QUANTIZATION_TARGET != "auto":
+        return ONNX_QUANTIZATION_TARGET
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        return "arm64"
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = set(f.read().split())
+    except OSError:
+        flags = set()
+    if "avx512_vnni" in flags:
+        return "avx512_vnni"
+    if "avx512f" in flags:
+        return "avx512"
+    return "avx2"
+
+
+class VectorCache:
+    """On-disk float32 vector cache: a SQLite key -> row index over a memory-mapped matrix.
+
+    Writers allocate rows and grow the matrix inside one SQLite write transaction,
+    so the ingestion workers and the API process can share the same files.
+    """
+
+    def __init__(self, directory, model_name, dim):
+        os.makedirs(directory, exist_ok=True)
+        slug = model_slug(model_name)
+        self.dim = dim
+        self.matrix = MmapMatrix(os.path.join(directory, f"{slug}.f32"), dim, np.float32)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(directory, f"{slug}.sqlite"), check_same_thread=False, timeout=30)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS vectors (key TEXT PRIMARY KEY, row INTEGER NOT NULL)")
+
+    def _rows(self, keys):
+        found = {}
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            found.update(self._conn.execute(
+                f"SELECT key, row FROM vectors WHERE key IN ({placeholders})", batch
+            ).fetchall())
+        return found
+
+    def get_many(self, keys):
+        if not keys:
+            return {}
+        with self._lock:
+            rows = self._rows(keys)
+            if not rows:
+                return {}
+            vectors = self.matrix.read(list(rows.values()))
+        return dict(zip(rows, vectors))
+
+    def put_many(self, keys, vectors):
+        if not keys:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                existing = set(self._rows(keys))
+                (next_row,) = self._conn.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM vectors").fetchone()
+                entries = []
+                for key, vector in zip(keys, vectors):
+                    if key in existing:
+                        continue
+                    existing.add(key)
+                    entries.append((key, next_row, vector))
+                    next_row += 1
+                if entries:
+                    self.matrix.write([row for _, row, _ in entries], [vector for _, _, vector in entries])
+                    self._conn.executemany(
+                        "INSERT OR IGNORE INTO vectors (key, row) VALUES (?, ?)", [(key, row) for key, row, _ in entries]
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def __len__(self):
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM vectors").fetchone()
+        return count
+
+
+class EmbeddingService(Embeddings):
+    """Batched sentence-transformers embeddings with a persistent vector cache and a query LRU.
+
+    With `backend="onnx"` the model is exported to ONNX once (into
+    `onnx_dir`), dynamically quantized to int8 unless `quantization` is
+    "fp32", and run by ONNX Runtime; without optimum/onnxruntime it falls back
+    to PyTorch. Cached vectors are keyed by the model and variant that
+    produced them (`cache_name`), so switching variants never mixes vectors.
+    """
+
+    def __init__(
+        self,
+        model_name=EMBEDDING_MODEL,
+        batch_size=EMBEDDING_BATCH_SIZE,
+        cache_dir=EMBEDDING_CACHE_DIR,
+        query_cache_size=QUERY_CACHE_SIZE,
+        backend=EMBEDDING_BACKEND,
+        quantization=EMBEDDING_QUANTIZATION,
+        onnx_dir=ONNX_EXPORT_DIR,
+        intra_op_threads=EMBEDDING_INTRA_OP_THREADS,
+        fallback_model=EMBEDDING_FALLBACK_MODEL,
+    ):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.cache_dir = cache_dir
+        self.query_cache_size = query_cache_size
+        self.backend = backend
+        self.quantization = quantization
+        self.onnx_dir = onnx_dir
+        self.intra_op_threads = intra_op_threads
+        self.fallback_model = fallback_model
+        # Set by the loader to the model actually loaded, and that plus its variant
+        self._loaded_model = model_name
+        self._cache_name = model_name
+        self._model = None
+        self._cache = None
+        self._queries = OrderedDict()
+        self._lock = threading.RLock()
+        # A fast tokenizer raises "Already borrowed" when two threads use it with different
+        # truncation/padding settings, so the model's own tokenizer is used under this lock only
+        self._encode_lock = threading.Lock()
+        self.metrics = {
+            "texts_encoded": 0,
+            "batches": 0,
+            "encode_seconds": 0.0,
+            "cache_hits": 0,
+            "cache_misses": 0,
+            "query_cache_hits": 0,
+            "query_cache_misses": 0,
+        }
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = self._load_model()
+        return self._model
+
+    @property
+    def loaded_model(self):
+        """The model actually loaded: model_name, or fallback_model if model_name could not be."""
+        self.model
+        return self._loaded_model
+
+    @property
+    def cache_name(self):
+        """Model name cached vectors are keyed by, plus the variant if it changes the vectors."""
+        self.model
+        return self._cache_name
+
+    def _load_model(self):
+        names = [self.model_name] + ([self.fallback_model] if self.fallback_model not in ("", self.model_name) else [])
+        for name in names:
+            try:
+                model, variant = self._load(name)
+            except Exception as e:
+                if name == names[-1]:
+                    raise
+                logger.warning(f"Could not load embedding model {name} ({e}), falling back to {names[-1]}")
+                continue
+            self._loaded_model = name
+            self._cache_name = name + variant
+            logger.info(f"Loaded embedding model {self._cache_name}")
+            return model
+
+    def _load(self, name):
+        """Return (model, cache-key suffix of the variant) for model `name`."""
+        if self.backend == "onnx":
+            try:
+                return self._load_onnx(name)
+            except ImportError as e:
+                logger.warning(f"ONNX Runtime is unavailable ({e}), running {name} on PyTorch")
+        from sentence_transformers import SentenceTransformer
+
+        if self.intra_op_threads:
+            import torch
+
+            torch.set_num_threads(self.intra_op_threads)
+        return SentenceTransformer(name, device="cpu"), ""
+
+    def onnx_export(self, name=None):
+        """Export (and quantize) model `name` for ONNX Runtime unless done already; returns (directory, file, int8 target)."""
+        name = name or self.model_name
+        target = quantization_target() if self.quantization == "int8" else None
+        directory = os.path.join(self.onnx_dir, model_slug(name))
+        file_name = f"onnx/model_int8_{target}.onnx" if target else "onnx/model.onnx"
+        if not os.path.exists(os.path.join(directory, file_name)):
+            # API workers and ingestion processes may all load the model at once; one of them exports
+            with FileLock(f"{directory}.lock", purpose=f"export {name}"):
+                if not os.path.exists(os.path.join(directory, file_name)):
+                    self._export_onnx(name, directory, target)
+        return directory, file_name, target
+
+    def _load_onnx(self, name):
+        import onnxruntime
+        from sentence_transformers import SentenceTransformer
+
+        directory, file_name, target = self.onnx_export(name)
+        options = onnxruntime.SessionOptions()
+        if self.intra_op_threads:
+            options.intra_op_num_threads = self.intra_op_threads
+        model = SentenceTransformer(
+            directory,
+            backend="onnx",
+            device="cpu",
+            model_kwargs={"file_name": file_name, "provider": "CPUExecutionProvider", "session_options": options},
+        )
+        # fp32 ONNX reproduces the PyTorch vectors, so the two share cached vectors
+        return model, f"@onnx-int8-{target}" if target else ""
+
+    @staticmethod
+    def _export_onnx(name, directory, target):
+        from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+        start = time.perf_counter()
+        # Loading with backend="onnx" exports the model unless its repository already ships ONNX weights
+        exported = SentenceTransformer(name, backend="onnx", device="cpu")
+        tmp = f"{directory}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        try:
+            exported.save(tmp)
+            if target:
+                export_dynamic_quantized_onnx_model(exported, target, tmp, file_suffix=f"int8_{target}")
+            if not os.path.exists(directory):
+                os.replace(tmp, directory)
+            else:
+                # The fp32 export exists already; add the quantized file to it
+                os.makedirs(os.path.join(directory, "onnx"), exist_ok=True)
+                for file_name in os.listdir(os.path.join(tmp, "onnx")):
+                    if not os.path.exists(os.path.join(directory, "onnx", file_name)):
+                        os.replace(os.path.join(tmp, "onnx", file_name), os.path.join(directory, "onnx", file_name))
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        logger.info(f"Exported {name} to ONNX{f' (int8, {target})' if target else ''} in {time.perf_counter() - start:.1f}s")
+
+    @property
+    def dimension(self):
+        return self.model.get_sentence_embedding_dimension()
+
+    @property
+    def max_tokens(self):
+        """Tokens of text that fit in one input window, excluding special tokens."""
+        return self.model.max_seq_length - 2
+
+    def copy_tokenizer(self):
+        """A private copy of the model's tokenizer, for counting and splitting text on another thread than encode."""
+        return copy.deepcopy(self.model.tokenizer)
+
+    def count_tokens(self, texts, tokenizer=None):
+        if tokenizer is None:
+            with self._encode_lock:
+                return self.count_tokens(texts, self.model.tokenizer)
+        return [len(ids) for ids in tokenizer(list(texts), add_special_tokens=False)["input_ids"]]
+
+    @property
+    def cache(self):
+        if self._cache is None and self.cache_dir:
+            with self._lock:
+                if self._cache is None:
+                    self._cache = VectorCache(self.cache_dir, self.cache_name, self.dimension)
+        return self._cache
+
+    def _length_buckets(self, texts):
+        # Sort by token length so each batch pads to a similar length
+        tokenizer = self.model.tokenizer
+        lengths = [
+            len(ids) for ids in tokenizer(
+                texts, add_special_tokens=True, truncation=True, max_length=self.model.max_seq_length
+            )["input_ids"]
+        ]
+        order = sorted(range(len(texts)), key=lambda i: lengths[i])
+        return [order[i:i + self.batch_size] for i in range(0, len(order), self.batch_size)]
+
+    def _encode(self, texts):
+        vectors = np.empty((len(texts), self.dimension), dtype=np.float32)
+        start = time.perf_counter()
+        # One forward pass at a time: it tokenizes with the shared tokenizer, and already uses every core
+        with self._encode_lock:
+            for batch in self._length_buckets(texts):
+                vectors[batch] = self.model.encode(
+                    [texts[i] for i in batch],
+                    batch_size=len(batch),
+                    convert_to_numpy=True,
+                    show_progress_bar=False,
+                )
+                self.metrics["batches"] += 1
+        self.metrics["encode_seconds"] += time.perf_counter() - start
+        self.metrics["texts_encoded"] += len(texts)
+        return vectors
+
+    def embed_array(self, texts):
+        """Embed `texts` as a float32 matrix, encoding only texts missing from the cache."""
+        if not texts:
+            return np.empty((0, self.dimension), dtype=np.float32)
+
+        keys = [text_key(text, self.cache_name) for text in texts]
+        cached = self.cache.get_many(list(set(keys))) if self.cache is not None else {}
+        self.metrics["cache_hits"] += sum(1 for key in keys if key in cached)
+
+        # Encode each distinct missing text once
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                missing.setdefault(key, text)
+        self.metrics["cache_misses"] += len(missing)
+
+        if missing:
+            fresh = self._encode(list(missing.values()))
+            if self.cache is not None:
+                self.cache.put_many(list(missing), fresh)
+            cached.update(zip(missing, fresh))
+
+        return np.stack([cached[key] for key in keys])
+
+    def embed_documents(self, texts):
+        return self.embed_array(list(texts)).tolist()
+
+    def cached_query(self, text):
+        """The query's vector from the LRU, or None (counted as a miss)."""
+        # Called on the event loop: never load the model here (the LRU is empty until it is loaded anyway)
+        key = text_key(text, self._cache_name)
+        with self._lock:
+            if key in self._queries:
+                self._queries.move_to_end(key)
+                self.metrics["query_cache_hits"] += 1
+                return self._queries[key]
+            self.metrics["query_cache_misses"] += 1
+        return None
+
+    def embed_queries(self, texts):
+        """Embed several queries in one forward pass and remember them in the query LRU.
+
+        Query vectors are kept in this process only: user questions never enter
+        the on-disk vector cache, which has no eviction and is meant for chunks.
+        """
+        texts = list(texts)
+        # Encode each distinct question once
+        unique = list(dict.fromkeys(texts))
+        encoded = dict(zip(unique, self._encode(unique).tolist())) if unique else {}
+        vectors = [encoded[text] for text in texts]
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                self._queries[text_key(text, self.cache_name)] = vector
+            while len(self._queries) > self.query_cache_size:
+                self._queries.popitem(last=False)
+        return vectors
+
+    def embed_query(self, text):
+        vector = self.cached_query(text)
+        if vector is None:
+            vector = self.embed_queries([text])[0]
+        return vector
+
+    def stats(self):
+        seconds = self.metrics["encode_seconds"]
+        return {
+            **self.metrics,
+            "texts_per_sec": self.metrics["texts_encoded"] / seconds if seconds else 0.0,
+            "query_cache_entries": len(self._queries),
+            # Not self.cache: opening it loads the model, which a stats read must never do
+            "vector_cache_entries": len(self._cache) if self._cache is not None else 0,
+        }
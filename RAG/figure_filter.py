@@ -0,0 +1,127 @@
+import os
+import re
+import html
+import logging
+import numpy as np
+from dotenv import load_dotenv
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Figures whose shorter side or area is below these are glyph crops, bullets or rules, not figures
+FIGURE_MIN_SIDE = int(os.getenv("FIGURE_MIN_SIDE", "48"))
+FIGURE_MIN_AREA = int(os.getenv("FIGURE_MIN_AREA", "6400"))
+# Shannon entropy (bits, 16 grey levels) below which a figure is a blank or flat region
+FIGURE_MIN_ENTROPY = float(os.getenv("FIGURE_MIN_ENTROPY", "0.5"))
+# Figures whose 64-bit difference hashes are at most this many bits apart share a caption; -1 disables
+FIGURE_HASH_DISTANCE = int(os.getenv("FIGURE_HASH_DISTANCE", "4"))
+# Tables with at least this much extracted text are described by that text instead of the vision model; 0 disables
+TABLE_TEXT_MIN_CHARS = int(os.getenv("TABLE_TEXT_MIN_CHARS", "20"))
+
+# Why a figure did not need its own vision call
+RULES = ("small", "low_entropy", "near_duplicate", "table_text")
+# Figures dropped outright, as opposed to ones described some other way
+DROP_RULES = ("small", "low_entropy")
+
+TAG_RE = re.compile(r"<[^>]+>")
+SPACE_RE = re.compile(r"\s+")
+
+
+def image_features(path):
+    """Return (width, height, grey-level entropy in bits, 64-bit difference hash) of an image file."""
+    from PIL import Image
+
+    with Image.open(path) as image:
+        width, height = image.size
+        # Let the JPEG decoder downscale while decoding; both features only need a small image
+        image.draft("L", (64, 64))
+        grey = image.convert("L")
+        levels = np.asarray(grey.resize((64, 64))) // 16
+        counts = np.bincount(levels.ravel(), minlength=16)
+        p = counts[counts > 0] / counts.sum()
+        entropy = float(-(p * np.log2(p)).sum())
+        # dHash: is each pixel brighter than its right neighbour, on a 9x8 thumbnail
+        pixels = np.asarray(grey.resize((9, 8), Image.Resampling.LANCZOS), dtype=np.int16)
+        bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+        dhash = int.from_bytes(np.packbits(bits).tobytes(), "big")
+    return width, height, entropy, dhash
+
+
+def table_text(element):
+    """Plain text unstructured already extracted for a Table element ("" if none)."""
+    text = element.text or ""
+    if not text.strip() and getattr(element.metadata, "text_as_html", None):
+        text = html.unescape(TAG_RE.sub(" ", element.metadata.text_as_html))
+    return SPACE_RE.sub(" ", text).strip()
+
+
+class FigureFilter:
+    """Decides which of a document's figures need a vision call.
+
+    Checks run cheapest first: tables unstructured already extracted text for
+    are described by that text; figures that are too small or nearly uniform
+    are dropped; and a figure whose perceptual hash is within
+    `hash_distance` bits of an earlier figure of the same document reuses that
+    figure's caption. One instance is used per document, so `saved` counts the
+    vision calls each rule avoided for it.
+    """
+
+    def __init__(
+        self,
+        min_side=FIGURE_MIN_SIDE,
+        min_area=FIGURE_MIN_AREA,
+        min_entropy=FIGURE_MIN_ENTROPY,
+        hash_distance=FIGURE_HASH_DISTANCE,
+        table_min_chars=TABLE_TEXT_MIN_CHARS,
+    ):
+        self.min_side = min_side
+        self.min_area = min_area
+        self.min_entropy = min_entropy
+        self.hash_distance = hash_distance
+        self.table_min_chars = table_min_chars
+        self.seen = 0
+        self.saved = dict.fromkeys(RULES, 0)
+        # (dhash, key) of the figures that go to the vision model
+        self._hashes = []
+        # key -> caption of those figures, once captioned
+        self.captions = {}
+
+    def check(self, element, key):
+        """Return (rule, detail) for a figure element: (None, None) if it needs a vision call.
+
+        detail is the table text for "table_text" and the key of the earlier
+        figure to share a caption with for "near_duplicate".
+        """
+        self.seen += 1
+        if self.table_min_chars and element.category == "Table":
+            text = table_text(element)
+            if len(text) >= self.table_min_chars:
+                self.saved["table_text"] += 1
+                return "table_text", text
+
+        try:
+            width, height, entropy, dhash = image_features(element.metadata.image_path)
+        except Exception as e:
+            # Let the vision model (or its fallback) deal with an image we cannot read
+            logger.warning(f"Could not analyse figure {element.metadata.image_path}: {e}")
+            return None, None
+
+        if min(width, height) < self.min_side or width * height < self.min_area:
+            self.saved["small"] += 1
+            return "small", None
+        if entropy < self.min_entropy:
+            self.saved["low_entropy"] += 1
+            return "low_entropy", None
+        if self.hash_distance >= 0:
+            for seen_hash, seen_key in self._hashes:
+                if (dhash ^ seen_hash).bit_count() <= self.hash_distance:
+                    self.saved["near_duplicate"] += 1
+                    return "near_duplicate", seen_key
+        self._hashes.append((dhash, key))
+        return None, None
+
+    def report(self):
+        return {"figures": self.seen, "vision_calls_saved": dict(self.saved)}
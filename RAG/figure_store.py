@@ -0,0 +1,243 @@
+import io
+import os
+import re
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import logging
+import mimetypes
+import threading
+from dotenv import load_dotenv
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+FIGURE_STORE_DIR = os.getenv("FIGURE_STORE_DIR", "./figures/store")
+# Longest side of the thumbnail variant, in pixels
+FIGURE_THUMB_SIZE = int(os.getenv("FIGURE_THUMB_SIZE", "320"))
+FIGURE_WEBP_QUALITY = int(os.getenv("FIGURE_WEBP_QUALITY", "80"))
+
+# Hex prefix of the SHA-256 of the image bytes
+FIGURE_ID_RE = re.compile(r"^[0-9a-f]{24}$")
+VARIANTS = ("original", "webp", "thumb")
+
+
+def figure_url(figure_id, variant=None):
+    return f"/figures/{figure_id}" + (f"?variant={variant}" if variant else "")
+
+
+class FigureStore:
+    """Content-addressed store for extracted figures.
+
+    A figure's id is a hash of its bytes, so the same image extracted from
+    several documents (or from a re-upload) is stored and served once. Next to
+    the original, a downscaled WebP thumbnail and a full-size WebP are written
+    when the figure is added, so serving never resizes or re-encodes. A SQLite
+    index records which documents reference each figure; `release` drops a
+    document's references and deletes figures nothing references any more.
+    """
+
+    def __init__(self, root=FIGURE_STORE_DIR, thumb_size=FIGURE_THUMB_SIZE, webp_quality=FIGURE_WEBP_QUALITY):
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.thumb_size = thumb_size
+        self.webp_quality = webp_quality
+        self.metrics = {"added": 0, "deduplicated": 0, "removed": 0, "variant_errors": 0}
+        self._lock = threading.Lock()
+        # Legacy image paths already imported, so each is hashed once per process
+        self._by_path = {}
+        self._conn = sqlite3.connect(os.path.join(root, "index.sqlite"), check_same_thread=False, timeout=30)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS figures ("
+                "id TEXT PRIMARY KEY, files TEXT NOT NULL, width INTEGER, height INTEGER, "
+                "bytes INTEGER NOT NULL, created REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS refs (figure_id TEXT NOT NULL, doc_id TEXT NOT NULL, "
+                "PRIMARY KEY (figure_id, doc_id))"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS refs_doc ON refs (doc_id)")
+
+    @staticmethod
+    def make_id(image_bytes):
+        return hashlib.sha256(image_bytes).hexdigest()[:24]
+
+    def figure_dir(self, figure_id):
+        # Fan out over 256 subdirectories so no single directory grows huge
+        return os.path.join(self.root, figure_id[:2], figure_id)
+
+    @staticmethod
+    def _write(path, data):
+        # Write-then-rename, so a concurrent reader never sees a partial file
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _make_variants(self, figure_dir, image_bytes, original_size):
+        """Write the thumbnail and full-size WebP; returns (width, height, {variant: filename})."""
+        from PIL import Image, features
+
+        files = {}
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            width, height = image.size
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB")
+            webp = features.check("webp")
+            fmt, ext = ("WEBP", ".webp") if webp else ("JPEG", ".jpg")
+            if fmt == "JPEG" and image.mode == "RGBA":
+                image = image.convert("RGB")
+
+            if webp:
+                buffer = io.BytesIO()
+                image.save(buffer, "WEBP", quality=self.webp_quality, method=4)
+                # A WebP that isn't smaller than the original isn't worth serving
+                if buffer.tell() < original_size:
+                    self._write(os.path.join(figure_dir, "full.webp"), buffer.getvalue())
+                    files["webp"] = "full.webp"
+
+            thumb = image.copy()
+            thumb.thumbnail((self.thumb_size, self.thumb_size))
+            buffer = io.BytesIO()
+            thumb.save(buffer, fmt, quality=self.webp_quality)
+            self._write(os.path.join(figure_dir, "thumb" + ext), buffer.getvalue())
+            files["thumb"] = "thumb" + ext
+        return width, height, files
+
+    def add(self, path, doc_id=None):
+        """Store the image at `path` (if its content isn't stored yet) and return its figure id."""
+        with open(path, "rb") as f:
+            image_bytes = f.read()
+        figure_id = self.make_id(image_bytes)
+        figure_dir = self.figure_dir(figure_id)
+        original = "original" + (os.path.splitext(path)[1].lower() or ".jpg")
+
+        with self._lock:
+            row = self._conn.execute("SELECT files FROM figures WHERE id = ?", (figure_id,)).fetchone()
+        if row is not None and os.path.exists(os.path.join(figure_dir, json.loads(row[0])["original"])):
+            self.metrics["deduplicated"] += 1
+        else:
+            os.makedirs(figure_dir, exist_ok=True)
+            self._write(os.path.join(figure_dir, original), image_bytes)
+            files, width, height = {"original": original}, None, None
+            try:
+                width, height, variants = self._make_variants(figure_dir, image_bytes, len(image_bytes))
+                files.update(variants)
+            except Exception as e:
+                # The original is still served for every variant
+                self.metrics["variant_errors"] += 1
+                logger.warning(f"Could not build variants of figure {figure_id} ({path}): {e}")
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO figures (id, files, width, height, bytes, created) VALUES (?, ?, ?, ?, ?, ?)",
+                    (figure_id, json.dumps(files), width, height, len(image_bytes), time.time()),
+                )
+            self.metrics["added"] += 1
+
+        if doc_id:
+            with self._lock, self._conn:
+                self._conn.execute("INSERT OR IGNORE INTO refs (figure_id, doc_id) VALUES (?, ?)", (figure_id, doc_id))
+        return figure_id
+
+    def path(self, figure_id, variant="original"):
+        """Return (file path, media type) of a stored variant, or None if the figure is unknown.
+
+        A variant that could not be built falls back to the original.
+        """
+        if not FIGURE_ID_RE.match(figure_id) or variant not in VARIANTS:
+            return None
+        with self._lock:
+            row = self._conn.execute("SELECT files FROM figures WHERE id = ?", (figure_id,)).fetchone()
+        if row is None:
+            return None
+        files = json.loads(row[0])
+        filename = files.get(variant) or files["original"]
+        media_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        return os.path.join(self.figure_dir(figure_id), filename), media_type
+
+    def release(self, doc_id, keep=()):
+        """Drop `doc_id`'s references except those in `keep`, deleting figures no document references."""
+        keep = set(keep)
+        with self._lock, self._conn:
+            referenced = [row[0] for row in self._conn.execute("SELECT figure_id FROM refs WHERE doc_id = ?", (doc_id,))]
+            dropped = [figure_id for figure_id in referenced if figure_id not in keep]
+            self._conn.executemany(
+                "DELETE FROM refs WHERE figure_id = ? AND doc_id = ?", [(figure_id, doc_id) for figure_id in dropped]
+            )
+            orphans = [
+                figure_id for figure_id in dropped
+                if self._conn.execute("SELECT 1 FROM refs WHERE figure_id = ? LIMIT 1", (figure_id,)).fetchone() is None
+            ]
+            self._conn.executemany("DELETE FROM figures WHERE id = ?", [(figure_id,) for figure_id in orphans])
+        for figure_id in orphans:
+            shutil.rmtree(self.figure_dir(figure_id), ignore_errors=True)
+        self.metrics["removed"] += len(orphans)
+        self._by_path = {path: figure_id for path, figure_id in self._by_path.items() if figure_id not in orphans}
+        if orphans:
+            logger.info(f"Removed {len(orphans)} figures no longer referenced after releasing {doc_id}")
+        return len(orphans)
+
+    def resolve(self, image_path, doc_id=None):
+        """Figure id for an image indexed by path only (before the store existed), importing it on first use."""
+        figure_id = self._by_path.get(image_path)
+        if figure_id is None and image_path and os.path.exists(image_path):
+            figure_id = self._by_path[image_path] = self.add(image_path, doc_id)
+        return figure_id
+
+    def stats(self):
+        with self._lock:
+            figures, stored_bytes = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM figures").fetchone()
+        return {**self.metrics, "figures": figures, "original_bytes": stored_bytes}
+
+    def close(self):
+        self._conn.close()
+
+
+# Created on first use so importing this module touches no files
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_figure_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = FigureStore()
+        return _store
+
+
+def figure_refs(docs):
+    """Stable ids and URLs of the figures among retrieved docs, in retrieval order, without repeats.
+
+    Figure hits come with their page; a text hit contributes the figures on its pages.
+    """
+    refs = {}
+
+    def add(figure_id, page_number):
+        # Chunks indexed before figures were referenced by store id carry ids nothing serves
+        if figure_id is None or not FIGURE_ID_RE.match(figure_id):
+            return
+        if figure_id in refs:
+            refs[figure_id]["page_number"] = refs[figure_id]["page_number"] or page_number
+            return
+        refs[figure_id] = {
+            "id": figure_id,
+            "url": figure_url(figure_id, "webp"),
+            "thumbnail_url": figure_url(figure_id, "thumb"),
+            "page_number": page_number,
+        }
+
+    for doc in docs:
+        if doc.get("type") == "image":
+            add(doc.get("image_id") or get_figure_store().resolve(doc.get("image_path"), doc.get("doc_id")), doc.get("page_number"))
+        else:
+            for figure_id in doc.get("figure_ids") or []:
+                add(figure_id, None)
+    return list(refs.values())
@@ -0,0 +1,89 @@
+import os
+import json
+import time
+import fcntl
+import socket
+import logging
+from dotenv import load_dotenv
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Held by whichever process is writing the index (an ingestion job or a document delete)
+INGEST_LOCK_PATH = os.getenv("INGEST_LOCK_PATH", "./cache/ingest.lock")
+# Longest an API request waits for that lock before giving up
+INGEST_LOCK_TIMEOUT = float(os.getenv("INGEST_LOCK_TIMEOUT", "30"))
+
+
+class FileLock:
+    """Exclusive flock() on a file, shared by every process and thread on the host.
+
+    The kernel releases the lock when its holder exits, even if it crashes, so
+    a lock can never be left behind the way a lock file or database row can.
+    The holder writes its pid, host, purpose and start time into the file, and
+    `holder()` reads them back for waiters' log messages. Locks taken through
+    separate FileLock objects exclude each other, also within one process.
+    """
+
+    def __init__(self, path=INGEST_LOCK_PATH, purpose=""):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.purpose = purpose
+        self._fd = None
+
+    def acquire(self, timeout=None):
+        """Take the lock, waiting at most `timeout` seconds (None: forever); returns False on timeout."""
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if timeout is None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            else:
+                deadline = time.monotonic() + timeout
+                delay = 0.01
+                while True:
+                    try:
+                        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            os.close(fd)
+                            return False
+                        time.sleep(min(delay, remaining))
+                        delay = min(delay * 2, 0.5)
+        except BaseException:
+            os.close(fd)
+            raise
+        self._fd = fd
+        info = {"pid": os.getpid(), "host": socket.gethostname(), "purpose": self.purpose, "since": time.time()}
+        os.ftruncate(fd, 0)
+        os.pwrite(fd, json.dumps(info).encode("utf-8"), 0)
+        return True
+
+    def release(self):
+        if self._fd is not None:
+            fd, self._fd = self._fd, None
+            os.ftruncate(fd, 0)
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def holder(self):
+        """Who holds (or last held) the lock, as written by its holder; None if unknown."""
+        try:
+            with open(self.path) as f:
+                return json.loads(f.read() or "null")
+        except (OSError, ValueError):
+            return None
+
+    def __enter__(self):
+        # A lock already taken with acquire(timeout) is just released on exit
+        if self._fd is None:
+            self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
@@ -0,0 +1,205 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dotenv import load_dotenv
+from RAG import telemetry
+from RAG.file_lock import FileLock, INGEST_LOCK_PATH
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "./cache/jobs.sqlite")
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))
+
+STAGES = ["partition", "split", "filter", "caption", "embed", "upsert"]
+
+_executor = None
+
+
+def no_progress(stage, status, done=None, total=None, **details):
+    pass
+
+
+def _connect():
+    if os.path.dirname(JOBS_DB_PATH):
+        os.makedirs(os.path.dirname(JOBS_DB_PATH), exist_ok=True)
+    conn = sqlite3.connect(JOBS_DB_PATH, timeout=30)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS jobs ("
+        "id TEXT PRIMARY KEY, filename TEXT NOT NULL, status TEXT NOT NULL, "
+        "stages TEXT NOT NULL, error TEXT, created REAL NOT NULL, updated REAL NOT NULL)"
+    )
+    return conn
+
+
+def create_job(filename):
+    job_id = uuid.uuid4().hex
+    stages = {stage: {"status": "pending", "done": 0, "total": None} for stage in STAGES}
+    now = time.time()
+    with _connect() as conn:
+        conn.execute(
+            "INSERT INTO jobs (id, filename, status, stages, error, created, updated) VALUES (?, ?, ?, ?, NULL, ?, ?)",
+            (job_id, filename, "queued", json.dumps(stages), now, now),
+        )
+    return job_id
+
+
+def get_job(job_id):
+    with _connect() as conn:
+        row = conn.execute(
+            "SELECT id, filename, status, stages, error, created, updated FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+    if row is None:
+        return None
+    return {
+        "job_id": row[0],
+        "filename": row[1],
+        "status": row[2],
+        "stages": json.loads(row[3]),
+        "error": row[4],
+        "created": row[5],
+        "updated": row[6],
+    }
+
+
+def set_job_status(job_id, status, error=None):
+    with _connect() as conn:
+        conn.execute(
+            "UPDATE jobs SET status = ?, error = ?, updated = ? WHERE id = ?", (status, error, time.time(), job_id)
+        )
+
+
+def update_stage(job_id, stage, status, done=None, total=None, **details):
+    # details are extra per-stage fields, e.g. the vision calls each figure filter rule saved
+    with _connect() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        (stages,) = conn.execute("SELECT stages FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        stages = json.loads(stages)
+        entry = stages.setdefault(stage, {"status": "pending", "done": 0, "total": None})
+        entry["status"] = status
+        if done is not None:
+            entry["done"] = done
+        if total is not None:
+            entry["total"] = total
+        entry.update(details)
+        conn.execute(
+            "UPDATE jobs SET stages = ?, updated = ? WHERE id = ?", (json.dumps(stages), time.time(), job_id)
+        )
+
+
+def run_ingestion_job(job_id, file_path, trace=None, filename=None, keep_path=None):
+    """Ingest `file_path` in a worker process; returns the worker's metrics for the API process to merge."""
+    def progress(stage, status, done=None, total=None, **details):
+        update_stage(job_id, stage, status, done, total, **details)
+
+    trace = trace or {}
+    filename = filename or os.path.basename(file_path)
+    with telemetry.request_context(trace.get("request_id"), trace.get("traceparent")):
+        with telemetry.span("ingest", job_id=job_id, file=filename):
+            _ingest(job_id, file_path, filename, keep_path, progress)
+    return telemetry.REGISTRY.drain()
+
+
+def _ingest(job_id, file_path, filename, keep_path, progress):
+    try:
+        # The BM25 index and figure references are read-modify-written whole, so only one
+        # process on the host writes the index at a time; other jobs wait here as "waiting"
+        lease = FileLock(INGEST_LOCK_PATH, purpose=f"ingest {filename} (job {job_id})")
+        if not lease.acquire(timeout=0):
+            set_job_status(job_id, "waiting")
+            logger.info(f"Ingestion job {job_id} waiting for the index lock held by {lease.holder()}")
+            lease.acquire()
+        with lease:
+            _ingest_locked(job_id, file_path, filename, progress)
+            if keep_path:
+                # Still under the lock, so keep_path always holds the version last indexed
+                os.replace(file_path, keep_path)
+    except Exception as e:
+        logger.error(f"Ingestion job {job_id} failed (request {telemetry.current_request_id()}): {e}", exc_info=True)
+        set_job_status(job_id, "failed", str(e))
+    finally:
+        if keep_path and os.path.exists(file_path):
+            os.remove(file_path)
+
+
+def _ingest_locked(job_id, file_path, filename, progress):
+    set_job_status(job_id, "running")
+    # Runs in a worker process; heavy modules are imported here, not in the API process
+    from RAG.doc_registry import make_doc_id, file_hash
+    from RAG.vector_db import index_stream, registry
+
+    doc_id = make_doc_id(filename)
+    content_hash = file_hash(file_path)
+
+    if registry.is_current(doc_id, content_hash):
+        # Unchanged re-upload: nothing to parse, caption or embed
+        for stage in STAGES:
+            progress(stage, "skipped")
+        set_job_status(job_id, "completed")
+        logger.info(f"Ingestion job {job_id}: {filename} is unchanged, skipping (request {telemetry.current_request_id()})")
+        return
+
+    from RAG.pdf_processor import iter_documents
+
+    # Parsing, captioning, embedding and upserting run as overlapping, bounded stages
+    doc_batches = iter_documents(file_path, doc_id=doc_id, progress=progress)
+    index_stream(doc_batches, doc_id, filename=filename, content_hash=content_hash, progress=progress)
+    set_job_status(job_id, "completed")
+    logger.info(f"Ingestion job {job_id} completed for {file_path} (request {telemetry.current_request_id()})")
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        # spawn: workers open their own model/client connections instead of inheriting forked sockets
+        _executor = ProcessPoolExecutor(max_workers=INGEST_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+def submit_ingestion(file_path, filename=None, keep_path=None):
+    """Queue ingestion of `file_path` as document `filename` (default: the file's name); returns the job id.
+
+    With `keep_path`, `file_path` is a copy only this job reads: it is moved to
+    `keep_path` once indexed (removed if the job fails), so a later upload of
+    the same name can never change the file under a running job.
+    """
+    global _executor
+    filename = filename or os.path.basename(file_path)
+    job_id = create_job(filename)
+    # The worker continues the uploading request's trace and request id
+    trace = telemetry.propagation_context()
+    try:
+        future = _get_executor().submit(run_ingestion_job, job_id, file_path, trace, filename, keep_path)
+    except BrokenProcessPool:
+        # A previous worker crashed and poisoned the pool; start a fresh one
+        logger.warning("Ingestion worker pool was broken, restarting it")
+        _executor = None
+        future = _get_executor().submit(run_ingestion_job, job_id, file_path, trace, filename, keep_path)
+
+    def on_done(f):
+        if f.exception() is not None:
+            # The worker process died before it could record the failure itself
+            set_job_status(job_id, "failed", str(f.exception()))
+        else:
+            # Ingestion stages ran in the worker; fold their metrics into this process's /metrics
+            telemetry.REGISTRY.merge(f.result())
+
+    future.add_done_callback(on_done)
+    logger.info(f"Queued ingestion job {job_id} for {file_path}")
+    return job_id
+
+
+def shutdown(wait=True):
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=wait)
+        _executor = None
@@ -1,8 +1,9 @@
 import os
 import logging
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_groq import ChatGroq
+import threading
 from dotenv import load_dotenv
+from RAG import telemetry
+from RAG.context import estimate_tokens
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -17,24 +18,81 @@ Answer:
 
 load_dotenv()
 
-# Validate API key
-api_key = os.getenv("GROQ_API_KEY")
-if not api_key:
-    raise ValueError("GROQ_API_KEY environment variable is required")
+LLM_MODEL = os.getenv("LLM_MODEL", "llama-3.1-8b-instant")
 
-model = ChatGroq(model="llama-3.1-8b-instant", api_key=api_key)
+# Created on first use so importing this module needs no credentials and stays fast
+_chain = None
+_lock = threading.Lock()
 
+def get_model():
+    # Validate API key
+    api_key = os.getenv("GROQ_API_KEY")
+    if not api_key:
+        raise RuntimeError("GROQ_API_KEY environment variable is required")
+
+    from langchain_groq import ChatGroq
+
+    return ChatGroq(model=LLM_MODEL, api_key=api_key)
+
+def get_chain(model=None):
+    """The prompt | model chain, built once and shared by every request."""
+    global _chain
+    if _chain is None or model is not None:
+        with _lock:
+            if _chain is None or model is not None:
+                from langchain_core.prompts import ChatPromptTemplate
+
+                prompt = ChatPromptTemplate.from_template(template)
+                _chain = prompt | (model or get_model())
+    return _chain
+
+def record_tokens(usage, question, documents, answer):
+    # Groq reports usage on the response; fall back to the chars/token estimate when it doesn't
+    usage = usage or {}
+    prompt = usage.get("input_tokens") or estimate_tokens(template + question + documents)
+    completion = usage.get("output_tokens") or estimate_tokens(answer)
+    telemetry.LLM_TOKENS.inc(prompt, kind="prompt")
+    telemetry.LLM_TOKENS.inc(completion, kind="completion")
+
+@telemetry.traced("llm")
 def llm_inference(question, documents):
     try:
         context = documents
 
-        prompt = ChatPromptTemplate.from_template(template)
-        chain = prompt | model
+        result = get_chain().invoke({"question": question, "context": context})
+        record_tokens(result.usage_metadata, question, documents, result.content)
+        logger.info(f"Successfully generated response for question: {question[:50]}...")
+        return result
+
+    except Exception as e:
+        logger.error(f"Error during LLM inference: {e}")
+        raise
 
-        result = chain.invoke({"question": question, "context": context})
+@telemetry.traced("llm")
+async def allm_inference(question, documents):
+    try:
+        result = await get_chain().ainvoke({"question": question, "context": documents})
+        record_tokens(result.usage_metadata, question, documents, result.content)
         logger.info(f"Successfully generated response for question: {question[:50]}...")
         return result
 
     except Exception as e:
         logger.error(f"Error during LLM inference: {e}")
-        raise
\ No newline at end of file
+        raise
+
+async def llm_astream(question, documents):
+    # Yields answer tokens as Groq produces them
+    try:
+        with telemetry.span("llm", stream=True):
+            tokens, usage = [], None
+            async for chunk in get_chain().astream({"question": question, "context": documents}):
+                usage = chunk.usage_metadata or usage
+                if chunk.content:
+                    tokens.append(chunk.content)
+                    yield chunk.content
+            record_tokens(usage, question, documents, "".join(tokens))
+        logger.info(f"Successfully streamed response for question: {question[:50]}...")
+
+    except Exception as e:
+        logger.error(f"Error during streaming LLM inference: {e}")
+        raise
@@ -0,0 +1,70 @@
+import os
+import numpy as np
+
+
+class MmapMatrix:
+    """Append-only 2-D matrix stored in a raw file and accessed through np.memmap.
+
+    The file only ever grows, so other processes holding an older mapping stay
+    valid; they call `refresh()` to see rows appended since they mapped it.
+    Callers are responsible for serialising writers (e.g. a SQLite write lock).
+    """
+
+    def __init__(self, path, dim, dtype=np.float32, min_rows=1024):
+        self.path = path
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.min_rows = min_rows
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        if not os.path.exists(path):
+            open(path, "wb").close()
+        self._mm = None
+        self.capacity = 0
+        self.refresh()
+
+    @property
+    def row_bytes(self):
+        return self.dim * self.dtype.itemsize
+
+    def refresh(self):
+        rows = os.path.getsize(self.path) // self.row_bytes
+        if rows == self.capacity and self._mm is not None:
+            return
+        if self._mm is not None:
+            self._mm.flush()
+        self._mm = np.memmap(self.path, dtype=self.dtype, mode="r+", shape=(rows, self.dim)) if rows else None
+        self.capacity = rows
+
+    def ensure_rows(self, rows):
+        if rows <= self.capacity:
+            return
+        new_capacity = max(rows, self.capacity * 2, self.min_rows)
+        if os.path.getsize(self.path) < new_capacity * self.row_bytes:
+            with open(self.path, "r+b") as f:
+                f.truncate(new_capacity * self.row_bytes)
+        self.refresh()
+
+    def write(self, rows, vectors):
+        rows = np.asarray(rows, dtype=np.int64)
+        if not len(rows):
+            return
+        self.ensure_rows(int(rows.max()) + 1)
+        self._mm[rows] = np.asarray(vectors, dtype=self.dtype)
+        self._mm.flush()
+
+    def read(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) and int(rows.max()) >= self.capacity:
+            self.refresh()
+        if self._mm is None:
+            return np.empty((0, self.dim), dtype=self.dtype)
+        return np.array(self._mm[rows])
+
+    def view(self, rows):
+        """Zero-copy view of the first `rows` rows (valid until the next refresh)."""
+        if rows > self.capacity:
+            self.refresh()
+        if self._mm is None:
+            return np.empty((0, self.dim), dtype=self.dtype)
+        return self._mm[:rows]
@@ -0,0 +1,202 @@
+import os
+import shutil
+import hashlib
+import logging
+import tempfile
+import multiprocessing
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import fitz
+from unstructured.partition.pdf import partition_pdf
+from unstructured.staging.base import elements_from_dicts
+from dotenv import load_dotenv
+from RAG.jobs import no_progress
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+PARTITION_WORKERS = int(os.getenv("PARTITION_WORKERS", str(min(4, os.cpu_count() or 1))))
+PARTITION_PAGES_PER_SHARD = int(os.getenv("PARTITION_PAGES_PER_SHARD", "8"))
+# Documents shorter than this are partitioned in-process; a pool is not worth the model load
+PARTITION_MIN_PAGES = int(os.getenv("PARTITION_MIN_PAGES", "16"))
+# hi_res | fast | ocr_only for every page, or "auto" to choose per page
+PARTITION_STRATEGY = os.getenv("PARTITION_STRATEGY", "hi_res")
+
+STRATEGIES = ("hi_res", "fast", "ocr_only")
+
+_executor = None
+_executor_workers = None
+
+
+def page_strategy(page):
+    """hi_res only where layout detection pays off: pages with images or tables."""
+    if page.get_images(full=False):
+        return "hi_res"
+    if page.find_tables().tables:
+        return "hi_res"
+    if page.get_text("text").strip():
+        return "fast"
+    # No text layer and no embedded images: scanned or vector-drawn text
+    return "ocr_only"
+
+
+def plan_pages(file_path, policy=None):
+    """Return the partition strategy for every page (0-based page index order)."""
+    policy = policy or PARTITION_STRATEGY
+    if policy not in STRATEGIES + ("auto",):
+        raise ValueError(f"Unknown partition strategy: {policy}")
+    with fitz.open(file_path) as pdf:
+        if policy != "auto":
+            return [policy] * pdf.page_count
+        return [page_strategy(page) for page in pdf]
+
+
+def plan_shards(strategies, pages_per_shard=None):
+    """Group consecutive pages sharing a strategy into (first_page, last_page, strategy) ranges, 0-based inclusive."""
+    pages_per_shard = pages_per_shard or PARTITION_PAGES_PER_SHARD
+    shards = []
+    for page, strategy in enumerate(strategies):
+        if shards and shards[-1][2] == strategy and page - shards[-1][0] < pages_per_shard:
+            shards[-1] = (shards[-1][0], page, strategy)
+        else:
+            shards.append((page, page, strategy))
+    return shards
+
+
+def element_id(page_number, position, text):
+    """Id of the `position`-th element on a page: unique within the document, stable across re-ingestion."""
+    return hashlib.sha256(f"{page_number}:{position}:{text}".encode("utf-8")).hexdigest()[:32]
+
+
+def partition_shard(file_path, first_page, last_page, strategy, output_dir):
+    """Partition pages [first_page, last_page] of `file_path` and return element dicts.
+
+    Runs in a worker process. Figures are written to `output_dir` with a
+    page-numbered prefix so names stay unique, and sort in page order, across shards.
+    Page numbers and element ids in the returned data refer to the original document.
+    """
+    shard_dir = tempfile.mkdtemp(prefix=f"shard-{first_page:05d}-", dir=output_dir)
+    shard_pdf = os.path.join(shard_dir, "pages.pdf")
+    try:
+        with fitz.open(file_path) as pdf, fitz.open() as shard:
+            shard.insert_pdf(pdf, from_page=first_page, to_page=last_page)
+            shard.save(shard_pdf)
+
+        kwargs = {}
+        if strategy == "hi_res":
+            kwargs = {"extract_image_block_types": ["Image", "Table"], "extract_image_block_output_dir": shard_dir}
+        elements = partition_pdf(shard_pdf, strategy=strategy, **kwargs)
+
+        renamed = {}
+        for name in sorted(os.listdir(shard_dir)):
+            source = os.path.join(shard_dir, name)
+            if source == shard_pdf or not os.path.isfile(source):
+                continue
+            target = os.path.join(output_dir, f"p{first_page:05d}-{name}")
+            os.replace(source, target)
+            renamed[source] = target
+
+        results = []
+        # Unstructured's ids hash the shard's file name, page and position, which repeat from shard to shard
+        ids, positions = {}, {}
+        for element in elements:
+            data = element.to_dict()
+            metadata = data.setdefault("metadata", {})
+            if metadata.get("page_number") is not None:
+                metadata["page_number"] += first_page
+            page = metadata.get("page_number")
+            page = f"shard{first_page}" if page is None else page
+            positions[page] = positions.get(page, -1) + 1
+            ids[data.get("element_id")] = data["element_id"] = element_id(page, positions[page], data.get("text") or "")
+            if metadata.get("parent_id") in ids:
+                metadata["parent_id"] = ids[metadata["parent_id"]]
+            if metadata.get("image_path") in renamed:
+                metadata["image_path"] = renamed[metadata["image_path"]]
+            metadata.pop("filename", None)
+            metadata.pop("file_directory", None)
+            results.append(data)
+        return results
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
+
+def _get_executor(workers):
+    global _executor, _executor_workers
+    if _executor is not None and _executor_workers != workers:
+        _executor.shutdown(wait=True)
+        _executor = None
+    if _executor is None:
+        # spawn: layout models and their threads don't survive fork
+        _executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        _executor_workers = workers
+    return _executor
+
+
+def shutdown(wait=True):
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=wait)
+        _executor = None
+
+
+def iter_partition(file_path, output_dir, policy=None, workers=None, progress=no_progress):
+    """Partition a PDF shard by shard, yielding each shard's elements in page order.
+
+    Large documents are split into page ranges that run in a process pool, with
+    at most two shards per worker in flight so a slow consumer holds back parsing.
+    `policy` ("hi_res", "fast", "ocr_only" or "auto") picks the strategy per page.
+    """
+    workers = PARTITION_WORKERS if workers is None else workers
+    strategies = plan_pages(file_path, policy)
+    total = len(strategies)
+    progress("partition", "running", 0, total)
+
+    if total < PARTITION_MIN_PAGES:
+        shards = plan_shards(strategies, pages_per_shard=total or 1)
+    else:
+        shards = plan_shards(strategies)
+    counts = {strategy: strategies.count(strategy) for strategy in set(strategies)}
+    logger.info(f"Partitioning {total} pages in {len(shards)} shards ({counts})")
+
+    pages_done = 0
+    if workers <= 1 or total < PARTITION_MIN_PAGES:
+        for shard in shards:
+            elements = partition_shard(file_path, *shard, output_dir)
+            pages_done += shard[1] - shard[0] + 1
+            progress("partition", "running", pages_done, total)
+            yield elements_from_dicts(elements)
+        return
+
+    def submit(shard):
+        global _executor
+        try:
+            return _get_executor(workers).submit(partition_shard, file_path, *shard, output_dir)
+        except BrokenProcessPool:
+            # A crashed worker (e.g. OOM on a huge page) breaks the pool; start a fresh one
+            _executor = None
+            return _get_executor(workers).submit(partition_shard, file_path, *shard, output_dir)
+
+    pending = iter(shards)
+    in_flight = deque((shard, submit(shard)) for shard in islice(pending, 2 * workers))
+    try:
+        while in_flight:
+            shard, future = in_flight.popleft()
+            elements = future.result()
+            for next_shard in islice(pending, 1):
+                in_flight.append((next_shard, submit(next_shard)))
+            pages_done += shard[1] - shard[0] + 1
+            progress("partition", "running", pages_done, total)
+            yield elements_from_dicts(elements)
+    finally:
+        for _, future in in_flight:
+            future.cancel()
+
+
+def partition_document(file_path, output_dir, policy=None, workers=None, progress=no_progress):
+    """Partition a whole PDF and return its elements in page order."""
+    return [element for elements in iter_partition(file_path, output_dir, policy, workers, progress) for element in elements]
@@ -2,11 +2,15 @@ import base64
 import os
 import logging
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from unstructured.partition.pdf import partition_pdf
-from unstructured.partition.utils.constants import PartitionStrategy
 from dotenv import load_dotenv
-from groq import Groq
 from langchain.schema import Document
+from RAG.captioner import caption_images
+from RAG.caption_cache import CaptionCache
+from RAG.jobs import no_progress
+from RAG.pdf_partition import iter_partition
+from RAG.figure_store import get_figure_store
+from RAG.figure_filter import FigureFilter, DROP_RULES
+from RAG import telemetry
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -14,49 +18,104 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-# Validate API key
-api_key = os.environ.get("GROQ_API_KEY")
-if not api_key:
-    raise ValueError("GROQ_API_KEY environment variable is required")
+# Created on first use so importing this module needs no credentials
+_client = None
+_caption_cache = None
 
-client = Groq(api_key=api_key)
+def get_client():
+    global _client
+    if _client is None:
+        # Validate API key
+        api_key = os.environ.get("GROQ_API_KEY")
+        if not api_key:
+            raise RuntimeError("GROQ_API_KEY environment variable is required")
 
+        from groq import Groq
+
+        _client = Groq(api_key=api_key)
+    return _client
+
+def get_caption_cache():
+    global _caption_cache
+    if _caption_cache is None:
+        _caption_cache = CaptionCache()
+    return _caption_cache
+
+CAPTION_MODEL = "meta-llama/llama-4-scout-17b-16e-instruct"  # Updated to a valid model name
+CAPTION_PROMPT = "Elaborate the findings in the image concisely in a single paragraph. Do not add anything."
+
+# Chunk size in embedding-model tokens; defaults to the model's input window (384 for all-mpnet-base-v2)
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "0")) or None
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "48"))
+
+# Figures are extracted into per-document scratch folders, then moved into the figure store
 figure_dir = "./figures/"
-# Ensure figures directory exists
-os.makedirs(figure_dir, exist_ok=True)
 
-# Clear .jpg or .jpeg files in the folder
-for f in os.listdir(figure_dir):
-    if f.lower().endswith((".jpg", ".jpeg")):
-        os.remove(os.path.join(figure_dir, f))
+def caption_image(file_path):
+    # Raises on API errors so the captioning stage can retry 429/5xx responses
+    base64_image = encode_image(file_path)
 
-def extract_text(file_path):
-    try:
-        # Getting the base64 string
-        base64_image = encode_image(file_path)
-
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": "Elaborate the findings in the image concisely in a single paragraph. Do not add anything."},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}",
-                            },
+    chat_completion = get_client().chat.completions.create(
+        messages=[
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": CAPTION_PROMPT},
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:image/jpeg;base64,{base64_image}",
                         },
-                    ],
-                }
-            ],
-            model="meta-llama/llama-4-scout-17b-16e-instruct",  # Updated to a valid model name
+                    },
+                ],
+            }
+        ],
+        model=CAPTION_MODEL,
+    )
+
+    return chat_completion.choices[0].message.content
+
+def caption_fallback(file_path):
+    return f"[Error processing image: {os.path.basename(file_path)}]"
+
+def extract_text(file_path):
+    return caption_figures([file_path])[0]
+
+def image_cache_key(file_path):
+    with open(file_path, "rb") as image_file:
+        return CaptionCache.make_key(image_file.read(), CAPTION_MODEL, CAPTION_PROMPT)
+
+@telemetry.traced("caption")
+def caption_figures(image_paths):
+    # Serve unchanged figures from the caption cache; only misses reach the vision model
+    caption_cache = get_caption_cache()
+    keys = [image_cache_key(path) for path in image_paths]
+    captions = [caption_cache.get(key) for key in keys]
+    missing = [i for i, caption in enumerate(captions) if caption is None]
+
+    # Identical images within one document share a single vision call
+    first_by_key = {}
+    for i in missing:
+        first_by_key.setdefault(keys[i], i)
+
+    if first_by_key:
+        fresh = caption_images(
+            [image_paths[i] for i in first_by_key.values()],
+            caption_image,
+            fallback=lambda path: None
         )
+        fresh_by_key = dict(zip(first_by_key, fresh))
+        for key, caption in fresh_by_key.items():
+            if caption is not None:
+                caption_cache.put(key, caption, CAPTION_MODEL)
+        for i in missing:
+            captions[i] = fresh_by_key[keys[i]] or caption_fallback(image_paths[i])
 
-        return chat_completion.choices[0].message.content
-    except Exception as e:
-        logger.error(f"Error extracting text from image {file_path}: {e}")
-        return f"[Error processing image: {os.path.basename(file_path)}]"
+    telemetry.FIGURES.inc(len(image_paths) - len(missing), source="cache")
+    telemetry.FIGURES.inc(len(first_by_key), source="vision")
+    telemetry.FIGURES.inc(len(missing) - len(first_by_key), source="duplicate")
+    logger.info(f"Captioned {len(image_paths)} figures ({len(first_by_key)} vision calls, {caption_cache.stats()['hit_rate']:.0%} cache hit rate)")
+    return captions
 
 def encode_image(image_path):
     try:
@@ -66,38 +125,286 @@ def encode_image(image_path):
         logger.error(f"Error encoding image {image_path}: {e}")
         raise
 
-def upload_pdf(file_path):
-    try:
-        if not os.path.exists(file_path):
-            raise FileNotFoundError(f"PDF file not found: {file_path}")
+def store_figure(image_path, doc_id=None):
+    # The extracted file is only scratch: the store keeps one copy per distinct image
+    image_id = get_figure_store().add(image_path, doc_id)
+    os.remove(image_path)
+    return image_id
+
+def document_figure_dir(doc_id):
+    # Each document writes its figures to its own folder so uploads can't clobber each other
+    doc_dir = os.path.join(figure_dir, doc_id) if doc_id else figure_dir
+    os.makedirs(doc_dir, exist_ok=True)
+    return doc_dir
 
-        elements = partition_pdf(
-                file_path,
-                strategy=PartitionStrategy.HI_RES,
-                extract_image_block_types=["Image", "Table"],
-                extract_image_block_output_dir=figure_dir
-            )
+class StructuredChunker:
+    """Token-sized chunks built from unstructured elements, carried across shards.
+
+    A Title element closes the running chunk and starts a new section. Elements
+    are packed whole until the next one would exceed `max_tokens` (the embedding
+    window), the trailing elements of a full chunk are repeated as overlap, and
+    elements longer than the window are split by tokens. Each chunk records its
+    pages, section, element ids, char offsets into the "\n\n"-joined text of
+    its first page (start) and last page (end), and the figure store ids of the
+    figures on its pages. Offsets are page-relative so that an edit on one page
+    leaves the chunks (and chunk ids) of every other page unchanged.
+    """
+
+    def __init__(self, count_tokens, max_tokens, overlap_tokens=CHUNK_OVERLAP_TOKENS, split_long=None):
+        self.count_tokens = count_tokens
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.split_long = split_long
+        self._parts = []
+        self._tokens = 0
+        self._closed = []
+        self._section = ""
+        self._offset = 0
+        self._offset_page = None
+        self._page = None
+        self._figures = {}
+
+    def _close(self, overlap=False):
+        if not self._parts:
+            return
+        self._closed.append((self._section, self._parts))
+        carry = []
+        if overlap:
+            tokens = 0
+            for part in reversed(self._parts):
+                tokens += part["tokens"]
+                if tokens > self.overlap_tokens:
+                    break
+                carry.insert(0, part)
+        self._parts = carry
+        self._tokens = sum(part["tokens"] for part in carry)
+
+    def _add(self, part):
+        if self._parts and self._tokens + part["tokens"] > self.max_tokens:
+            self._close(overlap=True)
+        self._parts.append(part)
+        self._tokens += part["tokens"]
+
+    def _document(self, section, parts):
+        pages = [part["page"] for part in parts if part["page"] is not None]
+        first_page, last_page = (min(pages), max(pages)) if pages else (None, None)
+        figure_ids = []
+        if pages:
+            for page in range(first_page, last_page + 1):
+                figure_ids.extend(self._figures.get(page, []))
+        # Store ids are content hashes, so a figure repeated on the pages appears once
+        figure_ids = list(dict.fromkeys(figure_ids))
+        return Document(
+            page_content="\n\n".join(part["text"] for part in parts),
+            metadata={
+                "type": "text",
+                "page_number": first_page,
+                "page_end": last_page,
+                "section": section,
+                "element_ids": list(dict.fromkeys(part["element_id"] for part in parts)),
+                "start_index": parts[0]["start"],
+                "end_index": parts[-1]["start"] + len(parts[-1]["text"]),
+                "figure_ids": figure_ids,
+            },
+        )
+
+    def _ready(self):
+        docs = [self._document(section, parts) for section, parts in self._closed]
+        self._closed = []
+        # Figures on pages before the running chunk can no longer be attached to anything
+        open_pages = [part["page"] for part in self._parts if part["page"] is not None]
+        first_open = min(open_pages, default=self._page)
+        if first_open is not None:
+            self._figures = {page: ids for page, ids in self._figures.items() if page is None or page >= first_open}
+        return docs
+
+    def feed(self, elements, figure_ids=None):
+        """Add one shard of elements (whole pages); return the chunks completed so far.
+
+        `figure_ids` maps the element id of each stored figure to its figure store id.
+        """
+        figure_ids = figure_ids or {}
+        texts = []
+        for element in elements:
+            page = element.metadata.page_number
+            self._page = page if page is not None else self._page
+            if element.category in ["Image", "Table"]:
+                # Figures that were not stored (no extracted image) cannot be served, so are not referenced
+                if element.id in figure_ids:
+                    self._figures.setdefault(page, []).append(figure_ids[element.id])
+                continue
+            text = (element.text or "").strip()
+            if text:
+                texts.append((element, text, page))
+
+        token_counts = self.count_tokens([text for _, text, _ in texts]) if texts else []
+        for (element, text, page), tokens in zip(texts, token_counts):
+            if page is not None and page != self._offset_page:
+                self._offset_page, self._offset = page, 0
+            start = self._offset
+            self._offset += len(text) + 2
+            if element.category == "Title":
+                self._close()
+                self._section = text
+            if tokens <= self.max_tokens or self.split_long is None:
+                self._add({
+                    "text": text,
+                    "tokens": tokens,
+                    "page": page,
+                    "element_id": element.id,
+                    "start": start,
+                    "title": element.category == "Title",
+                })
+                continue
+
+            # An element longer than the embedding window becomes several chunks of its own;
+            # a heading right before it is kept as the chunks' section rather than as a chunk
+            if all(part["title"] for part in self._parts):
+                self._parts, self._tokens = [], 0
+            self._close()
+            position = 0
+            for piece in self.split_long(text):
+                position = max(text.find(piece, position), position)
+                self._parts = [{
+                    "text": piece,
+                    "tokens": self.max_tokens,
+                    "page": page,
+                    "element_id": element.id,
+                    "start": start + position,
+                    "title": False,
+                }]
+                self._close()
+        return self._ready()
+
+    def flush(self):
+        self._close()
+        return self._ready()
+
+def make_chunker():
+    # Size chunks with the embedding model's own tokenizer so nothing is truncated at embed time
+    from RAG.vector_db import embeddings
+
+    max_tokens = min(CHUNK_MAX_TOKENS or embeddings.max_tokens, embeddings.max_tokens)
+    # Chunking runs on its own pipeline stage, concurrently with encoding: give it its own tokenizer
+    tokenizer = embeddings.copy_tokenizer()
+    splitter = RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
+        tokenizer, chunk_size=max_tokens, chunk_overlap=CHUNK_OVERLAP_TOKENS
+    )
+    count_tokens = lambda texts: embeddings.count_tokens(texts, tokenizer)
+    return StructuredChunker(count_tokens, max_tokens, split_long=splitter.split_text)
+
+def iter_documents(file_path, doc_id=None, progress=no_progress, strategy=None):
+    """Yield text chunk and figure caption Documents shard by shard, in page order.
+
+    Only one shard's elements are held at a time, so memory does not grow with
+    the page count and downstream stages can start on the first pages while the
+    rest of the document is still being parsed.
+    """
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"PDF file not found: {file_path}")
+
+    doc_figure_dir = document_figure_dir(doc_id)
+    # Drop figures left over from a previous version of this document
+    for f in os.listdir(doc_figure_dir):
+        if f.lower().endswith((".jpg", ".jpeg")):
+            os.remove(os.path.join(doc_figure_dir, f))
+
+    store = get_figure_store()
+    # Figures this version of the document references; the rest are released at the end
+    stored = set()
+    figure_filter = FigureFilter()
+    chunker = make_chunker()
+    text_count = image_count = 0
+    progress("split", "running")
+    progress("filter", "running")
+    progress("caption", "running")
+    shards = iter_partition(file_path, doc_figure_dir, policy=strategy, progress=progress)
+    for elements in telemetry.traced_iter("partition", shards):
+        # Figures extracted from this shard, in page order
+        figures = [
+            element
+            for element in elements
+            if element.category in ["Image", "Table"] and element.metadata.image_path
+        ]
+        with telemetry.span("filter"):
+            decisions = [figure_filter.check(element, element.id) for element in figures]
+        dropped = {element.id for element, (rule, _) in zip(figures, decisions) if rule in DROP_RULES}
+        for element in figures:
+            if element.id in dropped:
+                os.remove(element.metadata.image_path)
+        progress("filter", "running", figure_filter.seen - len(dropped), figure_filter.seen)
+
+        # Stored before chunking, so chunks reference figures by the id /figures serves them under
+        kept = [(element, rule, detail) for element, (rule, detail) in zip(figures, decisions) if element.id not in dropped]
+        with telemetry.span("store_figures"):
+            image_ids = {element.id: store_figure(element.metadata.image_path, doc_id) for element, _, _ in kept}
 
         #Processing Text
-        text_elements = [element.text for element in elements if element.category not in ["Image", "Table"]]
-        text_elements = "\n\n".join(text_elements)
-        text_docs = split_text(text_elements)
-
-        # Process extracted figures if any exist
-        image_docs = []
-        if os.path.exists(figure_dir) and os.listdir(figure_dir):
-            for file in os.listdir(figure_dir):
-                file_path_full = os.path.join(figure_dir, file)
-                if os.path.isfile(file_path_full):
-                    extracted_text = extract_text(file_path_full)
-                    image_docs.append(Document(
-                        page_content=extracted_text,
-                        metadata={"type": "image", "path": file_path_full}
-                    ))
-
-        
-        return text_docs + image_docs
+        with telemetry.span("chunk"):
+            text_docs = chunker.feed([element for element in elements if element.id not in dropped], image_ids)
+        text_count += len(text_docs)
+        progress("split", "running", text_count)
+
+        image_docs = describe_figures(kept, image_ids, figure_filter) if kept else []
+        stored.update(doc.metadata["image_id"] for doc in image_docs)
+        image_count += len(image_docs)
+        progress("caption", "running", image_count)
+
+        yield text_docs + image_docs
+
+    text_docs = chunker.flush()
+    text_count += len(text_docs)
+    yield text_docs
+    if doc_id:
+        store.release(doc_id, keep=stored)
+    report = figure_filter.report()
+    for rule, saved in report["vision_calls_saved"].items():
+        telemetry.FIGURES.inc(saved, source=rule)
+    logger.info(f"Figure filter for {doc_id or file_path}: {report['figures']} figures, vision calls saved per rule: {report['vision_calls_saved']}")
+    progress("partition", "done")
+    progress("split", "done", text_count, text_count)
+    progress("filter", "done", image_count, figure_filter.seen, saved=report["vision_calls_saved"])
+    progress("caption", "done", image_count, image_count)
 
+def describe_figures(kept, image_ids, figure_filter):
+    """Caption one shard's kept, stored figures that still need the vision model.
+
+    `kept` holds (element, rule, detail) from `figure_filter.check` and
+    `image_ids` maps their element ids to figure store ids; tables are
+    described by their text and near-duplicates reuse the caption of the
+    figure they matched.
+    """
+    store = get_figure_store()
+    image_ids = [image_ids[element.id] for element, _, _ in kept]
+    image_paths = [store.path(image_id)[0] for image_id in image_ids]
+
+    to_caption = [i for i, (_, rule, _) in enumerate(kept) if rule is None]
+    if to_caption:
+        fresh = caption_figures([image_paths[i] for i in to_caption])
+        for i, caption in zip(to_caption, fresh):
+            figure_filter.captions[kept[i][0].id] = caption
+
+    image_docs = []
+    for (element, rule, detail), image_id, path in zip(kept, image_ids, image_paths):
+        if rule == "table_text":
+            caption = detail
+        elif rule == "near_duplicate":
+            caption = figure_filter.captions[detail]
+        else:
+            caption = figure_filter.captions[element.id]
+        image_docs.append(Document(page_content=caption, metadata={
+            "type": "image",
+            "path": path,
+            "image_id": image_id,
+            "figure_id": image_id,
+            "page_number": element.metadata.page_number,
+        }))
+    return image_docs
+
+@telemetry.traced("upload_pdf")
+def upload_pdf(file_path, doc_id=None, progress=no_progress, strategy=None):
+    try:
+        return [doc for docs in iter_documents(file_path, doc_id, progress, strategy) for doc in docs]
     except Exception as e:
         logger.error(f"Error processing PDF {file_path}: {e}")
         raise
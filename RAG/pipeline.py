@@ -0,0 +1,79 @@
+import os
+import queue
+import threading
+import contextvars
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Items buffered between two ingestion stages; a full queue blocks the upstream stage
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "4"))
+# Chunks per embedding/upsert batch
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "256"))
+
+_DONE = object()
+
+
+class _Failed:
+    def __init__(self, error):
+        self.error = error
+
+
+def threaded(iterable, maxsize=INGEST_QUEUE_SIZE):
+    """Consume `iterable` on a background thread, yielding its items through a bounded queue.
+
+    The producer runs ahead of the consumer by at most `maxsize` items (backpressure).
+    Exceptions raised by the producer are re-raised in the consumer; closing the
+    consumer early stops the producer at its next item.
+    """
+    buffer = queue.Queue(maxsize)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+            put(_DONE)
+        except BaseException as e:
+            put(_Failed(e))
+        finally:
+            # Propagate an early stop to upstream stages
+            if hasattr(iterable, "close"):
+                iterable.close()
+
+    # The stage thread inherits the caller's request id and trace span
+    context = contextvars.copy_context()
+    thread = threading.Thread(target=context.run, args=(run,), name="ingest-stage", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failed):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+
+
+def rebatch(batches, size=INGEST_BATCH_SIZE):
+    """Regroup an iterable of lists into lists of `size` items (the last one may be shorter)."""
+    pending = []
+    for batch in batches:
+        pending.extend(batch)
+        while len(pending) >= size:
+            yield pending[:size]
+            pending = pending[size:]
+    if pending:
+        yield pending
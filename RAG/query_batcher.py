@@ -0,0 +1,110 @@
+import os
+import asyncio
+import logging
+from dotenv import load_dotenv
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Longest a query waits for others to share its forward pass; 0 dispatches every query alone
+QUERY_BATCH_WAIT_MS = float(os.getenv("QUERY_BATCH_WAIT_MS", "3"))
+# A batch is dispatched as soon as it holds this many distinct queries
+QUERY_BATCH_SIZE = int(os.getenv("QUERY_BATCH_SIZE", "32"))
+
+
+class QueryBatcher:
+    """Micro-batches concurrent query embeddings on the event loop.
+
+    While a batch is running, queries arriving within `max_wait_ms` of the
+    first pending one (or until `max_batch` distinct queries are pending) are
+    embedded by a single `embed_batch(texts)` call on `executor`, and each
+    waiting request gets its own row back. When the batcher is idle a query is
+    dispatched at once, so a lone request never pays the wait. A query that is
+    already pending or being embedded is not embedded again: later callers
+    await the same future.
+    """
+
+    def __init__(self, embed_batch, executor, max_wait_ms=QUERY_BATCH_WAIT_MS, max_batch=QUERY_BATCH_SIZE):
+        self.embed_batch = embed_batch
+        self.executor = executor
+        self.max_wait_ms = max_wait_ms
+        self.max_batch = max_batch
+        self._loop = None
+        # text -> future, for queries pending or in a running batch
+        self._futures = {}
+        self._pending = []
+        self._timer = None
+        self._running = 0
+        # The loop only holds weak references to tasks
+        self._tasks = set()
+        self.metrics = {"requests": 0, "coalesced": 0, "batches": 0, "batched_queries": 0, "max_batch_seen": 0}
+
+    def _bind(self, loop):
+        # Futures belong to one event loop; start over if a new loop (e.g. a new asyncio.run) shows up
+        if self._loop is not loop:
+            self._loop = loop
+            self._futures = {}
+            self._pending = []
+            self._timer = None
+            self._running = 0
+            self._tasks = set()
+
+    async def embed(self, text):
+        loop = asyncio.get_running_loop()
+        self._bind(loop)
+        self.metrics["requests"] += 1
+
+        future = self._futures.get(text)
+        if future is not None:
+            self.metrics["coalesced"] += 1
+        else:
+            future = self._futures[text] = loop.create_future()
+            self._pending.append(text)
+            idle = not self._running and len(self._pending) == 1
+            if idle or len(self._pending) >= self.max_batch or self.max_wait_ms <= 0:
+                self._dispatch()
+            elif self._timer is None:
+                self._timer = loop.call_later(self.max_wait_ms / 1000, self._dispatch)
+        # A cancelled request must not cancel the future other requests share
+        return await asyncio.shield(future)
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        texts, self._pending = self._pending, []
+        self.metrics["batches"] += 1
+        self.metrics["batched_queries"] += len(texts)
+        self.metrics["max_batch_seen"] = max(self.metrics["max_batch_seen"], len(texts))
+        self._running += 1
+        task = self._loop.create_task(self._run(texts))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, texts):
+        futures = [self._futures[text] for text in texts]
+        try:
+            vectors = await self._loop.run_in_executor(self.executor, self.embed_batch, texts)
+        except Exception as e:
+            logger.error(f"Batched query embedding failed for {len(texts)} queries: {e}")
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for future, vector in zip(futures, vectors):
+                if not future.done():
+                    future.set_result(vector)
+        finally:
+            self._running -= 1
+            for text, future in zip(texts, futures):
+                if self._futures.get(text) is future:
+                    del self._futures[text]
+
+    def stats(self):
+        batches = self.metrics["batches"]
+        return {**self.metrics, "mean_batch_size": self.metrics["batched_queries"] / batches if batches else 0.0}
@@ -0,0 +1,128 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "false").lower() in ("1", "true", "yes")
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+# Candidates fetched from first-stage retrieval for the cross-encoder to reorder
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "16"))
+# Scoring stops, and the first-stage order is kept, once this budget would be exceeded
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "300"))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "8192"))
+
+
+def pair_key(query, hit):
+    digest = hashlib.sha256(query.strip().lower().encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(hit["id"].encode("utf-8"))
+    return digest.hexdigest()
+
+
+class CrossEncoderReranker:
+    """Re-scores first-stage hits with a local cross-encoder on CPU.
+
+    Pairs are scored in length-sorted batches. Before each batch the expected
+    batch time (a running average) is checked against the latency budget; if
+    the budget would be exceeded the first-stage order is returned unchanged.
+    (query, chunk) scores are kept in an LRU so repeated queries cost nothing.
+    """
+
+    def __init__(
+        self,
+        model_name=RERANK_MODEL,
+        batch_size=RERANK_BATCH_SIZE,
+        budget_ms=RERANK_BUDGET_MS,
+        cache_size=RERANK_CACHE_SIZE,
+    ):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.budget_ms = budget_ms
+        self.cache_size = cache_size
+        self._model = None
+        self._lock = threading.RLock()
+        self._scores = OrderedDict()
+        self._batch_seconds = None
+        self.metrics = {"queries": 0, "pairs_scored": 0, "cache_hits": 0, "cache_misses": 0, "fallbacks": 0}
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+
+                    self._model = CrossEncoder(self.model_name, device="cpu")
+        return self._model
+
+    def _cached(self, key):
+        with self._lock:
+            score = self._scores.get(key)
+            if score is not None:
+                self._scores.move_to_end(key)
+            return score
+
+    def _store(self, keys, scores):
+        with self._lock:
+            for key, score in zip(keys, scores):
+                self._scores[key] = score
+                self._scores.move_to_end(key)
+            while len(self._scores) > self.cache_size:
+                self._scores.popitem(last=False)
+
+    def rerank(self, query, hits, k, budget_ms=None, timings=None):
+        """Return the top-k of `hits` by cross-encoder score (or the first k on budget overrun)."""
+        budget_ms = self.budget_ms if budget_ms is None else budget_ms
+        start = time.perf_counter()
+        deadline = start + budget_ms / 1000
+        self.metrics["queries"] += 1
+
+        keys = [pair_key(query, hit) for hit in hits]
+        scores = [self._cached(key) for key in keys]
+        self.metrics["cache_hits"] += sum(score is not None for score in scores)
+        self.metrics["cache_misses"] += sum(score is None for score in scores)
+        missing = sorted((i for i, score in enumerate(scores) if score is None), key=lambda i: len(hits[i]["content"]))
+
+        complete = True
+        for batch_start in range(0, len(missing), self.batch_size):
+            expected = self._batch_seconds or 0.0
+            if time.perf_counter() + expected > deadline:
+                complete = False
+                break
+            batch = missing[batch_start:batch_start + self.batch_size]
+            batch_timer = time.perf_counter()
+            batch_scores = self.model.predict(
+                [(query, hits[i]["content"]) for i in batch],
+                batch_size=len(batch),
+                show_progress_bar=False,
+            )
+            elapsed = time.perf_counter() - batch_timer
+            self._batch_seconds = elapsed if self._batch_seconds is None else 0.8 * self._batch_seconds + 0.2 * elapsed
+            batch_scores = [float(score) for score in batch_scores]
+            self._store([keys[i] for i in batch], batch_scores)
+            for i, score in zip(batch, batch_scores):
+                scores[i] = score
+            self.metrics["pairs_scored"] += len(batch)
+
+        if timings is not None:
+            timings["rerank_ms"] = (time.perf_counter() - start) * 1000
+        if not complete:
+            self.metrics["fallbacks"] += 1
+            logger.warning(f"Rerank budget of {budget_ms:.0f}ms exceeded, keeping first-stage order")
+            return hits[:k]
+
+        order = sorted(range(len(hits)), key=lambda i: scores[i], reverse=True)[:k]
+        return [{**hits[i], "rerank_score": scores[i]} for i in order]
+
+    def stats(self):
+        return {**self.metrics, "cached_pairs": len(self._scores)}
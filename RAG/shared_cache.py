@@ -0,0 +1,109 @@
+import os
+import time
+import pickle
+import sqlite3
+import logging
+import threading
+from dotenv import load_dotenv
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# SQLite file that worker processes share answers and bearer tokens through; empty keeps them per process
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", "")
+SHARED_CACHE_MAX_ENTRIES = int(os.getenv("SHARED_CACHE_MAX_ENTRIES", "10000"))
+
+
+class SharedStore:
+    """A namespace of pickled, expiring entries in a SQLite file shared by every process on the host.
+
+    The connection is opened on first use and again in each process that uses
+    the store, so a store created before the server forks its workers is safe
+    to use in all of them. Each write gets a new, increasing `seq`, which lets
+    a process pull just the entries written since it last looked (`since`).
+    An optional `tag` scopes entries, e.g. to an index version.
+    """
+
+    def __init__(self, path, namespace, max_entries=SHARED_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def _connection(self):
+        if self._pid != os.getpid():
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            with self._conn:
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS entries ("
+                    "seq INTEGER PRIMARY KEY AUTOINCREMENT, namespace TEXT NOT NULL, key TEXT NOT NULL, "
+                    "tag TEXT, value BLOB NOT NULL, expires REAL NOT NULL, UNIQUE (namespace, key))"
+                )
+                self._conn.execute("CREATE INDEX IF NOT EXISTS entries_expires ON entries (namespace, expires)")
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, key, tag=None):
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT value, tag FROM entries WHERE namespace = ? AND key = ? AND expires > ?",
+                (self.namespace, key, time.time()),
+            ).fetchone()
+        if row is None or (tag is not None and row[1] != str(tag)):
+            return None
+        return pickle.loads(row[0])
+
+    def put(self, key, value, ttl, tag=None):
+        now = time.time()
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                # REPLACE deletes and re-inserts, so an updated entry gets a new seq
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries (namespace, key, tag, value, expires) VALUES (?, ?, ?, ?, ?)",
+                    (self.namespace, key, None if tag is None else str(tag), blob, now + ttl),
+                )
+                conn.execute("DELETE FROM entries WHERE namespace = ? AND expires <= ?", (self.namespace, now))
+                if tag is not None:
+                    conn.execute("DELETE FROM entries WHERE namespace = ? AND tag != ?", (self.namespace, str(tag)))
+                (count,) = conn.execute("SELECT COUNT(*) FROM entries WHERE namespace = ?", (self.namespace,)).fetchone()
+                if count > self.max_entries:
+                    conn.execute(
+                        "DELETE FROM entries WHERE seq IN "
+                        "(SELECT seq FROM entries WHERE namespace = ? ORDER BY seq LIMIT ?)",
+                        (self.namespace, count - self.max_entries),
+                    )
+
+    def delete(self, key):
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                deleted = conn.execute(
+                    "DELETE FROM entries WHERE namespace = ? AND key = ?", (self.namespace, key)
+                ).rowcount
+        return deleted > 0
+
+    def since(self, seq, tag=None):
+        """Live entries written after `seq`, as a list of (seq, key, value) in write order."""
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT seq, key, value FROM entries WHERE namespace = ? AND seq > ? AND expires > ? "
+                "AND (? IS NULL OR tag = ?) ORDER BY seq",
+                (self.namespace, seq, time.time(), None if tag is None else str(tag), None if tag is None else str(tag)),
+            ).fetchall()
+        return [(row_seq, key, pickle.loads(value)) for row_seq, key, value in rows]
+
+
+def shared_store(namespace, path=None):
+    """The SharedStore for `namespace`, or None when SHARED_CACHE_PATH is unset (single-process mode)."""
+    path = SHARED_CACHE_PATH if path is None else path
+    return SharedStore(path, namespace) if path else None
@@ -0,0 +1,410 @@
+import os
+import re
+import json
+import time
+import uuid
+import logging
+import secrets
+import inspect
+import threading
+import functools
+import contextvars
+from bisect import bisect_left
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Finished spans are appended here as OTLP-shaped JSON lines (empty: spans are only timed, not exported)
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "")
+
+# Seconds; spans from sub-millisecond cache lookups up to multi-minute document ingestion
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+REQUEST_ID_HEADER = "x-request-id"
+REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+request_id_var = contextvars.ContextVar("request_id", default=None)
+_current_span = contextvars.ContextVar("span", default=None)
+_export_lock = threading.Lock()
+
+
+def _label_text(labelnames, labels, extra=""):
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(_escape(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(_escape(labels[name]) for name in self.labelnames), 0)
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_label_text(self.labelnames, key)} {value}" for key, value in items]
+
+    def drain(self):
+        with self._lock:
+            values, self._values = self._values, {}
+        return values
+
+    def merge(self, values):
+        with self._lock:
+            for key, value in values.items():
+                self._values[key] = self._values.get(key, 0) + value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (last is +Inf), sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(_escape(labels[name]) for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def count(self, **labels):
+        state = self._values.get(tuple(_escape(labels[name]) for name in self.labelnames))
+        return state[2] if state else 0
+
+    def render(self):
+        with self._lock:
+            items = sorted((key, [list(state[0]), state[1], state[2]]) for key, state in self._values.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket
+                lines.append(f"{self.name}_bucket{_label_text(self.labelnames, key, f'le=\"{bound}\"')} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_label_text(self.labelnames, key)} {count}")
+        return lines
+
+    def drain(self):
+        with self._lock:
+            values, self._values = self._values, {}
+        return values
+
+    def merge(self, values):
+        with self._lock:
+            for key, (counts, total, count) in values.items():
+                state = self._values.get(key)
+                if state is None:
+                    state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                state[0] = [a + b for a, b in zip(state[0], counts)]
+                state[1] += total
+                state[2] += count
+
+
+class MetricsRegistry:
+    """Process-wide metrics rendered in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._caches = {}
+
+    def register(self, metric):
+        return self._metrics.setdefault(metric.name, metric)
+
+    def register_cache(self, name, stats_fn):
+        """Expose a cache's hit/miss counts; `stats_fn` returns a dict with "hits" and "misses"."""
+        self._caches[name] = stats_fn
+
+    def cache_lines(self):
+        samples = []
+        for name, stats_fn in self._caches.items():
+            try:
+                stats = stats_fn()
+            except Exception as e:
+                logger.warning(f"Cache stats for {name} unavailable: {e}")
+                continue
+            hits, misses = stats["hits"], stats["misses"]
+            samples.append((name, hits, misses, hits / (hits + misses) if hits + misses else 0.0))
+        lines = []
+        for metric, help, kind, index in (
+            ("rag_cache_hits_total", "Cache lookups served from the cache", "counter", 1),
+            ("rag_cache_misses_total", "Cache lookups that missed", "counter", 2),
+            ("rag_cache_hit_ratio", "Hits over lookups since process start", "gauge", 3),
+        ):
+            lines += [f"# HELP {metric} {help}", f"# TYPE {metric} {kind}"]
+            lines += [f'{metric}{{cache="{sample[0]}"}} {sample[index]}' for sample in samples]
+        return lines
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines += [f"# HELP {metric.name} {metric.help}", f"# TYPE {metric.name} {metric.kind}"]
+            lines += metric.render()
+        lines += self.cache_lines()
+        return "\n".join(lines) + "\n"
+
+    def drain(self):
+        """Take (and reset) this process's counts so a parent process can merge them."""
+        return {name: metric.drain() for name, metric in self._metrics.items()}
+
+    def merge(self, drained):
+        for name, values in (drained or {}).items():
+            if name in self._metrics:
+                self._metrics[name].merge(values)
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "rag_stage_duration_seconds", "Time spent in each query and ingestion stage", ["stage"]
+))
+STAGE_ERRORS = REGISTRY.register(Counter(
+    "rag_stage_errors_total", "Stages that raised an exception", ["stage"]
+))
+HTTP_SECONDS = REGISTRY.register(Histogram(
+    "rag_http_request_duration_seconds", "HTTP request latency by route", ["method", "route", "status"]
+))
+LLM_TOKENS = REGISTRY.register(Counter(
+    "rag_llm_tokens_total", "LLM tokens by kind (prompt or completion)", ["kind"]
+))
+CHUNKS = REGISTRY.register(Counter(
+    "rag_chunks_total", "Indexed chunks by outcome (new, unchanged or stale)", ["state"]
+))
+FIGURES = REGISTRY.register(Counter(
+    "rag_figures_total",
+    "Extracted figures by how their caption was obtained (vision, cache, duplicate, near_duplicate, table_text) "
+    "or why they were dropped (small, low_entropy)",
+    ["source"],
+))
+
+
+class Span:
+    """A timed unit of work with W3C trace context ids, exportable as an OTLP span."""
+
+    def __init__(self, name, trace_id, parent_id, attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.status = "OK"
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_otlp(self):
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "attributes": [{"key": key, "value": {"stringValue": str(value)}} for key, value in self.attributes.items()],
+            "status": {"code": "STATUS_CODE_ERROR" if self.status == "ERROR" else "STATUS_CODE_OK"},
+        }
+
+
+def export_span(span):
+    if not TRACE_EXPORT_PATH:
+        return
+    line = json.dumps(span.to_otlp())
+    with _export_lock:
+        with open(TRACE_EXPORT_PATH, "a") as f:
+            f.write(line + "\n")
+
+
+def parse_traceparent(header):
+    """(trace id, parent span id) from a W3C traceparent header, or None."""
+    match = TRACEPARENT_RE.match(header or "")
+    return (match.group(1), match.group(2)) if match else None
+
+
+def current_request_id():
+    return request_id_var.get()
+
+
+def current_traceparent():
+    span = _current_span.get()
+    return span.traceparent if span is not None else None
+
+
+def propagation_context():
+    """What another process needs to continue the current request's trace."""
+    return {"request_id": current_request_id(), "traceparent": current_traceparent()}
+
+
+@contextmanager
+def request_context(request_id=None, traceparent=None):
+    """Bind a request id (generated when missing or malformed) and remote trace parent to this context."""
+    if not request_id or not REQUEST_ID_RE.match(request_id):
+        request_id = uuid.uuid4().hex
+    token = request_id_var.set(request_id)
+    remote = _current_span.set(parse_traceparent(traceparent))
+    try:
+        yield request_id
+    finally:
+        _current_span.reset(remote)
+        request_id_var.reset(token)
+
+
+@contextmanager
+def span(name, record=True, **attributes):
+    """Time a stage as a child of the current span; `record` also feeds rag_stage_duration_seconds."""
+    parent = _current_span.get()
+    if isinstance(parent, tuple):
+        # Remote parent from a traceparent header
+        trace_id, parent_id = parent
+    elif parent is not None:
+        trace_id, parent_id = parent.trace_id, parent.span_id
+    else:
+        trace_id, parent_id = secrets.token_hex(16), None
+    if request_id_var.get() is not None:
+        attributes["request.id"] = request_id_var.get()
+
+    current = Span(name, trace_id, parent_id, attributes)
+    token = _current_span.set(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    except BaseException:
+        current.status = "ERROR"
+        STAGE_ERRORS.inc(stage=name)
+        raise
+    finally:
+        if record:
+            STAGE_SECONDS.observe(time.perf_counter() - start, stage=name)
+        current.end_ns = time.time_ns()
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # Async generators may be finalised from another context
+            pass
+        export_span(current)
+
+
+def traced(name):
+    """Decorator running a sync or async function inside `span(name)`."""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def traced_iter(name, iterable):
+    """Yield from `iterable`, timing each item's production as a `name` span (e.g. one PDF shard)."""
+    iterator = iter(iterable)
+    try:
+        while True:
+            with span(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+    finally:
+        # Closing early (e.g. a failed downstream stage) must reach the wrapped generator
+        if hasattr(iterator, "close"):
+            iterator.close()
+
+
+def observe_timings(timings):
+    """Feed a retrieval `timings` dict ({"embed_ms": ...}) into the stage histogram."""
+    for stage, ms in timings.items():
+        STAGE_SECONDS.observe(ms / 1000, stage=f"retrieve.{stage.removesuffix('_ms')}")
+
+
+def run_in_context(fn, *args, **kwargs):
+    """Bind `fn` to a copy of the current context, for executors that don't copy it themselves."""
+    return functools.partial(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+class RequestTelemetryMiddleware:
+    """ASGI middleware: binds X-Request-ID and traceparent, wraps the request in a root span
+    and echoes both headers on the response."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = {key.decode("latin-1").lower(): value.decode("latin-1") for key, value in scope["headers"]}
+        status = 500
+        start = time.perf_counter()
+        with request_context(headers.get(REQUEST_ID_HEADER), headers.get("traceparent")) as request_id:
+            with span("http.request", record=False, method=scope["method"], path=scope["path"]) as current:
+                async def send_with_headers(message):
+                    nonlocal status
+                    if message["type"] == "http.response.start":
+                        status = message["status"]
+                        message["headers"] = list(message.get("headers", [])) + [
+                            (REQUEST_ID_HEADER.encode(), request_id.encode()),
+                            (b"traceparent", current.traceparent.encode()),
+                        ]
+                    await send(message)
+
+                try:
+                    await self.app(scope, receive, send_with_headers)
+                finally:
+                    current.set_attribute("http.status_code", status)
+                    # Label by route template, not raw path, to keep label cardinality bounded
+                    route = scope.get("route")
+                    HTTP_SECONDS.observe(
+                        time.perf_counter() - start,
+                        method=scope["method"],
+                        route=getattr(route, "path", "unmatched"),
+                        status=status,
+                    )
@@ -0,0 +1,673 @@
+import os
+import json
+import asyncio
+import sqlite3
+import logging
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from RAG.mmap_matrix import MmapMatrix
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "weaviate")
+COLLECTION_NAME = "Documents"
+
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", "./cache/index")
+LOCAL_INDEX_TYPE = os.getenv("LOCAL_INDEX_TYPE", "flat")
+HNSW_M = int(os.getenv("HNSW_M", "32"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+IVF_NLIST = int(os.getenv("IVF_NLIST", "256"))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "16"))
+PQ_M = int(os.getenv("PQ_M", "16"))
+# FAISS wants ~39 training points per centroid, for both the IVF lists and the 256 PQ codes
+IVF_MIN_TRAIN = max(IVF_NLIST, 256) * 39
+# Rebuild the FAISS index once this fraction of its rows are deleted
+REBUILD_TOMBSTONE_RATIO = float(os.getenv("REBUILD_TOMBSTONE_RATIO", "0.25"))
+# Largest (queries x chunks) score matrix a brute-force batched search materialises at once
+SEARCH_BLOCK_SCORES = int(os.getenv("SEARCH_BLOCK_SCORES", "16000000"))
+# How the local index stores vectors: float32, float16 (half the memory) or int8 (a quarter, plus a scale per row)
+VECTOR_DTYPE = os.getenv("VECTOR_DTYPE", "float32")
+VECTOR_DTYPES = {"float32": (np.float32, "f32"), "float16": (np.float16, "f16"), "int8": (np.int8, "i8")}
+# Vectors an int8 FAISS index trains its per-dimension ranges on; smaller indexes store fp16 until then
+SQ8_MIN_TRAIN = int(os.getenv("SQ8_MIN_TRAIN", "1000"))
+# Retrain a trained FAISS index (IVF-PQ, int8) once it holds this many times the vectors it was trained on
+RETRAIN_GROWTH = float(os.getenv("RETRAIN_GROWTH", "2"))
+# Rows gathered (and converted to float32) at a time when brute-force scoring has to copy them
+DECODE_BLOCK_ROWS = int(os.getenv("DECODE_BLOCK_ROWS", "16384"))
+# Concurrent near_vector requests of one batched Weaviate search
+WEAVIATE_SEARCH_THREADS = int(os.getenv("WEAVIATE_SEARCH_THREADS", "8"))
+
+
+class VectorBackend:
+    """Storage-agnostic interface used by populate_db / retrieve_docs.
+
+    Search hits are dicts with "id", "content", "metadata" and "score" (higher is better).
+    """
+
+    def upsert(self, ids, vectors, texts, metadatas):
+        raise NotImplementedError
+
+    def delete(self, ids):
+        raise NotImplementedError
+
+    def delete_document(self, doc_id):
+        raise NotImplementedError
+
+    def search(self, vector, k):
+        raise NotImplementedError
+
+    def search_many(self, vectors, k):
+        """search() for each of several query vectors; backends override this with a batched search."""
+        return [self.search(vector, k) for vector in vectors]
+
+    def get(self, ids):
+        """Fetch stored chunks by id, as hits with score None, in the order given."""
+        raise NotImplementedError
+
+    async def asearch(self, vector, k):
+        return await asyncio.to_thread(self.search, vector, k)
+
+    async def aget(self, ids):
+        return await asyncio.to_thread(self.get, ids)
+
+    def refresh(self):
+        """Pick up writes made by other processes now rather than on the next search."""
+        pass
+
+    def close(self):
+        pass
+
+
+class WeaviateBackend(VectorBackend):
+    def __init__(self, collection_name=COLLECTION_NAME):
+        import weaviate
+        from weaviate.classes.init import Auth
+        from weaviate.classes.config import Configure
+
+        weaviate_api_key = os.getenv("WEVIATE_API_KEY")
+        weaviate_url = os.getenv("WEVIATE_URL")
+        if not weaviate_api_key:
+            raise ValueError("WEVIATE_API_KEY environment variable is required")
+        if not weaviate_url:
+            raise ValueError("WEVIATE_URL environment variable is required")
+
+        self.client = weaviate.connect_to_weaviate_cloud(
+            cluster_url=weaviate_url,
+            auth_credentials=Auth.api_key(weaviate_api_key),
+        )
+        if not self.client.collections.exists(collection_name):
+            # Vectors are computed by EmbeddingService, never by Weaviate
+            self.client.collections.create(collection_name, vectorizer_config=Configure.Vectorizer.none())
+        self.collection = self.client.collections.get(collection_name)
+        self.collection_name = collection_name
+        self._async_client = None
+        self._async_lock = asyncio.Lock()
+
+    async def _async_collection(self):
+        import weaviate
+        from weaviate.classes.init import Auth
+
+        async with self._async_lock:
+            if self._async_client is None:
+                client = weaviate.use_async_with_weaviate_cloud(
+                    cluster_url=os.getenv("WEVIATE_URL"),
+                    auth_credentials=Auth.api_key(os.getenv("WEVIATE_API_KEY")),
+                )
+                await client.connect()
+                self._async_client = client
+        return self._async_client.collections.get(self.collection_name)
+
+    @staticmethod
+    def _to_hit(obj, score=None):
+        properties = dict(obj.properties)
+        content = properties.pop("content", "")
+        return {"id": str(obj.uuid), "content": content, "metadata": properties, "score": score}
+
+    def upsert(self, ids, vectors, texts, metadatas):
+        with self.collection.batch.dynamic() as batch:
+            for chunk_id, vector, text, metadata in zip(ids, vectors, texts, metadatas):
+                # Auto-schema can't infer a type from null or an empty list
+                properties = {key: value for key, value in metadata.items() if value is not None and value != []}
+                batch.add_object(properties={**properties, "content": text}, vector=list(map(float, vector)), uuid=chunk_id)
+        if self.collection.batch.failed_objects:
+            raise RuntimeError(f"Failed to upsert {len(self.collection.batch.failed_objects)} documents")
+
+    def delete(self, ids):
+        from weaviate.classes.query import Filter
+
+        if ids:
+            self.collection.data.delete_many(where=Filter.by_id().contains_any(list(ids)))
+
+    def delete_document(self, doc_id):
+        from weaviate.classes.query import Filter
+
+        self.collection.data.delete_many(where=Filter.by_property("doc_id").equal(doc_id))
+
+    def search(self, vector, k):
+        from weaviate.classes.query import MetadataQuery
+
+        response = self.collection.query.near_vector(
+            near_vector=list(map(float, vector)), limit=k, return_metadata=MetadataQuery(distance=True)
+        )
+        return [self._to_hit(obj, 1.0 - (obj.metadata.distance or 0.0)) for obj in response.objects]
+
+    def search_many(self, vectors, k):
+        # The client has no multi-vector query, so overlap the round trips instead
+        if len(vectors) <= 1:
+            return [self.search(vector, k) for vector in vectors]
+        with ThreadPoolExecutor(max_workers=min(len(vectors), WEAVIATE_SEARCH_THREADS)) as pool:
+            return list(pool.map(lambda vector: self.search(vector, k), vectors))
+
+    async def asearch(self, vector, k):
+        from weaviate.classes.query import MetadataQuery
+
+        collection = await self._async_collection()
+        response = await collection.query.near_vector(
+            near_vector=list(map(float, vector)), limit=k, return_metadata=MetadataQuery(distance=True)
+        )
+        return [self._to_hit(obj, 1.0 - (obj.metadata.distance or 0.0)) for obj in response.objects]
+
+    def get(self, ids):
+        from weaviate.classes.query import Filter
+
+        if not ids:
+            return []
+        response = self.collection.query.fetch_objects(
+            filters=Filter.by_id().contains_any(list(ids)), limit=len(ids)
+        )
+        by_id = {str(obj.uuid): self._to_hit(obj) for obj in response.objects}
+        return [by_id[chunk_id] for chunk_id in ids if chunk_id in by_id]
+
+    async def aget(self, ids):
+        from weaviate.classes.query import Filter
+
+        if not ids:
+            return []
+        collection = await self._async_collection()
+        response = await collection.query.fetch_objects(
+            filters=Filter.by_id().contains_any(list(ids)), limit=len(ids)
+        )
+        by_id = {str(obj.uuid): self._to_hit(obj) for obj in response.objects}
+        return [by_id[chunk_id] for chunk_id in ids if chunk_id in by_id]
+
+    def close(self):
+        self.client.close()
+
+
+class LocalBackend(VectorBackend):
+    """In-process vector index persisted under `directory`.
+
+    Vectors live in a memory-mapped matrix (one row per chunk version) and chunk
+    text/metadata in SQLite. `index_type` selects the search structure: "numpy"
+    (brute force over the memmap), or a FAISS "flat", "hnsw" or "ivfpq" index
+    whose ids are matrix rows. Deletes are tombstones; the FAISS index is rebuilt
+    from the live rows once too many accumulate. Every write bumps a version
+    number so other processes (the API vs. the ingestion workers) reload lazily.
+
+    `vector_dtype` "float16" or "int8" stores the matrix at reduced precision
+    (int8 rows are scaled per row to use the full range, with the scales in a
+    second matrix), and FAISS flat/hnsw indexes use the matching scalar
+    quantizer. It is fixed when the index is created; an existing index keeps
+    the dtype it was built with. Indexes that must be trained (IVF-PQ, the
+    int8 quantizer) are exact until enough vectors exist, and are retrained as
+    the index outgrows the vectors they were trained on. Once every chunk is
+    deleted the index accepts vectors of another dimension.
+    """
+
+    def __init__(self, directory=LOCAL_INDEX_DIR, index_type=LOCAL_INDEX_TYPE, dim=None, vector_dtype=VECTOR_DTYPE):
+        self.directory = directory
+        self.index_type = index_type
+        if vector_dtype not in VECTOR_DTYPES:
+            raise ValueError(f"Unknown VECTOR_DTYPE {vector_dtype!r}, expected one of {', '.join(VECTOR_DTYPES)}")
+        os.makedirs(directory, exist_ok=True)
+        if index_type != "numpy":
+            try:
+                import faiss  # noqa: F401
+            except ImportError:
+                logger.warning("faiss is not installed, falling back to the numpy index")
+                self.index_type = "numpy"
+
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(os.path.join(directory, "meta.sqlite"), check_same_thread=False, timeout=30)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                "row INTEGER PRIMARY KEY, chunk_id TEXT NOT NULL, doc_id TEXT, content TEXT NOT NULL, "
+                "metadata TEXT NOT NULL, deleted INTEGER NOT NULL DEFAULT 0)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_chunk_id ON chunks (chunk_id, deleted)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_doc_id ON chunks (doc_id, deleted)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+        self.dim = dim or self._meta("dim", int)
+        # Indexes created before the setting existed hold float32 vectors
+        self.vector_dtype = self._meta("vector_dtype") or ("float32" if self._meta("dim", int) else vector_dtype)
+        if self.vector_dtype != vector_dtype:
+            logger.info(f"Local index stores {self.vector_dtype} vectors; VECTOR_DTYPE={vector_dtype} applies to new indexes")
+        self.matrix = None
+        self.scales = None
+        self._index = None
+        self._live_rows = None
+        self._live_set = set()
+        self._loaded_version = -1
+        if self.dim:
+            self._open_matrix()
+
+    @property
+    def index_path(self):
+        return os.path.join(self.directory, f"{self.index_type}.faiss")
+
+    def _meta(self, key, cast=str):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return cast(row[0]) if row else None
+
+    def _set_meta(self, key, value):
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def _open_matrix(self):
+        dtype, suffix = VECTOR_DTYPES[self.vector_dtype]
+        stem = self._meta("matrix") or "vectors"
+        self.matrix = MmapMatrix(os.path.join(self.directory, f"{stem}.{suffix}"), self.dim, dtype)
+        if self.vector_dtype == "int8":
+            self.scales = MmapMatrix(os.path.join(self.directory, "scales.f32"), 1, np.float32)
+
+    def _write_vectors(self, rows, vectors):
+        """Store unit float32 `vectors` at `rows` in the matrix's dtype."""
+        if self.vector_dtype == "int8":
+            # Scale each row so its largest component maps to 127
+            scales = np.maximum(np.abs(vectors).max(axis=1, keepdims=True), 1e-12) / 127.0
+            self.scales.write(rows, scales)
+            vectors = np.rint(vectors / scales)
+        self.matrix.write(rows, vectors)
+
+    def _read_vectors(self, rows):
+        return self._decode(rows, self.matrix.read(rows))
+
+    def _decode(self, rows, stored, scales=None):
+        if self.vector_dtype == "float32":
+            return stored
+        vectors = stored.astype(np.float32)
+        if self.vector_dtype == "int8":
+            vectors *= self.scales.read(rows) if scales is None else scales[rows]
+        return vectors
+
+    def _live_scores(self, snapshot, queries):
+        """Inner products of unit `queries` (n x dim) with every live row, as an (n x live rows) float32 array."""
+        _, matrix, scales, live_rows, _ = snapshot
+        if self.vector_dtype == "float32" and len(matrix) == len(live_rows):
+            # No dead rows: brute force straight over the memory map, without a copy
+            return queries @ matrix.T
+        # Gather (and, as BLAS has no float16/int8 kernels, convert) a block of live rows at a time
+        scores = np.empty((len(queries), len(live_rows)), dtype=np.float32)
+        for start in range(0, len(live_rows), DECODE_BLOCK_ROWS):
+            rows = live_rows[start:start + DECODE_BLOCK_ROWS]
+            first, last = int(rows[0]), int(rows[-1]) + 1
+            # A run of live rows is a slice of the map; only blocks with dead rows in them are copied
+            stored = matrix[first:last] if last - first == len(rows) else matrix[rows]
+            scores[:, start:start + len(rows)] = queries @ self._decode(rows, stored, scales).T
+        return scores
+
+    @property
+    def version(self):
+        return self._meta("version", int) or 0
+
+    # ---------- index construction ----------
+
+    def _min_train(self):
+        """Vectors the FAISS index needs before it can be trained; 0 if it needs no training."""
+        if self.index_type == "ivfpq":
+            return IVF_MIN_TRAIN
+        return SQ8_MIN_TRAIN if self.vector_dtype == "int8" else 0
+
+    def _new_faiss_index(self, vectors):
+        import faiss
+
+        trainable = len(vectors) >= self._min_train()
+        # Flat and HNSW indexes hold their own copy of the vectors; keep it at the matrix's precision
+        qtype = {"float16": faiss.ScalarQuantizer.QT_fp16, "int8": faiss.ScalarQuantizer.QT_8bit}.get(self.vector_dtype)
+        if qtype == faiss.ScalarQuantizer.QT_8bit and not trainable:
+            # int8 ranges learnt from a handful of vectors would clip everything added later
+            qtype = faiss.ScalarQuantizer.QT_fp16
+        if self.index_type == "hnsw":
+            if qtype is None:
+                base = faiss.IndexHNSWFlat(self.dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+            else:
+                base = faiss.IndexHNSWSQ(self.dim, qtype, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+            base.hnsw.efSearch = HNSW_EF_SEARCH
+        elif self.index_type == "ivfpq" and trainable:
+            quantizer = faiss.IndexFlatIP(self.dim)
+            base = faiss.IndexIVFPQ(quantizer, self.dim, IVF_NLIST, PQ_M, 8, faiss.METRIC_INNER_PRODUCT)
+            base.train(vectors)
+            base.nprobe = IVF_NPROBE
+        else:
+            if self.index_type == "ivfpq":
+                # IVF-PQ needs enough vectors to train its coarse quantizer and codebooks
+                logger.info(f"Only {len(vectors)} vectors, using an exact index until IVF-PQ can be trained")
+            if qtype is None:
+                base = faiss.IndexFlatIP(self.dim)
+            else:
+                base = faiss.IndexScalarQuantizer(self.dim, qtype, faiss.METRIC_INNER_PRODUCT)
+        if qtype == faiss.ScalarQuantizer.QT_8bit:
+            # Per-dimension ranges come from the vectors at (re)build time, widened for vectors added later
+            sq = faiss.downcast_index(base.storage).sq if self.index_type == "hnsw" else base.sq
+            sq.rangestat = faiss.ScalarQuantizer.RS_minmax
+            sq.rangestat_arg = 0.2
+        if not base.is_trained:
+            base.train(vectors)
+        return faiss.IndexIDMap2(base)
+
+    def _rebuild(self):
+        rows = self._live_row_ids()
+        vectors = self._read_vectors(rows) if len(rows) else np.empty((0, self.dim), dtype=np.float32)
+        index = self._new_faiss_index(vectors)
+        if len(rows):
+            index.add_with_ids(vectors, rows)
+        self._write_index(index)
+        # Vectors the index was trained on; 0 while an exact index stands in for one that needs training
+        min_train = self._min_train()
+        self._set_meta("index_trained_rows", len(rows) if min_train and len(rows) >= min_train else 0)
+        self._index = index
+
+    def _write_index(self, index):
+        import faiss
+
+        # Readers memory-map the file: write a sibling and rename it over, so none maps a partial index
+        tmp = f"{self.index_path}.{os.getpid()}.tmp"
+        faiss.write_index(index, tmp)
+        os.replace(tmp, self.index_path)
+
+    def _live_row_ids(self):
+        return np.array(
+            [row for (row,) in self._conn.execute("SELECT row FROM chunks WHERE deleted = 0 ORDER BY row")],
+            dtype=np.int64,
+        )
+
+    def _load(self):
+        """Reload the index if another process wrote a newer version."""
+        version = self.version
+        if version == self._loaded_version:
+            return
+        dim = self._meta("dim", int)
+        if dim is not None and dim != self.dim:
+            # The first vectors, or an emptied index given another dimension, written by another process
+            self.dim = dim
+            self._open_matrix()
+        if self.matrix is not None:
+            self.matrix.refresh()
+        if self.scales is not None:
+            self.scales.refresh()
+        self._live_rows = self._live_row_ids()
+        self._live_set = set(self._live_rows.tolist())
+        if self.index_type != "numpy" and self.dim:
+            import faiss
+
+            if os.path.exists(self.index_path):
+                try:
+                    self._index = faiss.read_index(self.index_path, faiss.IO_FLAG_MMAP)
+                except RuntimeError:
+                    self._index = faiss.read_index(self.index_path)
+                self._apply_search_params()
+            else:
+                self._index = None
+        self._loaded_version = version
+
+    def _apply_search_params(self):
+        import faiss
+
+        base = faiss.downcast_index(self._index.index) if hasattr(self._index, "index") else self._index
+        if isinstance(base, faiss.IndexHNSW):
+            base.hnsw.efSearch = HNSW_EF_SEARCH
+        elif isinstance(base, faiss.IndexIVF):
+            base.nprobe = IVF_NPROBE
+
+    # ---------- writes ----------
+
+    def upsert(self, ids, vectors, texts, metadatas):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not len(ids):
+            return
+        # Cosine similarity as inner product over unit vectors
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self.dim is None:
+                    self.dim = vectors.shape[1]
+                    self._set_meta("dim", self.dim)
+                    self._set_meta("vector_dtype", self.vector_dtype)
+                    self._open_matrix()
+                elif vectors.shape[1] != self.dim:
+                    (live,) = self._conn.execute("SELECT COUNT(*) FROM chunks WHERE deleted = 0").fetchone()
+                    if live:
+                        raise ValueError(f"Vector dimension {vectors.shape[1]} does not match index dimension {self.dim}")
+                    # Every chunk was deleted, e.g. to embed them anew with another model
+                    logger.info(f"Local index is empty, changing its dimension from {self.dim} to {vectors.shape[1]}")
+                    self.dim = vectors.shape[1]
+                    self._set_meta("dim", self.dim)
+                    # Row numbers keep growing, so the new matrix never overlaps rows other processes still map
+                    self._set_meta("matrix", f"vectors-{self.dim}d")
+                    self._open_matrix()
+
+                self._tombstone(ids)
+                (next_row,) = self._conn.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM chunks").fetchone()
+                rows = np.arange(next_row, next_row + len(ids), dtype=np.int64)
+                self._write_vectors(rows, vectors)
+                self._conn.executemany(
+                    "INSERT INTO chunks (row, chunk_id, doc_id, content, metadata) VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (int(row), chunk_id, metadata.get("doc_id"), text, json.dumps(metadata))
+                        for row, chunk_id, text, metadata in zip(rows, ids, texts, metadatas)
+                    ],
+                )
+                self._commit_index(rows, vectors)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                self._loaded_version = -1
+                raise
+
+    def _tombstone(self, ids):
+        ids = list(ids)
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            self._conn.execute(
+                f"UPDATE chunks SET deleted = 1 WHERE deleted = 0 AND chunk_id IN ({','.join('?' * len(batch))})", batch
+            )
+
+    def _commit_index(self, new_rows=None, new_vectors=None):
+        if self.index_type != "numpy":
+            self._load_for_write()
+            (live,) = self._conn.execute("SELECT COUNT(*) FROM chunks WHERE deleted = 0").fetchone()
+            # Train once there are enough vectors, and retrain once the index outgrows its training set
+            min_train = self._min_train()
+            trained = self._meta("index_trained_rows", int) or 0
+            retrain = bool(min_train) and live >= max(min_train, RETRAIN_GROWTH * trained)
+            if new_rows is not None:
+                live -= len(new_rows)
+            # Rows still in the index whose chunks have since been deleted or replaced
+            dead = self._index.ntotal - live if self._index is not None else 0
+            if (
+                self._index is None
+                or self._index.d != self.dim
+                or not self._index.is_trained
+                or retrain
+                or dead > REBUILD_TOMBSTONE_RATIO * max(self._index.ntotal, 1)
+            ):
+                self._rebuild()
+            elif new_rows is not None and len(new_rows):
+                self._index.add_with_ids(new_vectors, new_rows)
+                self._write_index(self._index)
+        self._set_meta("version", self.version + 1)
+
+    def _load_for_write(self):
+        import faiss
+
+        # A memory-mapped index is read-only; writers need a private in-memory copy
+        if os.path.exists(self.index_path):
+            self._index = faiss.read_index(self.index_path)
+        else:
+            self._index = None
+
+    def delete(self, ids):
+        if not ids:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._tombstone(ids)
+                self._commit_index()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            finally:
+                self._loaded_version = -1
+
+    def delete_document(self, doc_id):
+        with self._lock:
+            ids = [chunk_id for (chunk_id,) in self._conn.execute(
+                "SELECT chunk_id FROM chunks WHERE doc_id = ? AND deleted = 0", (doc_id,)
+            )]
+        self.delete(ids)
+
+    # ---------- reads ----------
+
+    def refresh(self):
+        with self._lock:
+            self._load()
+
+    def _snapshot(self):
+        """Reload if needed and return (index, matrix view, scales view, live rows, live row set); None if empty.
+
+        Searches run on the snapshot outside the lock: a reload or write replaces
+        these objects rather than modifying them, the matrix files only grow, and
+        FAISS searches are safe to run concurrently on one index.
+        """
+        with self._lock:
+            self._load()
+            if self.dim is None or not len(self._live_rows):
+                return None
+            n_rows = int(self._live_rows[-1]) + 1
+            scales = self.scales.view(n_rows) if self.scales is not None else None
+            return self._index, self.matrix.view(n_rows), scales, self._live_rows, self._live_set
+
+    def search(self, vector, k):
+        snapshot = self._snapshot()
+        if snapshot is None:
+            return []
+        index, _, _, live_rows, live_set = snapshot
+        query = np.asarray(vector, dtype=np.float32).reshape(1, -1)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+        if self.index_type == "numpy" or index is None:
+            scores = self._live_scores(snapshot, query)[0]
+            top = np.argsort(-scores)[:min(k, len(scores))]
+            rows, row_scores = live_rows[top], scores[top]
+        else:
+            # Over-fetch so tombstoned rows still in the index don't starve the result
+            fetch = min(k + max(0, index.ntotal - len(live_rows)), max(index.ntotal, 1))
+            scores, rows = index.search(query, fetch)
+            pairs = [(int(r), float(s)) for r, s in zip(rows[0], scores[0]) if r >= 0 and int(r) in live_set][:k]
+            rows = [r for r, _ in pairs]
+            row_scores = [s for _, s in pairs]
+
+        return self._hits(rows, row_scores)
+
+    def search_many(self, vectors, k):
+        """search() for a batch of queries: one matrix product (or one FAISS call) per block of queries.
+
+        Chunks that several queries retrieve are read from SQLite once.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        snapshot = self._snapshot() if len(vectors) else None
+        if snapshot is None:
+            return [[] for _ in range(len(vectors))]
+        index, _, _, live_rows, live_set = snapshot
+        queries = vectors.reshape(len(vectors), -1)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+
+        results = []
+        if self.index_type == "numpy" or index is None:
+            top_k = min(k, len(live_rows))
+            # Bound the (queries x live rows) score matrix
+            block = max(1, SEARCH_BLOCK_SCORES // len(live_rows))
+            for start in range(0, len(queries), block):
+                scores = self._live_scores(snapshot, queries[start:start + block])
+                top = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+                top_scores = np.take_along_axis(scores, top, axis=1)
+                order = np.argsort(-top_scores, axis=1)
+                top, top_scores = np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+                results.extend(zip(live_rows[top].tolist(), top_scores.tolist()))
+        else:
+            fetch = min(k + max(0, index.ntotal - len(live_rows)), max(index.ntotal, 1))
+            all_scores, all_rows = index.search(queries, fetch)
+            for rows, scores in zip(all_rows, all_scores):
+                pairs = [(int(r), float(s)) for r, s in zip(rows, scores) if r >= 0 and int(r) in live_set][:k]
+                results.append(([r for r, _ in pairs], [s for _, s in pairs]))
+
+        records = self._records({row for rows, _ in results for row in rows})
+        return [self._hits(rows, scores, records) for rows, scores in results]
+
+    def _records(self, rows):
+        rows = [int(r) for r in rows]
+        records = {}
+        # The connection is shared with writers, so reads take the lock too (briefly, unlike the search)
+        with self._lock:
+            for start in range(0, len(rows), 500):
+                batch = rows[start:start + 500]
+                records.update(
+                    (row, (chunk_id, content, metadata))
+                    for row, chunk_id, content, metadata in self._conn.execute(
+                        f"SELECT row, chunk_id, content, metadata FROM chunks WHERE row IN ({','.join('?' * len(batch))})",
+                        batch,
+                    )
+                )
+        return records
+
+    def _hits(self, rows, scores, records=None):
+        rows = [int(r) for r in rows]
+        if not rows:
+            return []
+        records = self._records(rows) if records is None else records
+        return [
+            {"id": records[row][0], "content": records[row][1], "metadata": json.loads(records[row][2]), "score": float(score)}
+            for row, score in zip(rows, scores)
+            if row in records
+        ]
+
+    def get(self, ids):
+        ids = list(ids)
+        if not ids:
+            return []
+        with self._lock:
+            rows = {
+                chunk_id: (content, metadata)
+                for chunk_id, content, metadata in self._conn.execute(
+                    f"SELECT chunk_id, content, metadata FROM chunks WHERE deleted = 0 AND chunk_id IN ({','.join('?' * len(ids))})",
+                    ids,
+                )
+            }
+        return [
+            {"id": chunk_id, "content": rows[chunk_id][0], "metadata": json.loads(rows[chunk_id][1]), "score": None}
+            for chunk_id in ids
+            if chunk_id in rows
+        ]
+
+    def close(self):
+        self._conn.close()
+
+
+def create_backend(name=VECTOR_BACKEND):
+    if name == "weaviate":
+        return WeaviateBackend()
+    if name == "local":
+        return LocalBackend()
+    raise ValueError(f"Unknown VECTOR_BACKEND: {name}")
@@ -1,89 +1,460 @@
 import logging
-from langchain_huggingface import HuggingFaceEmbeddings
-import weaviate
-from weaviate.classes.init import Auth
-from weaviate.classes.query import Filter
-from langchain_weaviate.vectorstores import WeaviateVectorStore
+import time
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 import os
+from RAG.jobs import no_progress
+from RAG.doc_registry import DocumentRegistry, chunk_ids
+from RAG.embeddings import EmbeddingService
+from RAG.query_batcher import QueryBatcher
+from RAG.vector_backends import create_backend, VECTOR_BACKEND
+from RAG.bm25 import BM25Index
+from RAG.pipeline import threaded, rebatch
+from RAG.reranker import CrossEncoderReranker, RERANK_ENABLED, RERANK_CANDIDATES
+from RAG import telemetry
 
 load_dotenv()
 
-# Load environment variables
-weaviate_api_key = os.getenv("WEVIATE_API_KEY")
-weaviate_url = os.getenv("WEVIATE_URL")
+# Retrieval: "dense", "sparse" (BM25) or "hybrid"
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+# Fusion of the dense and sparse rankings: "rrf" or "weighted"
+FUSION_METHOD = os.getenv("FUSION_METHOD", "rrf")
+DENSE_WEIGHT = float(os.getenv("DENSE_WEIGHT", "1.0"))
+SPARSE_WEIGHT = float(os.getenv("SPARSE_WEIGHT", "1.0"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Each retriever returns k * HYBRID_CANDIDATES candidates for fusion
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "4"))
+# Seconds between BM25 index saves while a document is being ingested
+SPARSE_SAVE_INTERVAL = float(os.getenv("SPARSE_SAVE_INTERVAL", "10"))
+# Threads dedicated to query embedding on the async path
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "2"))
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Validate environment variables
-if not weaviate_api_key:
-    raise ValueError("WEVIATE_API_KEY environment variable is required")
-if not weaviate_url:
-    raise ValueError("WEVIATE_URL environment variable is required")
-
-embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-mpnet-base-v2")
-
-client = weaviate.connect_to_weaviate_cloud(
-    cluster_url=weaviate_url,
-    auth_credentials=Auth.api_key(weaviate_api_key),
-)
-vector_store = WeaviateVectorStore(
-    client=client,
-    index_name="Documents",   # schema name, Weaviate will create if missing
-    text_key="content",       # text field to store your document body
-    embedding=embeddings
-)
-
-def populate_db(all_docs):
+# Batched, cached embeddings
+embeddings = EmbeddingService()
+# Query embedding is CPU-bound; a dedicated pool keeps it from starving the default threadpool
+embedding_executor = ThreadPoolExecutor(max_workers=EMBEDDING_THREADS, thread_name_prefix="embed")
+# Concurrent requests' query embeddings share forward passes on that pool
+query_batcher = QueryBatcher(embeddings.embed_queries, embedding_executor)
+
+# Created on first use so importing this module needs no credentials or network
+_backend = None
+_sparse_index = None
+# Request threads may race to the first use; only one of them constructs
+_init_lock = threading.Lock()
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _init_lock:
+            if _backend is None:
+                _backend = create_backend(VECTOR_BACKEND)
+                logger.info(f"Using {VECTOR_BACKEND} vector backend")
+    return _backend
+
+def close_backend():
+    global _backend
+    if _backend is not None:
+        _backend.close()
+        _backend = None
+
+def get_sparse_index():
+    # Loading the BM25 pickle is proportional to corpus size; defer it to the first search or ingest
+    global _sparse_index
+    if _sparse_index is None:
+        with _init_lock:
+            if _sparse_index is None:
+                _sparse_index = BM25Index()
+    return _sparse_index
+
+def refresh_indexes():
+    """Reload whichever of the vector and BM25 indexes exist here if another process changed them."""
+    global _embedding_checked
+    # Another process may have emptied the index and rebuilt it with another model
+    _embedding_checked = False
+    if _backend is not None:
+        _backend.refresh()
+    if _sparse_index is not None:
+        _sparse_index.refresh()
+
+registry = DocumentRegistry()
+# Optional second stage; the cross-encoder is only loaded on first use
+reranker = CrossEncoderReranker()
+# Whether the loaded embedding model was found to be the one the index was built with
+_embedding_checked = False
+
+def check_embedding_model(record=False):
+    """Raise unless the loaded embedding model is the one the indexed chunks were embedded with.
+
+    Vectors of another model (say EMBEDDING_FALLBACK_MODEL) have another
+    dimension or live in another space, so searching them fails or ranks
+    nonsense. `record` (ingestion) claims an index with no documents for the
+    loaded model.
+    """
+    global _embedding_checked
+    if _embedding_checked and not record:
+        return
+    loaded = (embeddings.loaded_model, embeddings.dimension)
+    recorded = registry.claim_embedding_model(*loaded) if record else registry.embedding_model()
+    if recorded is not None and tuple(recorded) != loaded:
+        raise RuntimeError(
+            f"The index was built with embedding model {recorded[0]} ({recorded[1]} dimensions) but {loaded[0]} "
+            f"({loaded[1]} dimensions) is loaded; load {recorded[0]} again, or delete the documents and ingest them anew"
+        )
+    _embedding_checked = recorded is not None
+
+@telemetry.traced("index")
+def index_stream(doc_batches, doc_id, filename=None, content_hash=None, progress=no_progress):
+    """Index Documents as they arrive: chunk batches -> embedding -> upsert, each stage on its own thread.
+
+    Stages are joined by bounded queues, so parsing, embedding and upserting
+    overlap while memory stays bounded, and every batch is searchable as soon
+    as it is upserted. Chunks of the previous version of the document that were
+    not seen again are removed once the stream is exhausted.
+    """
     try:
-        if not all_docs:
+        check_embedding_model(record=True)
+        backend = get_backend()
+        existing_ids = registry.chunk_ids(doc_id)
+        ids = []
+        occurrences = {}
+
+        def embed_batches(batches):
+            # Chunk ids are deterministic, so only chunks the index doesn't hold yet are embedded
+            embedded = 0
+            for docs in batches:
+                batch_ids = chunk_ids(doc_id, docs, occurrences)
+                ids.extend(batch_ids)
+                new_chunks = [(chunk_id, doc) for chunk_id, doc in zip(batch_ids, docs) if chunk_id not in existing_ids]
+                texts = [doc.page_content for _, doc in new_chunks]
+                with telemetry.span("embed", chunks=len(texts)):
+                    vectors = embeddings.embed_array(texts)
+                embedded += len(texts)
+                progress("embed", "running", embedded)
+                yield new_chunks, texts, vectors
+
+        upserted = 0
+        last_save = time.monotonic()
+        progress("embed", "running", 0)
+        progress("upsert", "running", 0)
+        for new_chunks, texts, vectors in threaded(embed_batches(threaded(rebatch(threaded(doc_batches))))):
+            if not new_chunks:
+                continue
+            new_ids = [chunk_id for chunk_id, _ in new_chunks]
+            with telemetry.span("upsert", chunks=len(new_ids)):
+                backend.upsert(
+                    new_ids,
+                    vectors,
+                    texts,
+                    [{**doc.metadata, "doc_id": doc_id} for _, doc in new_chunks]
+                )
+                get_sparse_index().add(new_ids, texts)
+            # The BM25 pickle is rewritten whole, so persist it periodically rather than per batch
+            if time.monotonic() - last_save > SPARSE_SAVE_INTERVAL:
+                get_sparse_index().save()
+                last_save = time.monotonic()
+            upserted += len(new_ids)
+            progress("upsert", "running", upserted)
+
+        if not ids:
             raise ValueError("No documents provided to populate the database.")
 
-        collection = client.collections.get("Documents")
-        collection.data.delete_many(
-            where=Filter.by_property("content").like("*")
-        )
-        logger.info(f"Successfully cleared vector store")
-        texts = [doc.page_content for doc in all_docs]
-        metadatas = [doc.metadata for doc in all_docs]
+        stale_ids = existing_ids - set(ids)
+        if stale_ids:
+            backend.delete(list(stale_ids))
+        get_sparse_index().remove(stale_ids)
+        get_sparse_index().save()
+        telemetry.CHUNKS.inc(upserted, state="new")
+        telemetry.CHUNKS.inc(len(ids) - upserted, state="unchanged")
+        telemetry.CHUNKS.inc(len(stale_ids), state="stale")
+        progress("embed", "done", upserted, upserted)
+        progress("upsert", "done", upserted, upserted)
+        logger.info(f"Embedding stats: {embeddings.stats()}")
+        logger.info(f"Document {doc_id}: {upserted} new, {len(ids) - upserted} unchanged, {len(stale_ids)} stale chunks")
 
-        vector_store.add_texts(texts, metadatas=metadatas)
-        logger.info(f"Successfully added {len(all_docs)} documents to vector store")
+        registry.save(doc_id, filename or doc_id, content_hash or "", ids)
+        logger.info(f"Successfully indexed {len(ids)} documents for {doc_id}")
     except Exception as e:
         logger.error(f"Error populating database: {e}", exc_info=True)
         raise
 
-def retrieve_docs(query, k=5):
+def populate_db(all_docs, doc_id, filename=None, content_hash=None, progress=no_progress):
+    if not all_docs:
+        raise ValueError("No documents provided to populate the database.")
+    index_stream([all_docs], doc_id, filename=filename, content_hash=content_hash, progress=progress)
+
+def delete_document(doc_id):
+    try:
+        get_backend().delete_document(doc_id)
+        get_sparse_index().remove(registry.chunk_ids(doc_id))
+        get_sparse_index().save()
+        deleted = registry.delete(doc_id)
+        logger.info(f"Deleted document {doc_id} from vector store")
+        return deleted
+    except Exception as e:
+        logger.error(f"Error deleting document {doc_id}: {e}", exc_info=True)
+        raise
+
+def reciprocal_rank_fusion(rankings, weights, k=RRF_K):
+    scores = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, (chunk_id, _) in enumerate(ranking):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + weight / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+def weighted_fusion(rankings, weights):
+    # Min-max normalise each ranking's scores before mixing them
+    scores = {}
+    for ranking, weight in zip(rankings, weights):
+        if not ranking:
+            continue
+        values = [score for _, score in ranking]
+        low, high = min(values), max(values)
+        for chunk_id, score in ranking:
+            normalised = (score - low) / (high - low) if high > low else 1.0
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + weight * normalised
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+def fuse_rankings(dense_hits, sparse_ranking, k, mode, dense_weight=None, sparse_weight=None, fusion=None):
+    if mode == "sparse":
+        return sparse_ranking[:k]
+    rankings = [[(hit["id"], hit["score"]) for hit in dense_hits], sparse_ranking]
+    weights = [
+        DENSE_WEIGHT if dense_weight is None else dense_weight,
+        SPARSE_WEIGHT if sparse_weight is None else sparse_weight,
+    ]
+    if (fusion or FUSION_METHOD) == "weighted":
+        return weighted_fusion(rankings, weights)[:k]
+    return reciprocal_rank_fusion(rankings, weights)[:k]
+
+def missing_hit_ids(ranked, dense_hits):
+    # Sparse-only hits still need their text and metadata from the vector store
+    dense_ids = {hit["id"] for hit in dense_hits}
+    return [chunk_id for chunk_id, _ in ranked if chunk_id not in dense_ids]
+
+def assemble_hits(ranked, dense_hits, fetched_hits):
+    by_id = {hit["id"]: hit for hit in dense_hits + fetched_hits}
+    return [{**by_id[chunk_id], "score": score} for chunk_id, score in ranked if chunk_id in by_id]
+
+def search_plan(k, mode=None, rerank=None):
+    """(mode, rerank, candidates fused, candidates per retriever) of a search for the top `k`."""
+    mode = mode or RETRIEVAL_MODE
+    rerank = RERANK_ENABLED if rerank is None else rerank
+    # The reranker reorders an over-fetched candidate list down to k
+    fused = max(k, RERANK_CANDIDATES) if rerank else k
+    return mode, rerank, fused, fused * HYBRID_CANDIDATES if mode == "hybrid" else fused
+
+def fuse_candidates(dense_hits, sparse_rankings, k, mode, dense_weight=None, sparse_weight=None, fusion=None):
+    """Fused top-k (chunk id, score) rankings per query, and the ids of ranked chunks no dense hit carries.
+
+    The caller fetches those chunks with one backend get for all the queries.
+    """
+    ranked = [
+        fuse_rankings(hits, ranking, k, mode, dense_weight, sparse_weight, fusion)
+        for hits, ranking in zip(dense_hits, sparse_rankings)
+    ]
+    missing = list(dict.fromkeys(
+        chunk_id for ranking, hits in zip(ranked, dense_hits) for chunk_id in missing_hit_ids(ranking, hits)
+    ))
+    return ranked, missing
+
+def resolve_hits(queries, mode, dense_hits, ranked, fetched, k, rerank, timings):
+    """Hits per query: the dense hits or the fused rankings (looked up in the dense and fetched hits), reranked down to k."""
+    if mode == "dense":
+        results = dense_hits
+    else:
+        results = [assemble_hits(ranking, hits, fetched) for ranking, hits in zip(ranked, dense_hits)]
+    if rerank:
+        results = [reranker.rerank(query, hits, k, timings=timings) for query, hits in zip(queries, results)]
+    return results
+
+def search_chunks(query, k=5, mode=None, dense_weight=None, sparse_weight=None, fusion=None, timings=None, rerank=None):
+    """Return the top-k backend hits for `query`, filling `timings` with per-stage milliseconds."""
+    return search_chunks_many(
+        [query], k, mode=mode, dense_weight=dense_weight, sparse_weight=sparse_weight, fusion=fusion, timings=timings, rerank=rerank
+    )[0]
+
+def embed_queries_once(queries):
+    """Vectors for `queries`: LRU hits first, then every miss in a single forward pass."""
+    vectors = [embeddings.cached_query(query) for query in queries]
+    missing = list(dict.fromkeys(query for query, vector in zip(queries, vectors) if vector is None))
+    if missing:
+        fresh = dict(zip(missing, embeddings.embed_queries(missing)))
+        vectors = [fresh[query] if vector is None else vector for query, vector in zip(queries, vectors)]
+    return vectors
+
+def search_chunks_many(queries, k=5, mode=None, dense_weight=None, sparse_weight=None, fusion=None, timings=None, rerank=None, vectors=None):
+    """search_chunks for a batch of queries, returning one hit list per query.
+
+    The queries are embedded in one pass (or `vectors` is used) and searched
+    with one batched backend call, and chunks that only the sparse rankings
+    found are fetched with a single backend.get for the whole batch. `timings`
+    holds the batch's per-stage milliseconds.
+    """
+    mode, rerank, fused_k, fetch = search_plan(k, mode, rerank)
+    timings = {} if timings is None else timings
+    backend = get_backend()
+
+    dense_hits = [[] for _ in queries]
+    if mode in ("dense", "hybrid"):
+        check_embedding_model()
+        if vectors is None:
+            start = time.perf_counter()
+            vectors = embed_queries_once(queries)
+            timings["embed_ms"] = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        dense_hits = backend.search_many(vectors, fetch)
+        timings["dense_ms"] = (time.perf_counter() - start) * 1000
+
+    sparse_rankings = [[] for _ in queries]
+    if mode in ("sparse", "hybrid"):
+        start = time.perf_counter()
+        sparse_rankings = [get_sparse_index().search(query, fetch) for query in queries]
+        timings["sparse_ms"] = (time.perf_counter() - start) * 1000
+
+    ranked, fetched = None, []
+    if mode != "dense":
+        start = time.perf_counter()
+        ranked, missing = fuse_candidates(dense_hits, sparse_rankings, fused_k, mode, dense_weight, sparse_weight, fusion)
+        fetched = backend.get(missing) if missing else []
+        timings["fusion_ms"] = (time.perf_counter() - start) * 1000
+
+    return resolve_hits(queries, mode, dense_hits, ranked, fetched, k, rerank, timings)
+
+async def aembed_query(query):
+    """Embed a query, micro-batched with concurrent ones (served from the query LRU when repeated)."""
+    vector = embeddings.cached_query(query)
+    if vector is None:
+        vector = await query_batcher.embed(query)
+    return vector
+
+async def asearch_chunks(query, k=5, mode=None, dense_weight=None, sparse_weight=None, fusion=None, timings=None, rerank=None):
+    """Async search_chunks: the event loop only awaits, CPU work runs on executors."""
+    mode, rerank, fused_k, fetch = search_plan(k, mode, rerank)
+    timings = {} if timings is None else timings
+    backend = get_backend()
+
+    async def dense():
+        if not _embedding_checked:
+            await asyncio.to_thread(check_embedding_model)
+        start = time.perf_counter()
+        vector = await aembed_query(query)
+        timings["embed_ms"] = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        hits = await backend.asearch(vector, fetch)
+        timings["dense_ms"] = (time.perf_counter() - start) * 1000
+        return hits
+
+    async def sparse():
+        start = time.perf_counter()
+        ranking = await asyncio.to_thread(get_sparse_index().search, query, fetch)
+        timings["sparse_ms"] = (time.perf_counter() - start) * 1000
+        return ranking
+
+    # Dense and sparse retrieval run concurrently
+    dense_hits, sparse_ranking = await asyncio.gather(
+        dense() if mode in ("dense", "hybrid") else asyncio.sleep(0, []),
+        sparse() if mode in ("sparse", "hybrid") else asyncio.sleep(0, []),
+    )
+
+    ranked, fetched = None, []
+    if mode != "dense":
+        start = time.perf_counter()
+        ranked, missing = fuse_candidates([dense_hits], [sparse_ranking], fused_k, mode, dense_weight, sparse_weight, fusion)
+        fetched = await backend.aget(missing) if missing else []
+        timings["fusion_ms"] = (time.perf_counter() - start) * 1000
+
+    resolve = functools.partial(resolve_hits, [query], mode, [dense_hits], ranked, fetched, k, rerank, timings)
+    if rerank:
+        # Cross-encoder inference shares the CPU-bound embedding executor
+        return (await asyncio.get_running_loop().run_in_executor(embedding_executor, resolve))[0]
+    return resolve()[0]
+
+def format_results(results):
+    final_results = []
+    for r in results:
+        if r["metadata"].get("type") == "image":
+            final_results.append({
+                "content": r["content"],
+                "image_path": r["metadata"].get("path"),
+                "image_id": r["metadata"].get("image_id"),
+                "type": "image",
+                "doc_id": r["metadata"].get("doc_id"),
+                "page_number": r["metadata"].get("page_number"),
+                "figure_id": r["metadata"].get("figure_id")
+            })
+        else:
+            final_results.append({
+                "content": r["content"],
+                "type": "text",
+                "doc_id": r["metadata"].get("doc_id"),
+                "start_index": r["metadata"].get("start_index"),
+                "end_index": r["metadata"].get("end_index"),
+                "page_number": r["metadata"].get("page_number"),
+                "page_end": r["metadata"].get("page_end"),
+                "section": r["metadata"].get("section"),
+                "figure_ids": r["metadata"].get("figure_ids") or []
+            })
+    return final_results
+
+def log_timings(timings):
+    telemetry.observe_timings(timings)
+    logger.info("Retrieval timings: " + ", ".join(f"{stage}={ms:.1f}ms" for stage, ms in timings.items()))
+
+@telemetry.traced("retrieve")
+def retrieve_docs(query, k=5, mode=None, dense_weight=None, sparse_weight=None, timings=None, rerank=None):
+    try:
+        if not query or not query.strip():
+            raise ValueError("Query cannot be empty.")
+
+        timings = {} if timings is None else timings
+        results = search_chunks(
+            query, k, mode=mode, dense_weight=dense_weight, sparse_weight=sparse_weight, timings=timings, rerank=rerank
+        )
+        log_timings(timings)
+
+        if not results:
+            logger.warning(f"No similar documents found for query: {query}")
+
+        return format_results(results)
+
+    except Exception as e:
+        logger.error(f"Error retrieving documents: {e}")
+        raise
+
+@telemetry.traced("retrieve")
+def retrieve_many(queries, k=5, mode=None, timings=None, rerank=None, vectors=None):
+    """retrieve_docs for a batch of non-empty queries, in order."""
+    timings = {} if timings is None else timings
+    results = search_chunks_many(queries, k, mode=mode, timings=timings, rerank=rerank, vectors=vectors)
+    log_timings(timings)
+    return [format_results(hits) for hits in results]
+
+@telemetry.traced("retrieve")
+async def aretrieve_docs(query, k=5, mode=None, dense_weight=None, sparse_weight=None, timings=None, rerank=None):
     try:
         if not query or not query.strip():
             raise ValueError("Query cannot be empty.")
 
-        results = vector_store.similarity_search(
-            query=query,
-            k=k
+        timings = {} if timings is None else timings
+        results = await asearch_chunks(
+            query, k, mode=mode, dense_weight=dense_weight, sparse_weight=sparse_weight, timings=timings, rerank=rerank
         )
+        log_timings(timings)
 
         if not results:
             logger.warning(f"No similar documents found for query: {query}")
 
-        final_results = []
-        for r in results:
-            if r.metadata.get("type") == "image":
-                final_results.append({
-                    "content": r.page_content,
-                    "image_path": r.metadata.get("path"),
-                    "type": "image"
-                })
-            else:
-                final_results.append({
-                    "content": r.page_content,
-                    "type": "text"
-                })
-
-        return final_results
+        return format_results(results)
 
     except Exception as e:
         logger.error(f"Error retrieving documents: {e}")
-        raise
\ No newline at end of file
+        raise
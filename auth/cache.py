@@ -0,0 +1,144 @@
+import os
+import hmac
+import time
+import hashlib
+import secrets
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+from RAG.shared_cache import shared_store
+
+load_dotenv()
+
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "300"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "4096"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+# Lifetime of bearer tokens issued by /login; 0 disables issuance
+AUTH_TOKEN_TTL = float(os.getenv("AUTH_TOKEN_TTL", "3600"))
+
+# Per-process key: cache keys are useless outside this process and never hold a usable password digest
+_SECRET = secrets.token_bytes(32)
+
+
+class TTLCache:
+    """Bounded LRU mapping whose entries expire `ttl` seconds after insertion."""
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires, value = entry
+            if time.monotonic() > expires:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            while len(self._entries) >= self.max_entries:
+                self._entries.popitem(last=False)
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return entry[1] if entry else None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+def credential_key(username, password):
+    return hmac.new(_SECRET, f"{username}\0{password}".encode("utf-8"), hashlib.sha256).digest()
+
+
+class VerificationCache:
+    """Remembers successful password checks so bcrypt runs once per TTL per credential pair.
+
+    The stored value is the bcrypt hash the password was checked against, so a
+    password change in MongoDB invalidates the entry on the next lookup.
+    """
+
+    def __init__(self, ttl=AUTH_CACHE_TTL, max_entries=AUTH_CACHE_SIZE):
+        self._cache = TTLCache(ttl, max_entries)
+
+    def verified(self, username, password, hashed):
+        return self._cache.get(credential_key(username, password)) == hashed
+
+    def remember(self, username, password, hashed):
+        self._cache.put(credential_key(username, password), hashed)
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        return self._cache.stats()
+
+
+def token_key(token):
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class TokenStore:
+    """Opaque bearer tokens issued at /login, held in memory for `ttl` seconds.
+
+    With a `shared` SharedStore, tokens are kept there instead (by hash, never
+    in the clear), so a token issued by one worker process is accepted, and a
+    revoked one rejected, by all of them.
+    """
+
+    def __init__(self, ttl=AUTH_TOKEN_TTL, max_entries=AUTH_CACHE_SIZE, shared=None):
+        self.ttl = ttl
+        self.shared = shared
+        self._cache = TTLCache(ttl, max_entries)
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def issue(self, user):
+        token = secrets.token_urlsafe(32)
+        identity = {"username": user["username"], "role": user["role"]}
+        if self.shared is not None:
+            self.shared.put(token_key(token), identity, self.ttl)
+        else:
+            self._cache.put(token, identity)
+        return token
+
+    def get(self, token):
+        if self.shared is not None:
+            return self.shared.get(token_key(token))
+        return self._cache.get(token)
+
+    def revoke(self, token):
+        if self.shared is not None:
+            return self.shared.delete(token_key(token))
+        return self._cache.pop(token) is not None
+
+
+verification_cache = VerificationCache()
+user_cache = TTLCache(USER_CACHE_TTL, AUTH_CACHE_SIZE)
+token_store = TokenStore(shared=shared_store("tokens"))
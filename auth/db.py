@@ -1,10 +1,41 @@
 import os
 from dotenv import load_dotenv
-from pymongo import MongoClient
 
 load_dotenv()
 MONGO_URI = os.getenv("MONGO_URI")
 
-client = MongoClient(MONGO_URI)
-db = client["RBAC-USERS"]
-users_collection = db["Users"]
\ No newline at end of file
+# Clients are created on first use: a mongodb+srv URI does DNS lookups on construction
+_client = None
+_async_client = None
+
+def get_client():
+    global _client
+    if _client is None:
+        from pymongo import MongoClient
+
+        _client = MongoClient(MONGO_URI)
+    return _client
+
+def get_users_collection():
+    return get_client()["RBAC-USERS"]["Users"]
+
+# Non-blocking client for the request path
+def get_async_client():
+    global _async_client
+    if _async_client is None:
+        from pymongo import AsyncMongoClient
+
+        _async_client = AsyncMongoClient(MONGO_URI)
+    return _async_client
+
+def get_async_users_collection():
+    return get_async_client()["RBAC-USERS"]["Users"]
+
+async def close():
+    global _client, _async_client
+    if _async_client is not None:
+        await _async_client.close()
+        _async_client = None
+    if _client is not None:
+        _client.close()
+        _client = None
@@ -1,7 +1,30 @@
+import asyncio
 import bcrypt
+from auth.cache import credential_key, verification_cache
 
 def hash_password(password):
     return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
 
 def verify_password(password, hashed):
-    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
\ No newline at end of file
+    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+async def averify_password(password, hashed):
+    # bcrypt is deliberately slow; keep it off the event loop
+    return await asyncio.to_thread(verify_password, password, hashed)
+
+# Concurrent checks of the same credentials share one bcrypt call
+_inflight = {}
+
+async def acheck_credentials(username, password, hashed):
+    """averify_password behind the verification cache: bcrypt only runs on a cache miss."""
+    if verification_cache.verified(username, password, hashed):
+        return True
+    key = (credential_key(username, password), hashed)
+    task = _inflight.get(key)
+    if task is None:
+        task = _inflight[key] = asyncio.ensure_future(averify_password(password, hashed))
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    if not await asyncio.shield(task):
+        return False
+    verification_cache.remember(username, password, hashed)
+    return True
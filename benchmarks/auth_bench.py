@@ -0,0 +1,110 @@
+"""Requests/sec of an authenticated endpoint with and without the auth caches.
+
+MongoDB is replaced by an in-memory stub with injected latency; bcrypt is real
+(cost 12, the `bcrypt.gensalt()` default used by hash_password). Three paths
+are compared on `GET /login`-style requests, each after one warm-up request
+so the cached paths are measured in steady state:
+
+- uncached: user lookup + bcrypt.checkpw on every request (the previous behaviour)
+- cached:   HTTP Basic through the user-record and verification caches
+- token:    bearer token issued by /login, no password check at all
+
+Run from the repository root:
+    python -m benchmarks.auth_bench --concurrency 1 16 64
+"""
+import os
+import time
+import asyncio
+import argparse
+import tempfile
+
+_tmp = tempfile.mkdtemp(prefix="rag-auth-bench-")
+os.environ.update(
+    GROQ_API_KEY="stub",
+    VECTOR_BACKEND="local",
+    EMBEDDING_CACHE_DIR="",
+    DOC_REGISTRY_PATH=os.path.join(_tmp, "documents.sqlite"),
+    BM25_INDEX_PATH=os.path.join(_tmp, "bm25.pkl"),
+    JOBS_DB_PATH=os.path.join(_tmp, "jobs.sqlite"),
+    LOCAL_INDEX_DIR=os.path.join(_tmp, "index"),
+    CAPTION_CACHE_PATH=os.path.join(_tmp, "captions.sqlite"),
+)
+
+import httpx
+from fastapi import Depends, HTTPException
+from fastapi.security import HTTPBasicCredentials
+
+import main
+from auth.utils import hash_password, averify_password
+from auth.cache import user_cache, verification_cache
+from benchmarks.stubs import StubUsers
+
+
+def install_stubs(args):
+    user = {"username": "bench", "password": hash_password("secret"), "role": "user"}
+    users = StubUsers(args.mongo_ms / 1000, [user])
+    main.get_async_users_collection = lambda: users
+
+    # The pre-cache authentication path, for comparison
+    @main.app.get("/login/uncached")
+    async def legacy_login(credentials: HTTPBasicCredentials = Depends(main.security)):
+        found = await users.find_one({"username": credentials.username})
+        if not found or not await averify_password(credentials.password, found["password"]):
+            raise HTTPException(status_code=401, detail="Invalid credentials")
+        return {"message": f"Welcome {found['username']}", "role": found["role"]}
+
+
+async def run_load(concurrency, total, **request):
+    transport = httpx.ASGITransport(app=main.app)
+    counter = iter(range(total))
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        (await client.get(request["path"], auth=request.get("auth"), headers=request.get("headers"))).raise_for_status()
+
+        async def worker():
+            for _ in counter:
+                resp = await client.get(request["path"], auth=request.get("auth"), headers=request.get("headers"))
+                resp.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return total / (time.perf_counter() - start)
+
+
+async def issue_token():
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        resp = await client.get("/login", auth=("bench", "secret"))
+        resp.raise_for_status()
+        return resp.json()["token"]
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--requests-per-client", type=int, default=8)
+    parser.add_argument("--mongo-ms", type=float, default=5)
+    args = parser.parse_args()
+
+    import logging
+    logging.disable(logging.INFO)
+    install_stubs(args)
+    token = asyncio.run(issue_token())
+
+    paths = {
+        "uncached": {"path": "/login/uncached", "auth": ("bench", "secret")},
+        "cached": {"path": "/login", "auth": ("bench", "secret")},
+        "token": {"path": "/login", "headers": {"Authorization": f"Bearer {token}"}},
+    }
+
+    print(f"{'path':<10} {'clients':>7} {'req/s':>9}")
+    for name, request in paths.items():
+        for concurrency in args.concurrency:
+            user_cache.clear()
+            verification_cache.clear()
+            rps = asyncio.run(run_load(concurrency, concurrency * args.requests_per_client, **request))
+            print(f"{name:<10} {concurrency:>7} {rps:>9.1f}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,60 @@
+"""Captioning stage benchmark against a local stub captioner.
+
+Run from the repository root:
+    python -m benchmarks.caption_bench --figures 40 --latency 0.2
+"""
+import argparse
+import random
+import time
+
+from RAG.captioner import caption_images
+
+
+class StubAPIError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"stub error {status_code}")
+        self.status_code = status_code
+
+
+def make_stub_captioner(latency, error_rate):
+    def caption(path):
+        time.sleep(latency)
+        if random.random() < error_rate:
+            raise StubAPIError(random.choice([429, 503]))
+        return f"caption for {path}"
+    return caption
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--figures", type=int, default=40)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds per stub vision call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls failing with 429/503")
+    parser.add_argument("--rate", type=float, default=1000.0, help="Token bucket rate (requests/sec)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    args = parser.parse_args()
+
+    paths = [f"figure-{i}.jpg" for i in range(args.figures)]
+    caption_fn = make_stub_captioner(args.latency, args.error_rate)
+
+    print(f"{'concurrency':>11} {'wall (s)':>9} {'ideal (s)':>9} {'speedup':>8}")
+    baseline = None
+    for concurrency in args.concurrency:
+        start = time.perf_counter()
+        captions = caption_images(
+            paths,
+            caption_fn,
+            concurrency=concurrency,
+            rate=args.rate,
+            burst=concurrency,
+            backoff_base=args.latency,
+        )
+        elapsed = time.perf_counter() - start
+        assert captions == [f"caption for {p}" for p in paths], "captions out of order"
+        baseline = baseline or elapsed
+        ideal = -(-args.figures // concurrency) * args.latency
+        print(f"{concurrency:>11} {elapsed:>9.2f} {ideal:>9.2f} {baseline / elapsed:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
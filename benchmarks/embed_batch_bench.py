@@ -0,0 +1,108 @@
+"""Query-embedding throughput with and without micro-batching, at several client counts.
+
+Each client embeds --requests-per-client questions back to back through
+aembed_query. The stand-in model costs --pass-ms per forward pass plus
+--per-query-ms per question in it, which is the shape that makes batching pay
+off on CPU (--real uses the sentence-transformers model instead). Modes:
+
+- unbatched: every query is its own forward pass on the embedding pool (the previous behaviour)
+- batched:   QueryBatcher with --max-wait-ms / --max-batch
+
+--duplicate-rate makes that fraction of questions repeat one another, to show
+in-flight coalescing.
+
+Run from the repository root:
+    python -m benchmarks.embed_batch_bench --clients 1 8 64
+"""
+import time
+import random
+import asyncio
+import argparse
+import statistics
+
+from benchmarks.stubs import isolated_env, StubModel
+
+isolated_env(prefix="rag-embed-batch-bench-")
+
+import RAG.vector_db as vector_db
+from RAG.query_batcher import QueryBatcher
+
+
+async def unbatched(text):
+    # The pre-batching aembed_query
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(vector_db.embedding_executor, vector_db.embeddings.embed_query, text)
+
+
+def questions(run, clients, per_client, duplicate_rate):
+    rng = random.Random(0)
+    total = clients * per_client
+    texts = []
+    for i in range(total):
+        if texts and rng.random() < duplicate_rate:
+            # Repeat a question that is likely still in flight
+            texts.append(texts[max(0, len(texts) - rng.randint(1, clients))])
+        else:
+            texts.append(f"{run}: what does attention head {i} attend to?")
+    return texts
+
+
+async def run_load(embed, texts, clients):
+    latencies = []
+    queue = iter(texts)
+
+    async def client():
+        for text in queue:
+            start = time.perf_counter()
+            await embed(text)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "qps": len(texts) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[int(0.95 * (len(latencies) - 1))] * 1000,
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 64])
+    parser.add_argument("--requests-per-client", type=int, default=20)
+    parser.add_argument("--pass-ms", type=float, default=8, help="stand-in cost per forward pass")
+    parser.add_argument("--per-query-ms", type=float, default=0.5, help="stand-in cost per question in a pass")
+    parser.add_argument("--max-wait-ms", type=float, default=vector_db.query_batcher.max_wait_ms)
+    parser.add_argument("--max-batch", type=int, default=vector_db.query_batcher.max_batch)
+    parser.add_argument("--duplicate-rate", type=float, default=0.0)
+    parser.add_argument("--real", action="store_true", help="use the sentence-transformers model")
+    args = parser.parse_args()
+
+    import logging
+    logging.disable(logging.INFO)
+    if not args.real:
+        vector_db.embeddings._model = StubModel(args.pass_ms / 1000, per_text=args.per_query_ms / 1000)
+    vector_db.embeddings.embed_query("warm up")
+
+    print(f"{'mode':<10} {'clients':>7} {'q/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'passes':>7} {'mean batch':>10} {'coalesced':>9}")
+    for clients in args.clients:
+        for mode in ["unbatched", "batched"]:
+            batcher = QueryBatcher(
+                vector_db.embeddings.embed_queries, vector_db.embedding_executor, args.max_wait_ms, args.max_batch
+            )
+            passes = vector_db.embeddings.metrics["batches"]
+            texts = questions(f"{mode}-{clients}", clients, args.requests_per_client, args.duplicate_rate)
+            embed = unbatched if mode == "unbatched" else vector_db.aembed_query
+            vector_db.query_batcher = batcher
+            result = asyncio.run(run_load(embed, texts, clients))
+            stats = batcher.stats()
+            print(
+                f"{mode:<10} {clients:>7} {result['qps']:>8.1f} {result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f}"
+                f" {vector_db.embeddings.metrics['batches'] - passes:>7} {stats['mean_batch_size']:>10.1f} {stats['coalesced']:>9}"
+            )
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,164 @@
+"""Accuracy vs. speed of the CPU embedding variants and the reduced-precision vector storage.
+
+Every variant embeds the passages and questions of
+benchmarks/fixtures/retrieval_corpus.json and searches them in a temporary
+local (numpy) index. The baseline is --model on PyTorch in fp32, stored as
+float32. Reported per variant:
+
+- texts/s:    passage encoding throughput (--repeat copies of the corpus, --threads op threads)
+- query ms:   median latency of embedding one question alone
+- R@5:        recall@5 against the labelled relevant passages
+- vs fp32@5:  overlap of the top 5 with the baseline's top 5 ("recall@5 against fp32")
+- bytes/vec:  index storage per vector
+
+Variants: torch-fp32 (baseline), onnx-fp32, onnx-int8, --small-model on torch
+and onnx-int8, and the baseline vectors stored as float16 and int8. Needs
+sentence-transformers, optimum and onnxruntime, and network access (or local
+copies) for the models; ONNX exports are kept in ONNX_EXPORT_DIR.
+
+Run from the repository root:
+    python -m benchmarks.embedding_eval --threads 4 --output embedding_report.md
+"""
+import os
+import json
+import time
+import argparse
+import platform
+import tempfile
+import statistics
+
+from RAG.embeddings import EmbeddingService, EMBEDDING_MODEL, ONNX_EXPORT_DIR, quantization_target
+from RAG.vector_backends import LocalBackend
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "retrieval_corpus.json")
+K = 5
+
+
+def variants(args):
+    """name -> (EmbeddingService settings, storage dtype)."""
+    found = {
+        "torch-fp32": ({"model_name": args.model, "backend": "torch"}, "float32"),
+        "onnx-fp32": ({"model_name": args.model, "backend": "onnx", "quantization": "fp32"}, "float32"),
+        "onnx-int8": ({"model_name": args.model, "backend": "onnx", "quantization": "int8"}, "float32"),
+        "torch-fp32/float16": ({"model_name": args.model, "backend": "torch"}, "float16"),
+        "torch-fp32/int8": ({"model_name": args.model, "backend": "torch"}, "int8"),
+    }
+    if args.small_model:
+        found["small torch-fp32"] = ({"model_name": args.small_model, "backend": "torch"}, "float32")
+        found["small onnx-int8"] = ({"model_name": args.small_model, "backend": "onnx", "quantization": "int8"}, "float32")
+    return found
+
+
+def measure_encoder(service, passages, questions, repeat):
+    """(texts/s, median single-question ms) of the model behind `service`."""
+    service._encode(["warm up"] * 4)
+    # Distinct texts of the corpus's length distribution
+    texts = [f"{text} ({i})" for i in range(repeat) for text in passages]
+    start = time.perf_counter()
+    service._encode(texts)
+    throughput = len(texts) / (time.perf_counter() - start)
+    latencies = []
+    for question in questions:
+        start = time.perf_counter()
+        service._encode([question])
+        latencies.append((time.perf_counter() - start) * 1000)
+    return throughput, statistics.median(latencies)
+
+
+def rankings(passage_vectors, question_vectors, passage_ids, dtype, directory):
+    """Top-K passage ids per question from a local numpy index storing `dtype`; also bytes per vector."""
+    backend = LocalBackend(directory, index_type="numpy", vector_dtype=dtype)
+    backend.upsert(passage_ids, passage_vectors, passage_ids, [{"passage_id": pid} for pid in passage_ids])
+    ranked = [[hit["id"] for hit in hits] for hits in backend.search_many(question_vectors, K)]
+    stored = backend.matrix.row_bytes + (backend.scales.row_bytes if backend.scales is not None else 0)
+    backend.close()
+    return ranked, stored
+
+
+def evaluate(args):
+    with open(args.corpus) as f:
+        corpus = json.load(f)
+    passage_ids = [p["id"] for p in corpus["passages"]]
+    passages = [p["text"] for p in corpus["passages"]]
+    questions = [q["question"] for q in corpus["queries"]]
+    relevant = [set(q["relevant"]) for q in corpus["queries"]]
+    tmp = tempfile.mkdtemp(prefix="rag-embedding-eval-")
+
+    rows, encoders, baseline = [], {}, None
+    for name, (settings, dtype) in variants(args).items():
+        key = json.dumps(settings, sort_keys=True)
+        if key not in encoders:
+            service = EmbeddingService(cache_dir="", onnx_dir=args.onnx_dir, intra_op_threads=args.threads, **settings)
+            try:
+                if service.backend == "onnx":
+                    # Without it the service would quietly run PyTorch under this variant's name
+                    import onnxruntime  # noqa: F401
+                speed = measure_encoder(service, passages, questions, args.repeat)
+            except Exception as e:
+                print(f"{name}: skipped ({e})")
+                encoders[key] = None
+                continue
+            encoders[key] = (service.cache_name, speed, service._encode(passages), service._encode(questions))
+        if encoders[key] is None:
+            continue
+        loaded, (throughput, query_ms), passage_vectors, question_vectors = encoders[key]
+
+        ranked, stored = rankings(passage_vectors, question_vectors, passage_ids, dtype, os.path.join(tmp, str(len(rows))))
+        if baseline is None:
+            baseline = ranked
+        rows.append({
+            "variant": name,
+            "model": loaded,
+            "texts_per_sec": throughput,
+            "query_ms": query_ms,
+            "recall": statistics.mean(len(rel & set(r)) / len(rel) for rel, r in zip(relevant, ranked)),
+            "vs_fp32": statistics.mean(len(set(b) & set(r)) / K for b, r in zip(baseline, ranked)),
+            "bytes_per_vector": stored,
+        })
+    return rows, len(passages), len(questions)
+
+
+def report(rows, n_passages, n_questions, args):
+    lines = [
+        "# Embedding accuracy vs. speed",
+        "",
+        f"{n_passages} passages, {n_questions} questions ({os.path.basename(args.corpus)}); "
+        f"{platform.processor() or platform.machine()}, {os.cpu_count()} CPUs, "
+        f"{args.threads or 'default'} op threads, int8 kernels for {quantization_target()}.",
+        "",
+        "| variant | model | texts/s | query ms | R@5 | vs fp32@5 | bytes/vec |",
+        "|---|---|---:|---:|---:|---:|---:|",
+    ]
+    base = rows[0]["texts_per_sec"] if rows else 1.0
+    for row in rows:
+        lines.append(
+            f"| {row['variant']} | {row['model']} | {row['texts_per_sec']:.1f} ({row['texts_per_sec'] / base:.1f}x) "
+            f"| {row['query_ms']:.1f} | {row['recall']:.2f} | {row['vs_fp32']:.2f} | {row['bytes_per_vector']} |"
+        )
+    return "\n".join(lines) + "\n"
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=FIXTURE)
+    parser.add_argument("--model", default=EMBEDDING_MODEL)
+    parser.add_argument("--small-model", default="sentence-transformers/all-MiniLM-L6-v2", help="'' to skip")
+    parser.add_argument("--threads", type=int, default=0, help="op threads per forward pass (0: runtime default)")
+    parser.add_argument("--repeat", type=int, default=20, help="copies of the corpus encoded for texts/s")
+    parser.add_argument("--onnx-dir", default=ONNX_EXPORT_DIR)
+    parser.add_argument("--output", help="also write the report (markdown) to this file")
+    args = parser.parse_args()
+
+    import logging
+    logging.disable(logging.WARNING)
+
+    rows, n_passages, n_questions = evaluate(args)
+    text = report(rows, n_passages, n_questions, args)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main_cli()
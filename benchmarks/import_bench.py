@@ -0,0 +1,80 @@
+"""Cold-start time: how long `import main` and the RAG modules take in a fresh interpreter.
+
+Each module is imported --runs times in a new process with no credentials in
+the environment (nothing should need them at import), and the median wall
+time is reported together with the slowest top-level imports from
+`python -X importtime`. --max-seconds turns the check into a regression gate.
+
+Run from the repository root:
+    python -m benchmarks.import_bench --runs 5 --max-seconds 2
+"""
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+
+MODULES = ["main", "RAG.vector_db", "RAG.llm", "RAG.jobs", "RAG.pdf_processor", "auth.db"]
+CREDENTIALS = ["GROQ_API_KEY", "MONGO_URI", "WEAVIATE_API_KEY", "WEAVIATE_URL"]
+
+
+def clean_env():
+    return {key: value for key, value in os.environ.items() if key not in CREDENTIALS}
+
+
+def time_import(module, env):
+    code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+    result = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        return None, result.stderr.strip().splitlines()[-1]
+    return float(result.stdout.strip().splitlines()[-1]), None
+
+
+def slowest_imports(module, env, top):
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], env=env, capture_output=True, text=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # Direct children of the measured module only
+        if name.startswith("   ") and not name.startswith("    "):
+            rows.append((int(cumulative) / 1000, name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", nargs="+", default=MODULES)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=5)
+    parser.add_argument("--max-seconds", type=float, help="fail if `import main` is slower than this")
+    args = parser.parse_args()
+
+    env = clean_env()
+    failed = False
+    print(f"{'module':<20} {'median s':>9} {'min s':>7}")
+    for module in args.modules:
+        times, error = [], None
+        for _ in range(args.runs):
+            seconds, error = time_import(module, env)
+            if error:
+                break
+            times.append(seconds)
+        if error:
+            failed = True
+            print(f"{module:<20} import failed: {error}")
+            continue
+        print(f"{module:<20} {statistics.median(times):>9.3f} {min(times):>7.3f}")
+        if module == "main" and args.max_seconds and statistics.median(times) > args.max_seconds:
+            failed = True
+            print(f"{'':<20} slower than --max-seconds {args.max_seconds}")
+
+    print("\nslowest imports under main:")
+    for ms, name in slowest_imports("main", env, args.top):
+        print(f"  {ms:>8.1f} ms  {name}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,111 @@
+"""Peak RSS and time-to-first-searchable of streaming vs. all-at-once ingestion.
+
+A synthetic document of --pages pages is "parsed" with --parse-ms of latency
+per page (standing in for partition_pdf), embedded with a stub model and
+indexed into the local backend. Two modes are compared, each in a fresh
+process so peak RSS is not shared:
+
+- batch:  build every Document, then populate_db (the previous behaviour)
+- stream: iter_documents-style generator fed to index_stream
+
+Run from the repository root:
+    python -m benchmarks.ingest_bench --pages 1000
+"""
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+
+from benchmarks.stubs import StubModel
+
+
+def synthetic_pages(pages, parse_ms, page_chars):
+    from langchain_core.documents import Document
+
+    words = ("attention transformer encoder decoder layer head residual softmax query key value " * 64).split()
+    for page in range(pages):
+        time.sleep(parse_ms / 1000)
+        text = " ".join(words[(page + i) % len(words)] for i in range(page_chars // 8))
+        yield [
+            Document(page_content=f"page {page} part {part}: {text[:1000]}", metadata={"type": "text"})
+            for part in range(max(page_chars // 1000, 1))
+        ]
+
+
+def run_mode(args):
+    tmp = tempfile.mkdtemp(prefix="rag-ingest-bench-")
+    os.environ.update(
+        VECTOR_BACKEND="local",
+        LOCAL_INDEX_TYPE=args.index_type,
+        EMBEDDING_CACHE_DIR="",
+        DOC_REGISTRY_PATH=os.path.join(tmp, "documents.sqlite"),
+        BM25_INDEX_PATH=os.path.join(tmp, "bm25.pkl"),
+        LOCAL_INDEX_DIR=os.path.join(tmp, "index"),
+    )
+    import logging
+    logging.disable(logging.INFO)
+
+    import RAG.vector_db as vector_db
+
+    vector_db.embeddings._model = StubModel(args.embed_ms / 1000, dim=args.dim)
+    backend = vector_db.get_backend()
+    first_upsert = []
+    upsert = backend.upsert
+
+    def timed_upsert(*a, **kw):
+        upsert(*a, **kw)
+        if not first_upsert:
+            first_upsert.append(time.perf_counter())
+
+    backend.upsert = timed_upsert
+    pages = synthetic_pages(args.pages, args.parse_ms, args.page_chars)
+
+    start = time.perf_counter()
+    if args.mode == "batch":
+        vector_db.populate_db([doc for docs in pages for doc in docs], "bench")
+    else:
+        vector_db.index_stream(pages, "bench")
+    elapsed = time.perf_counter() - start
+
+    hits = backend.search(np.ones(args.dim, dtype=np.float32), 1)
+    print(json.dumps({
+        "mode": args.mode,
+        "seconds": elapsed,
+        "first_searchable_s": first_upsert[0] - start,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "searchable": bool(hits),
+    }))
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=1000)
+    parser.add_argument("--page-chars", type=int, default=3000)
+    parser.add_argument("--parse-ms", type=float, default=5)
+    parser.add_argument("--embed-ms", type=float, default=20)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--index-type", default="flat")
+    parser.add_argument("--mode", choices=["batch", "stream"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args)
+        return
+
+    print(f"{'mode':<7} {'seconds':>8} {'first searchable s':>19} {'peak RSS MB':>12}")
+    for mode in ["batch", "stream"]:
+        out = subprocess.run(
+            [sys.executable, "-m", "benchmarks.ingest_bench", *sys.argv[1:], "--mode", mode],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        result = json.loads(out.strip().splitlines()[-1])
+        print(f"{mode:<7} {result['seconds']:>8.1f} {result['first_searchable_s']:>19.2f} {result['peak_rss_mb']:>12.0f}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,154 @@
+"""Concurrent request capacity of /query against stubbed backends.
+
+Every external dependency is replaced by a stub with injected latency:
+the Mongo user lookup, bcrypt, the query embedding, the vector search and
+the Groq completion. The async /query endpoint is compared with the previous
+synchronous code path, mounted here as a plain `def` endpoint that FastAPI
+runs in its threadpool.
+
+Run from the repository root:
+    python -m benchmarks.load_test --concurrency 1 16 64 256
+"""
+import os
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+
+# Keep every on-disk cache out of the working tree and stub the credentials
+_tmp = tempfile.mkdtemp(prefix="rag-load-test-")
+os.environ.update(
+    GROQ_API_KEY="stub",
+    VECTOR_BACKEND="local",
+    RETRIEVAL_MODE="dense",
+    EMBEDDING_CACHE_DIR="",
+    DOC_REGISTRY_PATH=os.path.join(_tmp, "documents.sqlite"),
+    BM25_INDEX_PATH=os.path.join(_tmp, "bm25.pkl"),
+    JOBS_DB_PATH=os.path.join(_tmp, "jobs.sqlite"),
+    LOCAL_INDEX_DIR=os.path.join(_tmp, "index"),
+    CAPTION_CACHE_PATH=os.path.join(_tmp, "captions.sqlite"),
+)
+
+import httpx
+from fastapi import Depends
+from fastapi.security import HTTPBasicCredentials
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+
+import main
+import auth.utils
+import RAG.llm
+import RAG.vector_db
+from RAG.vector_backends import VectorBackend
+from benchmarks.stubs import StubModel, StubUsers
+from schemas.query import QueryInput
+
+
+class StubBackend(VectorBackend):
+    def __init__(self, latency):
+        self.latency = latency
+        self.hits = [
+            {"id": str(i), "content": f"passage {i}", "metadata": {"type": "text"}, "score": 1.0} for i in range(5)
+        ]
+
+    def search(self, vector, k):
+        time.sleep(self.latency)
+        return self.hits[:k]
+
+    async def asearch(self, vector, k):
+        await asyncio.sleep(self.latency)
+        return self.hits[:k]
+
+    def get(self, ids):
+        return []
+
+    async def aget(self, ids):
+        return []
+
+
+def install_stubs(args):
+    users = StubUsers(args.mongo_ms / 1000, [{"username": "bench", "password": "stub", "role": "user"}])
+    main.get_async_users_collection = lambda: users
+
+    def verify_password(password, hashed):
+        time.sleep(args.bcrypt_ms / 1000)
+        return True
+
+    auth.utils.verify_password = verify_password
+    RAG.vector_db.embeddings._model = StubModel(args.embed_ms / 1000)
+    RAG.vector_db._backend = StubBackend(args.search_ms / 1000)
+    # The stub model gives every question the same embedding; keep the semantic answer cache out of the measurement
+    main.answer_cache.threshold = float("inf")
+
+    def complete(prompt):
+        time.sleep(args.llm_ms / 1000)
+        return AIMessage(content="stub answer")
+
+    async def acomplete(prompt):
+        await asyncio.sleep(args.llm_ms / 1000)
+        return AIMessage(content="stub answer")
+
+    RAG.llm.get_chain(RunnableLambda(complete, afunc=acomplete))
+
+    # The pre-async request path, for comparison
+    @main.app.post("/query/sync")
+    def legacy_inference(query: QueryInput, credentials: HTTPBasicCredentials = Depends(main.security)):
+        user = users.find_one_sync({"username": credentials.username})
+        verify_password(credentials.password, user["password"])
+        related_docs = RAG.vector_db.retrieve_docs(query.question)
+        full_context, image_paths = main.build_context(related_docs)
+        response = RAG.llm.llm_inference(query.question, full_context)
+        return {"response": response.content, "images": image_paths}
+
+
+async def run_load(path, concurrency, total):
+    transport = httpx.ASGITransport(app=main.app)
+    latencies = []
+    counter = iter(range(total))
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", auth=("bench", "stub"), timeout=None) as client:
+        async def worker():
+            for i in counter:
+                # Unique questions so the query embedding cache never short-circuits the stub model
+                start = time.perf_counter()
+                resp = await client.post(path, json={"question": f"question {path} {i}"})
+                latencies.append(time.perf_counter() - start)
+                resp.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "rps": total / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[int(0.95 * (len(latencies) - 1))] * 1000,
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64, 256])
+    parser.add_argument("--requests-per-client", type=int, default=4)
+    parser.add_argument("--mongo-ms", type=float, default=5)
+    parser.add_argument("--bcrypt-ms", type=float, default=20)
+    parser.add_argument("--embed-ms", type=float, default=5)
+    parser.add_argument("--search-ms", type=float, default=30)
+    parser.add_argument("--llm-ms", type=float, default=300)
+    args = parser.parse_args()
+
+    import logging
+    logging.disable(logging.INFO)
+    install_stubs(args)
+
+    print(f"{'path':<12} {'clients':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    for path in ["/query/sync", "/query"]:
+        for concurrency in args.concurrency:
+            result = asyncio.run(run_load(path, concurrency, concurrency * args.requests_per_client))
+            print(f"{path:<12} {concurrency:>7} {result['rps']:>8.1f} {result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,57 @@
+"""Pages/sec of PDF partitioning as the worker count grows.
+
+Runs RAG.pdf_partition.partition_document on a real PDF (unstructured and its
+layout models must be installed). Each worker count is run once to warm the
+pool, which loads the layout model in every worker, and then timed.
+
+Run from the repository root:
+    python -m benchmarks.partition_bench paper.pdf --workers 1 2 4 --strategy hi_res auto
+"""
+import time
+import shutil
+import argparse
+import tempfile
+
+from RAG import pdf_partition
+
+
+def run(pdf_path, workers, strategy):
+    output_dir = tempfile.mkdtemp(prefix="rag-partition-bench-")
+    try:
+        start = time.perf_counter()
+        elements = pdf_partition.partition_document(pdf_path, output_dir, policy=strategy, workers=workers)
+        return time.perf_counter() - start, len(elements)
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdf")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--strategy", nargs="+", default=["hi_res", "auto"])
+    parser.add_argument("--pages-per-shard", type=int, default=pdf_partition.PARTITION_PAGES_PER_SHARD)
+    args = parser.parse_args()
+
+    import logging
+    logging.disable(logging.INFO)
+    pdf_partition.PARTITION_PAGES_PER_SHARD = args.pages_per_shard
+    pdf_partition.PARTITION_MIN_PAGES = 0
+
+    pages = len(pdf_partition.plan_pages(args.pdf, "fast"))
+    for strategy in args.strategy:
+        plan = pdf_partition.plan_pages(args.pdf, strategy)
+        mix = ", ".join(f"{s}={plan.count(s)}" for s in pdf_partition.STRATEGIES if plan.count(s))
+        print(f"{args.pdf}: {pages} pages, strategy {strategy} ({mix})")
+        print(f"{'workers':>7} {'seconds':>8} {'pages/s':>8} {'speedup':>8} {'elements':>8}")
+        baseline = None
+        for workers in args.workers:
+            run(args.pdf, workers, strategy)
+            seconds, elements = run(args.pdf, workers, strategy)
+            baseline = baseline or seconds
+            print(f"{workers:>7} {seconds:>8.1f} {pages / seconds:>8.2f} {baseline / seconds:>7.2f}x {elements:>8}")
+    pdf_partition.shutdown()
+
+
+if __name__ == "__main__":
+    main_cli()
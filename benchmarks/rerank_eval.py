@@ -0,0 +1,106 @@
+"""Offline retrieval evaluation: recall@k and per-stage latency, with and without reranking.
+
+Indexes benchmarks/fixtures/retrieval_corpus.json into a temporary local
+backend with the real embedding model, then runs every labelled query through
+dense, hybrid and hybrid + cross-encoder retrieval. Needs sentence-transformers
+and network access (or a local copy) for the embedding and reranker models.
+
+Run from the repository root:
+    python -m benchmarks.rerank_eval --k 1 3 5
+"""
+import os
+import json
+import argparse
+import tempfile
+import statistics
+
+_tmp = tempfile.mkdtemp(prefix="rag-rerank-eval-")
+os.environ.update(
+    VECTOR_BACKEND="local",
+    DOC_REGISTRY_PATH=os.path.join(_tmp, "documents.sqlite"),
+    BM25_INDEX_PATH=os.path.join(_tmp, "bm25.pkl"),
+    LOCAL_INDEX_DIR=os.path.join(_tmp, "index"),
+)
+
+from langchain_core.documents import Document
+
+import RAG.vector_db as vector_db
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "retrieval_corpus.json")
+
+CONFIGS = {
+    "dense": {"mode": "dense", "rerank": False},
+    "hybrid": {"mode": "hybrid", "rerank": False},
+    "hybrid+rerank": {"mode": "hybrid", "rerank": True},
+}
+
+
+def load_corpus(path):
+    with open(path) as f:
+        corpus = json.load(f)
+    docs = [
+        Document(page_content=p["text"], metadata={"type": "text", "passage_id": p["id"], "page_number": p["page"]})
+        for p in corpus["passages"]
+    ]
+    return docs, corpus["queries"]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[int(q * (len(values) - 1))] if values else 0.0
+
+
+def evaluate(queries, config, ks):
+    found = {k: [] for k in ks}
+    timings = []
+    for query in queries:
+        stage_ms = {}
+        hits = vector_db.search_chunks(query["question"], max(ks), timings=stage_ms, **config)
+        timings.append(stage_ms)
+        ranked = [hit["metadata"].get("passage_id") for hit in hits]
+        relevant = set(query["relevant"])
+        for k in ks:
+            found[k].append(len(relevant & set(ranked[:k])) / len(relevant))
+    recall = {k: statistics.mean(values) for k, values in found.items()}
+    stages = sorted({stage for t in timings for stage in t})
+    latency = {stage: (statistics.mean(t.get(stage, 0.0) for t in timings), percentile([t.get(stage, 0.0) for t in timings], 0.95)) for stage in stages}
+    return recall, latency
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=FIXTURE)
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 3, 5])
+    parser.add_argument("--candidates", type=int, default=vector_db.RERANK_CANDIDATES)
+    parser.add_argument("--budget-ms", type=float, default=vector_db.reranker.budget_ms)
+    args = parser.parse_args()
+
+    import logging
+    logging.disable(logging.WARNING)
+    vector_db.RERANK_CANDIDATES = args.candidates
+    vector_db.reranker.budget_ms = args.budget_ms
+
+    docs, queries = load_corpus(args.corpus)
+    vector_db.populate_db(docs, "eval", filename=os.path.basename(args.corpus))
+    # Load both models before timing anything
+    vector_db.search_chunks("warm up", 1, mode="hybrid", rerank=True)
+
+    header = f"{'config':<15}" + "".join(f"{f'R@{k}':>7}" for k in args.k)
+    print(f"{len(docs)} passages, {len(queries)} queries\n")
+    print(header)
+    latencies = {}
+    for name, config in CONFIGS.items():
+        # Each config pays for its own query embeddings
+        vector_db.embeddings._queries.clear()
+        recall, latencies[name] = evaluate(queries, config, args.k)
+        print(f"{name:<15}" + "".join(f"{recall[k]:>7.2f}" for k in args.k))
+
+    print(f"\n{'config':<15} {'stage':<11} {'mean ms':>8} {'p95 ms':>8}")
+    for name, stages in latencies.items():
+        for stage, (mean, p95) in stages.items():
+            print(f"{name:<15} {stage:<11} {mean:>8.1f} {p95:>8.1f}")
+    print(f"\nreranker: {vector_db.reranker.stats()}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,165 @@
+"""Offline stand-ins for the cloud services, with injected latency.
+
+- StubModel:      the sentence-transformers embedding model
+- LatencyBackend: Weaviate Cloud, as the local backend plus a network round trip per call
+- StubUsers:      the MongoDB users collection
+- StubGroq:       the Groq vision client used for figure captioning
+- stub_chat:      the Groq chat model behind the answer chain
+
+Importing this module imports nothing from RAG, so `isolated_env` can still
+redirect every on-disk cache to a temporary directory before the RAG modules
+read their settings.
+"""
+import os
+import time
+import asyncio
+import hashlib
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from types import SimpleNamespace
+
+
+def isolated_env(prefix="rag-bench-", **overrides):
+    """Point every on-disk cache and index at a fresh temporary directory; returns the directory."""
+    tmp = tempfile.mkdtemp(prefix=prefix)
+    os.environ.update(
+        GROQ_API_KEY="stub",
+        VECTOR_BACKEND="local",
+        EMBEDDING_CACHE_DIR="",
+        DOC_REGISTRY_PATH=os.path.join(tmp, "documents.sqlite"),
+        BM25_INDEX_PATH=os.path.join(tmp, "bm25.pkl"),
+        JOBS_DB_PATH=os.path.join(tmp, "jobs.sqlite"),
+        LOCAL_INDEX_DIR=os.path.join(tmp, "index"),
+        CAPTION_CACHE_PATH=os.path.join(tmp, "captions.sqlite"),
+        FIGURE_STORE_DIR=os.path.join(tmp, "figure_store"),
+        INGEST_LOCK_PATH=os.path.join(tmp, "ingest.lock"),
+        SHARED_CACHE_PATH="",
+        **overrides,
+    )
+    return tmp
+
+
+class StubModel:
+    """Stands in for the sentence-transformers model: `latency` seconds per encode call,
+    plus `per_text` seconds per text in it.
+
+    Vectors are derived from a hash of the text, so equal texts embed equally
+    and different texts don't collide in the semantic answer cache.
+    """
+
+    def __init__(self, latency, dim=768, per_text=0.0):
+        self.latency = latency
+        self.per_text = per_text
+        self.dim = dim
+        self.max_seq_length = 384
+        self.tokenizer = lambda texts, **kwargs: {"input_ids": [[0] * len(t.split()) for t in texts]}
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def encode(self, texts, **kwargs):
+        time.sleep(self.latency + self.per_text * len(texts))
+        vectors = np.empty((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+            vectors[i] = np.random.default_rng(seed).standard_normal(self.dim)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class LatencyBackend:
+    """Wraps a real VectorBackend, adding `latency` seconds to every call like a remote vector store."""
+
+    def __init__(self, inner, latency):
+        self.inner = inner
+        self.latency = latency
+
+    def upsert(self, ids, vectors, texts, metadatas):
+        time.sleep(self.latency)
+        return self.inner.upsert(ids, vectors, texts, metadatas)
+
+    def delete(self, ids):
+        time.sleep(self.latency)
+        return self.inner.delete(ids)
+
+    def delete_document(self, doc_id):
+        time.sleep(self.latency)
+        return self.inner.delete_document(doc_id)
+
+    def search(self, vector, k):
+        time.sleep(self.latency)
+        return self.inner.search(vector, k)
+
+    def search_many(self, vectors, k):
+        # Like WeaviateBackend.search_many: a round trip per query, overlapped on threads
+        with ThreadPoolExecutor(max_workers=min(len(vectors), 8) or 1) as pool:
+            return list(pool.map(lambda vector: self.search(vector, k), vectors))
+
+    def get(self, ids):
+        time.sleep(self.latency)
+        return self.inner.get(ids)
+
+    async def asearch(self, vector, k):
+        # The async Weaviate client waits on the network without holding a thread
+        await asyncio.sleep(self.latency)
+        return await asyncio.to_thread(self.inner.search, vector, k)
+
+    async def aget(self, ids):
+        await asyncio.sleep(self.latency)
+        return await asyncio.to_thread(self.inner.get, ids)
+
+    def close(self):
+        self.inner.close()
+
+
+class StubUsers:
+    """The users collection: `latency` seconds per lookup, users held in a dict."""
+
+    def __init__(self, latency, users=()):
+        self.latency = latency
+        self.users = {user["username"]: user for user in users}
+
+    def find_one_sync(self, query):
+        # The blocking pymongo lookup of the pre-async request path
+        time.sleep(self.latency)
+        return self.users.get(query.get("username"))
+
+    async def find_one(self, query):
+        await asyncio.sleep(self.latency)
+        return self.users.get(query.get("username"))
+
+    async def insert_one(self, document):
+        await asyncio.sleep(self.latency)
+        self.users[document["username"]] = document
+
+
+class StubGroq:
+    """The Groq client's `chat.completions.create`, for figure captioning."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+        self.chat = self
+        self.completions = self
+
+    def create(self, messages, model, **kwargs):
+        time.sleep(self.latency)
+        self.calls += 1
+        message = SimpleNamespace(content=f"Stub caption {self.calls}: a figure from the document.")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+def stub_chat(latency, answer="stub answer"):
+    """A chat model runnable for RAG.llm.get_chain: `latency` seconds per completion."""
+    from langchain_core.messages import AIMessage
+    from langchain_core.runnables import RunnableLambda
+
+    def complete(prompt):
+        time.sleep(latency)
+        return AIMessage(content=answer)
+
+    async def acomplete(prompt):
+        await asyncio.sleep(latency)
+        return AIMessage(content=answer)
+
+    return RunnableLambda(complete, afunc=acomplete)
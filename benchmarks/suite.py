@@ -0,0 +1,419 @@
+"""End-to-end benchmark suite: the real code paths against offline stand-ins for Groq, Weaviate and Mongo.
+
+Scenarios, each run in a fresh process so peak RSS is its own:
+
+- ingest:   upload_pdf on every fixture PDF, then populate_db with the chunks
+- retrieve: retrieve_docs for the fixture questions over the indexed chunks
+- query:    POST /query through the ASGI app, --concurrency clients
+- batch:    answer_batch (behind POST /query/batch) on --requests questions, timing each answer
+- upload:   POST /uploadfile, polling GET /jobs/{id} until the job completes
+
+Fixtures are the PDFs in pdfs/ (1706.03762v7.pdf is bundled) and the questions
+in benchmarks/fixtures/retrieval_corpus.json. Without the PDF parsing stack
+(unstructured, PyMuPDF) the index is built from that file's passages instead,
+and the PDF-only scenarios are reported as skipped. Every stand-in waits for
+its --*-ms latency (see benchmarks/stubs.py).
+
+Results are written as JSON to benchmarks/results/<commit>.json; --baseline
+compares them with an earlier run and exits non-zero on a regression beyond
+--tolerance.
+
+Run from the repository root:
+    python -m benchmarks.suite
+    python -m benchmarks.suite --scenarios query --concurrency 16 --baseline benchmarks/results/abc123.json
+"""
+import os
+import sys
+import json
+import time
+import glob
+import random
+import asyncio
+import platform
+import argparse
+import resource
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ["ingest", "retrieve", "query", "batch", "upload"]
+CORPUS = os.path.join(os.path.dirname(__file__), "fixtures", "retrieval_corpus.json")
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+# Metrics compared against a baseline, and whether a higher value is better
+COMPARED = {"p50_ms": False, "p95_ms": False, "p99_ms": False, "throughput": True, "peak_rss_mb": False}
+
+
+def latency_stats(seconds):
+    ordered = sorted(seconds)
+
+    def percentile(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+
+    return {
+        "count": len(ordered),
+        "mean_ms": statistics.mean(ordered) * 1000,
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+    }
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux, bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def install_stubs(args):
+    """Swap every cloud dependency for its stand-in; returns the stub Groq client."""
+    import main
+    import RAG.llm
+    import RAG.jobs
+    import RAG.vector_db as vector_db
+    from concurrent.futures import ThreadPoolExecutor
+    from RAG.vector_backends import create_backend
+    from auth.utils import hash_password
+    from benchmarks.stubs import StubModel, LatencyBackend, StubUsers, StubGroq, stub_chat
+
+    vector_db.embeddings._model = StubModel(args.embed_ms / 1000)
+    vector_db._backend = LatencyBackend(create_backend("local"), args.weaviate_ms / 1000)
+    users = StubUsers(args.mongo_ms / 1000, [
+        {"username": "bench-user", "password": hash_password("secret"), "role": "user"},
+        {"username": "bench-admin", "password": hash_password("secret"), "role": "admin"},
+    ])
+    main.get_async_users_collection = lambda: users
+    RAG.llm.get_chain(stub_chat(args.llm_ms / 1000))
+    # Ingestion jobs run in threads of this process so they see the stubs
+    RAG.jobs._executor = ThreadPoolExecutor(max_workers=1)
+    main.UPLOAD_DIR = os.path.join(os.environ["BENCH_TMP"], "uploads")
+    os.makedirs(main.UPLOAD_DIR, exist_ok=True)
+
+    groq = StubGroq(args.caption_ms / 1000)
+    try:
+        import RAG.pdf_processor as pdf_processor
+    except ImportError:
+        return groq
+    pdf_processor._client = groq
+    pdf_processor.figure_dir = os.path.join(os.environ["BENCH_TMP"], "figures")
+    return groq
+
+
+def fixture_pdfs(args):
+    return sorted(glob.glob(os.path.join(ROOT, args.pdfs)))
+
+
+def load_questions():
+    with open(CORPUS) as f:
+        return [query["question"] for query in json.load(f)["queries"]]
+
+
+def parse_fixtures(args):
+    """(Documents, source) from the fixture PDFs, or the JSON passages without a PDF parser."""
+    try:
+        from RAG.pdf_processor import upload_pdf
+        from RAG.doc_registry import make_doc_id
+    except ImportError as e:
+        from langchain_core.documents import Document
+
+        with open(CORPUS) as f:
+            passages = json.load(f)["passages"]
+        docs = [Document(page_content=p["text"], metadata={"type": "text", "page_number": p["page"]}) for p in passages]
+        return {"corpus": docs}, f"retrieval_corpus.json ({e})"
+
+    return {
+        make_doc_id(os.path.basename(path)): upload_pdf(path, doc_id=make_doc_id(os.path.basename(path)))
+        for path in fixture_pdfs(args)
+    }, "pdfs"
+
+
+def build_index(args):
+    from RAG.vector_db import populate_db
+
+    parsed, source = parse_fixtures(args)
+    for doc_id, docs in parsed.items():
+        populate_db(docs, doc_id, filename=doc_id)
+    return source
+
+
+def scenario_ingest(args):
+    try:
+        from RAG.pdf_processor import upload_pdf
+    except ImportError as e:
+        return {"skipped": f"PDF parsing unavailable: {e}"}
+    from RAG.vector_db import populate_db
+    from RAG.doc_registry import make_doc_id
+
+    parse, index, chunks = [], [], 0
+    for path in fixture_pdfs(args):
+        for i in range(args.repeat):
+            # A fresh document id each time, so no chunk is skipped as unchanged
+            doc_id = f"{make_doc_id(os.path.basename(path))}-{i}"
+            start = time.perf_counter()
+            docs = upload_pdf(path, doc_id=doc_id)
+            parse.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            populate_db(docs, doc_id, filename=os.path.basename(path))
+            index.append(time.perf_counter() - start)
+            chunks += len(docs)
+
+    return {
+        "upload_pdf": latency_stats(parse),
+        "populate_db": latency_stats(index),
+        "throughput": chunks / (sum(parse) + sum(index)),
+        "throughput_unit": "chunks/s",
+        "chunks": chunks,
+    }
+
+
+def scenario_retrieve(args):
+    from RAG.vector_db import retrieve_docs
+
+    source = build_index(args)
+    questions = load_questions()
+    retrieve_docs("warm up")
+    latencies = []
+    start = time.perf_counter()
+    for i in range(args.requests):
+        # Distinct strings so the query embedding LRU doesn't serve repeats
+        question = f"{questions[i % len(questions)]} ({i})"
+        began = time.perf_counter()
+        retrieve_docs(question)
+        latencies.append(time.perf_counter() - began)
+    elapsed = time.perf_counter() - start
+    return {**latency_stats(latencies), "throughput": len(latencies) / elapsed, "throughput_unit": "queries/s", "fixture": source}
+
+
+async def drive(client, concurrency, total, request):
+    """Run `total` requests from `concurrency` clients; returns (latencies, elapsed seconds)."""
+    latencies = []
+    counter = iter(range(total))
+
+    async def worker():
+        for i in counter:
+            start = time.perf_counter()
+            await request(client, i)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - start
+
+
+def scenario_query(args):
+    import httpx
+    import main
+
+    source = build_index(args)
+    questions = load_questions()
+
+    async def ask(client, i):
+        resp = await client.post("/query", json={"question": f"{questions[i % len(questions)]} ({i})"})
+        resp.raise_for_status()
+
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", auth=("bench-user", "secret"), timeout=None) as client:
+            # Pays the one bcrypt check and loads the indexes before timing
+            await ask(client, -1)
+            return await drive(client, args.concurrency, args.requests, ask)
+
+    latencies, elapsed = asyncio.run(run())
+    return {
+        **latency_stats(latencies),
+        "throughput": len(latencies) / elapsed,
+        "throughput_unit": "requests/s",
+        "concurrency": args.concurrency,
+        "fixture": source,
+    }
+
+
+def scenario_batch(args):
+    import main
+    from RAG.batch import answer_batch
+
+    source = build_index(args)
+    questions = load_questions()
+    batch = [f"{questions[i % len(questions)]} ({i})" for i in range(args.requests)]
+
+    async def run():
+        # answer_batch is what /query/batch streams; httpx's ASGI transport would buffer the stream
+        arrivals, errors = [], 0
+        [result async for result in answer_batch(["warm up"], cache=main.answer_cache)]
+        start = time.perf_counter()
+        async for result in answer_batch(batch, cache=main.answer_cache, concurrency=args.concurrency):
+            arrivals.append(time.perf_counter() - start)
+            errors += "error" in result
+        return arrivals, errors, time.perf_counter() - start
+
+    arrivals, errors, elapsed = asyncio.run(run())
+    return {
+        **latency_stats(arrivals),
+        "throughput": len(arrivals) / elapsed,
+        "throughput_unit": "questions/s",
+        "concurrency": args.concurrency,
+        "errors": errors,
+        "fixture": source,
+    }
+
+
+def scenario_upload(args):
+    try:
+        import RAG.pdf_processor  # noqa: F401
+    except ImportError as e:
+        return {"skipped": f"PDF parsing unavailable: {e}"}
+    import httpx
+    import main
+
+    paths = fixture_pdfs(args)
+
+    async def upload(client, i):
+        path = paths[i % len(paths)]
+        with open(path, "rb") as f:
+            # A distinct filename per upload so every job does the full ingest
+            name = f"{i}-{os.path.basename(path)}"
+            resp = await client.post("/uploadfile", files={"file": (name, f.read(), "application/pdf")})
+        resp.raise_for_status()
+        job_id = resp.json()["job_id"]
+        while True:
+            job = (await client.get(f"/jobs/{job_id}")).json()
+            if job["status"] in ("completed", "failed"):
+                break
+            await asyncio.sleep(0.05)
+        if job["status"] == "failed":
+            raise RuntimeError(f"Upload {name} failed: {job['error']}")
+
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", auth=("bench-admin", "secret"), timeout=None) as client:
+            return await drive(client, 1, args.repeat * len(paths), upload)
+
+    latencies, elapsed = asyncio.run(run())
+    return {**latency_stats(latencies), "throughput": len(latencies) / elapsed, "throughput_unit": "documents/s"}
+
+
+def run_scenario(args):
+    from benchmarks.stubs import isolated_env
+
+    os.environ["BENCH_TMP"] = isolated_env(prefix=f"rag-suite-{args.scenario}-")
+    import logging
+    logging.disable(logging.WARNING)
+    random.seed(0)
+
+    groq = install_stubs(args)
+    result = globals()[f"scenario_{args.scenario}"](args)
+    if "skipped" not in result:
+        result["peak_rss_mb"] = peak_rss_mb()
+        result["vision_calls"] = groq.calls
+    print(json.dumps(result))
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT, capture_output=True, text=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def compare(results, baseline, tolerance):
+    """Print metric changes against `baseline`; returns the regressions beyond `tolerance`."""
+    regressions = []
+    print(f"\nvs {baseline.get('commit') or 'baseline'}:")
+    if baseline.get("config") != results["config"]:
+        print("  (settings differ from the baseline run; changes may not be regressions)")
+    for name, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name, {})
+        for metric, higher_is_better in COMPARED.items():
+            for label, now, before in metric_pairs(name, metric, current, previous):
+                change = (now - before) / before
+                worse = -change if higher_is_better else change
+                flag = "REGRESSION" if worse > tolerance else ""
+                if flag:
+                    regressions.append(label)
+                print(f"  {label:<32} {before:>10.1f} -> {now:>10.1f} {change:>+7.0%} {flag}")
+    return regressions
+
+
+def metric_pairs(name, metric, current, previous):
+    # Top-level metrics plus those of nested stages (e.g. ingest's upload_pdf / populate_db)
+    for key, now in current.items():
+        if isinstance(now, dict):
+            for label, *values in metric_pairs(f"{name}.{key}", metric, now, previous.get(key, {})):
+                yield (label, *values)
+        elif key == metric and previous.get(key):
+            yield f"{name}.{metric}", now, previous[key]
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--pdfs", default="pdfs/*.pdf", help="fixture PDFs, relative to the repository root")
+    parser.add_argument("--requests", type=int, default=200, help="queries for retrieve, query and batch")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--repeat", type=int, default=1, help="ingests per fixture PDF")
+    parser.add_argument("--embed-ms", type=float, default=5, help="per embedding batch")
+    parser.add_argument("--weaviate-ms", type=float, default=20, help="per vector store call")
+    parser.add_argument("--mongo-ms", type=float, default=5, help="per user lookup")
+    parser.add_argument("--llm-ms", type=float, default=300, help="per answer")
+    parser.add_argument("--caption-ms", type=float, default=200, help="per figure caption")
+    parser.add_argument("--output", help="results file (default benchmarks/results/<commit>.json)")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="relative change counted as a regression")
+    parser.add_argument("--scenario", choices=SCENARIOS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario:
+        run_scenario(args)
+        return
+
+    commit, dirty = git_commit()
+    config = {key: value for key, value in vars(args).items() if key not in ("scenarios", "output", "baseline", "scenario")}
+    results = {
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "config": config,
+        "scenarios": {},
+    }
+
+    print(f"{'scenario':<10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'throughput':>18} {'peak RSS MB':>12}")
+    for scenario in args.scenarios:
+        proc = subprocess.run(
+            [sys.executable, "-m", "benchmarks.suite", *sys.argv[1:], "--scenario", scenario],
+            cwd=ROOT, capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            result = {"error": proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"exit {proc.returncode}"}
+        else:
+            result = json.loads(proc.stdout.strip().splitlines()[-1])
+        results["scenarios"][scenario] = result
+
+        if "skipped" in result or "error" in result:
+            print(f"{scenario:<10} {result.get('skipped') or 'error: ' + result['error']}")
+            continue
+        stages = {scenario: result} if "p50_ms" in result else {f"{scenario}.{key}": value for key, value in result.items() if isinstance(value, dict)}
+        for label, stats in stages.items():
+            print(f"{label:<10} {stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f}", end="")
+            print(f" {result['throughput']:>8.1f} {result['throughput_unit']:<9} {result['peak_rss_mb']:>12.0f}")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{(commit or 'unknown')[:12]}{'-dirty' if dirty else ''}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nresults written to {os.path.relpath(output, ROOT)}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
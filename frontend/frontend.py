@@ -1,8 +1,8 @@
 import streamlit as st
 import requests
 import logging
-import os
-from PIL import Image
+import json
+import time
 from datetime import datetime
 
 # Configure logging
@@ -10,7 +10,6 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 BACKEND_URL = "http://127.0.0.1:8000/"
-FIGURES_PATH = "../"
 
 # Page config
 st.set_page_config(
@@ -135,27 +134,153 @@ def admin_page():
     st.markdown('<div class="glass-card"><h2>📄 Upload PDF</h2></div>', unsafe_allow_html=True)
     uploaded_file = st.file_uploader("Upload PDF", type=["pdf"])
     if uploaded_file and st.button("🚀 Upload and Process"):
-        with st.spinner("Processing..."):
-            files = {"file": (uploaded_file.name, uploaded_file, "application/pdf")}
-            resp = requests.post(
-                f"{BACKEND_URL}/uploadfile",
-                files=files,
-                auth=(st.session_state.username, st.session_state.password)
-            )
+        files = {"file": (uploaded_file.name, uploaded_file, "application/pdf")}
+        resp = requests.post(
+            f"{BACKEND_URL}/uploadfile",
+            files=files,
+            auth=(st.session_state.username, st.session_state.password)
+        )
+        if resp.status_code == 200:
+            st.info(resp.json()["message"])
+            poll_job(resp.json()["job_id"])
+        else:
+            st.error(resp.json().get("detail", "Upload failed"))
+
+    documents_section()
+
+def documents_section():
+    st.markdown('<div class="glass-card"><h2>📚 Indexed Documents</h2></div>', unsafe_allow_html=True)
+    auth = (st.session_state.username, st.session_state.password)
+    resp = requests.get(f"{BACKEND_URL}/documents", auth=auth)
+    if resp.status_code != 200:
+        st.error(resp.json().get("detail", "Could not list documents"))
+        return
+
+    documents = resp.json()["documents"]
+    if not documents:
+        st.caption("No documents indexed yet.")
+    for doc in documents:
+        col1, col2 = st.columns([4, 1])
+        col1.write(f"📄 {doc['filename']} ({doc['chunk_count']} chunks)")
+        if col2.button("🗑️ Delete", key=f"delete_{doc['doc_id']}"):
+            resp = requests.delete(f"{BACKEND_URL}/documents/{doc['doc_id']}", auth=auth)
             if resp.status_code == 200:
                 st.success(resp.json()["message"])
+                st.rerun()
             else:
-                st.error(resp.json().get("detail", "Upload failed"))
+                st.error(resp.json().get("detail", "Delete failed"))
+
+def poll_job(job_id):
+    # Poll the ingestion job instead of holding one long upload request open
+    progress_bar = st.progress(0.0)
+    status_text = st.empty()
+    while True:
+        resp = requests.get(
+            f"{BACKEND_URL}/jobs/{job_id}",
+            auth=(st.session_state.username, st.session_state.password)
+        )
+        if resp.status_code != 200:
+            st.error(resp.json().get("detail", "Could not fetch job status"))
+            return
+
+        job = resp.json()
+        stages = job["stages"]
+        finished = sum(1 for stage in stages.values() if stage["status"] in ("done", "skipped"))
+        pages = stages.get("partition", {})
+        if pages.get("status") == "running" and pages.get("total"):
+            # Stages overlap while streaming, so pages parsed is the best overall measure
+            progress_bar.progress(min(pages["done"] / pages["total"], 1.0))
+        else:
+            progress_bar.progress(finished / len(stages))
+        status_text.markdown(" · ".join(
+            f"{'✅' if stage['status'] in ('done', 'skipped') else '⏳' if stage['status'] == 'running' else '▫️'} {name}"
+            + (f" ({stage['done']}/{stage['total']})" if stage["total"] else f" ({stage['done']})" if stage["done"] else "")
+            for name, stage in stages.items()
+        ))
+
+        if job["status"] == "completed":
+            st.success(f"File ({job['filename']}) processed successfully")
+            return
+        if job["status"] == "failed":
+            st.error(f"Processing failed: {job['error']}")
+            return
+        time.sleep(1)
 
 # ================== User Page ==================
+def render_images(figures):
+    # Figures are served by the backend, so the frontend needs no access to its disk
+    auth = (st.session_state.username, st.session_state.password)
+
+    st.markdown("### 🖼️ Related Images")
+    cols = st.columns(3)
+    for idx, figure in enumerate(figures[:6]):
+        with cols[idx % 3]:
+            try:
+                resp = requests.get(f"{BACKEND_URL.rstrip('/')}{figure['thumbnail_url']}", auth=auth, timeout=10)
+                resp.raise_for_status()
+                caption = f"Figure {idx+1}" + (f" (page {figure['page_number']})" if figure.get("page_number") else "")
+                st.image(resp.content, caption=caption, width=250)
+            except Exception:
+                st.warning("⚠️ Could not load image")
+
+def iter_sse(resp):
+    # Minimal server-sent events parser: yields (event, data) pairs
+    event, data = "message", []
+    for line in resp.iter_lines(decode_unicode=True):
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+
+def stream_answer(query_text, show_images):
+    resp = requests.post(
+        f"{BACKEND_URL}/query/stream",
+        json={"question": query_text},
+        auth=(st.session_state.username, st.session_state.password),
+        stream=True
+    )
+    if resp.status_code != 200:
+        st.error(resp.json().get("detail", "Query failed"))
+        return
+
+    st.markdown("### ✨ Answer")
+    answer_box = st.empty()
+    answer_box.markdown('<div class="answer-box">…</div>', unsafe_allow_html=True)
+    images_area = st.container()
+    answer = ""
+    pages = []
+
+    for event, data in iter_sse(resp):
+        if event == "context":
+            pages = sorted({doc["page_number"] for doc in data.get("sources", []) if doc.get("page_number") is not None})
+            if show_images and data.get("images"):
+                with images_area:
+                    render_images(data["images"])
+        elif event == "token":
+            answer += data["text"]
+            answer_box.markdown(f'<div class="answer-box">{answer}▌</div>', unsafe_allow_html=True)
+        elif event == "error":
+            st.error(data.get("detail", "Query failed"))
+            break
+    answer_box.markdown(f'<div class="answer-box">{answer}</div>', unsafe_allow_html=True)
+    if pages:
+        st.caption("Pages: " + ", ".join(map(str, pages)))
+
 def user_page():
     st.markdown('<div class="glass-card"><h2>💬 Query Documents</h2></div>', unsafe_allow_html=True)
     query_text = st.text_area("Ask a question:", height=100)
     show_images = st.checkbox("Show reference images", value=True)
+    stream = st.checkbox("Stream answer", value=True)
 
     if st.button("🔍 Get Answer"):
         if not query_text.strip():
             st.warning("Enter a question first")
+        elif stream:
+            stream_answer(query_text, show_images)
         else:
             with st.spinner("Thinking..."):
                 resp = requests.post(
@@ -168,25 +293,11 @@ def user_page():
                     result = resp.json()
                     st.markdown("### ✨ Answer")
                     st.markdown(f'<div class="answer-box">{result["response"]}</div>', unsafe_allow_html=True)
-
-                    PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-                    FIGURES_PATH = os.path.join(PROJECT_ROOT, "figures")
+                    if result.get("pages"):
+                        st.caption("Pages: " + ", ".join(map(str, result["pages"])))
 
                     if show_images and result.get("images"):
-                        st.markdown("### 🖼️ Related Images")
-                        cols = st.columns(3)
-                        for idx, img_path in enumerate(result["images"][:6]):
-                            filename = os.path.basename(img_path)
-                            full_path = os.path.join(FIGURES_PATH, filename)
-                            print("Resolved path:", full_path)
-                            # print(img_path)
-                            if os.path.exists(full_path):
-                                with cols[idx % 3]:
-                                    try:
-                                        img = Image.open(full_path)
-                                        st.image(img, caption=f"Figure {idx+1}", width=250)
-                                    except:
-                                        st.warning("⚠️ Could not load image")
+                        render_images(result["images"])
                 else:
                     st.error(resp.json().get("detail", "Query failed"))
 
@@ -0,0 +1,40 @@
+"""Multi-worker deployment: gunicorn managing uvicorn workers.
+
+    gunicorn main:app -c gunicorn.conf.py
+
+The app is imported once in the gunicorn master (preload_app) and the models
+in PRELOAD are loaded there before the workers fork, so the workers share the
+weights copy-on-write instead of each loading its own copy. Answers and bearer
+tokens go through the SQLite file at SHARED_CACHE_PATH, ingestion and deletes
+take the index lock at INGEST_LOCK_PATH, and each worker reloads the local
+index when the index version changes (INDEX_WATCH_INTERVAL).
+"""
+import gc
+import os
+
+# Must be set before the app module is imported below
+os.environ.setdefault("SHARED_CACHE_PATH", "./cache/shared.sqlite")
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", "4"))
+worker_class = os.getenv("WORKER_CLASS", "uvicorn.workers.UvicornWorker")
+preload_app = True
+# Model loading happens before the fork, but a cold first request can still take a while
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+
+
+def when_ready(server):
+    # Runs in the master after the app was imported and before any worker is forked
+    from RAG import app_context
+
+    app_context.preload()
+    # Keep the garbage collector from writing to (and so copying) the pages of objects loaded so far
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    from RAG import app_context
+
+    app_context.after_fork()
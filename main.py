@@ -1,40 +1,116 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends
-from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Header
+from fastapi.responses import StreamingResponse, PlainTextResponse, FileResponse, Response
+from fastapi.security import HTTPBasic, HTTPBasicCredentials, HTTPBearer, HTTPAuthorizationCredentials
 import os
+import json
+import asyncio
+import uuid
 import shutil
 import logging
-from schemas.query import QueryInput
+from contextlib import asynccontextmanager
+from schemas.query import QueryInput, BatchQueryInput
 from schemas.response import LLMResponse
 from schemas.signup import SignUp
 
-from RAG.llm import llm_inference
-from RAG.vector_db import populate_db, retrieve_docs
-from RAG.pdf_processor import upload_pdf, split_text
-from auth.db import users_collection
-from auth.utils import verify_password, hash_password
+from RAG.llm import allm_inference, llm_astream
+from RAG.vector_db import aembed_query, aretrieve_docs, delete_document, embeddings, query_batcher, registry, reranker
+from RAG.answer_cache import AnswerCache
+from RAG.shared_cache import shared_store
+from RAG.context import build_context, cited_pages
+from RAG.batch import answer_batch, BATCH_MAX_QUESTIONS
+from RAG.figure_store import get_figure_store
+from RAG.jobs import submit_ingestion, get_job
+from RAG.file_lock import FileLock, INGEST_LOCK_PATH, INGEST_LOCK_TIMEOUT
+from RAG import app_context, telemetry
+from auth.db import get_async_users_collection
+from auth.utils import acheck_credentials, hash_password
+from auth.cache import user_cache, token_store, verification_cache
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
-security = HTTPBasic()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Models and clients are created lazily; WARMUP opts them into loading here
+    await app_context.startup()
+    yield
+    await app_context.shutdown()
+
+app = FastAPI(lifespan=lifespan)
+# X-Request-ID / traceparent in and out, a root span and latency histogram per request
+app.add_middleware(telemetry.RequestTelemetryMiddleware)
+# Either HTTP Basic credentials or a bearer token issued by /login
+security = HTTPBasic(auto_error=False)
+bearer = HTTPBearer(auto_error=False)
 
 # Ensure required directories exist
 UPLOAD_DIR = "pdfs"
+FIGURE_DIR = "figures"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-def authenticate(credentials:HTTPBasicCredentials=Depends(security)):
-    user=users_collection.find_one({"username":credentials.username})
-    if not user or not verify_password(credentials.password,user['password']):
-        raise HTTPException(status_code=401,details="Invalid credentials")
+# Answers are dropped whenever a document is (re)indexed or deleted, and shared across workers with SHARED_CACHE_PATH
+answer_cache = AnswerCache(version_fn=registry.index_version, store=shared_store("answers"))
+
+def hit_counts(stats, hits, misses):
+    def counts():
+        values = stats()
+        return {"hits": sum(values[key] for key in hits), "misses": values[misses]}
+    return counts
+
+telemetry.REGISTRY.register_cache("answers", hit_counts(answer_cache.stats, ["exact_hits", "semantic_hits"], "misses"))
+# The raw counters, not stats(): a scrape must not count the on-disk vector cache's rows
+telemetry.REGISTRY.register_cache("query_embeddings", hit_counts(lambda: embeddings.metrics, ["query_cache_hits"], "query_cache_misses"))
+telemetry.REGISTRY.register_cache("chunk_embeddings", hit_counts(lambda: embeddings.metrics, ["cache_hits"], "cache_misses"))
+telemetry.REGISTRY.register_cache("rerank_scores", hit_counts(reranker.stats, ["cache_hits"], "cache_misses"))
+telemetry.REGISTRY.register_cache("auth_verifications", verification_cache.stats)
+telemetry.REGISTRY.register_cache("auth_users", user_cache.stats)
+
+async def cached_answer(q):
+    """Look up `q` in the answer cache, returning (cached value or None, question embedding)."""
+    # Lookups check the index version and pull shared entries from SQLite, so they run off the event loop
+    with telemetry.span("answer_cache") as span:
+        cached = await asyncio.to_thread(answer_cache.get_exact, q)
+        if cached is None:
+            vector = await aembed_query(q)
+            cached = await asyncio.to_thread(answer_cache.get_semantic, vector)
+        else:
+            vector = None
+        span.set_attribute("hit", cached is not None)
+        return cached, vector
+
+async def get_user(username):
+    user = user_cache.get(username)
+    if user is None:
+        user = await get_async_users_collection().find_one({"username":username})
+        if user:
+            user_cache.put(username, user)
+    return user
+
+@telemetry.traced("authenticate")
+async def authenticate(
+    credentials:HTTPBasicCredentials=Depends(security),
+    token:HTTPAuthorizationCredentials=Depends(bearer),
+):
+    if token is not None:
+        # With a shared store the token lives in SQLite; look it up off the event loop
+        user = await asyncio.to_thread(token_store.get, token.credentials)
+        if user is None:
+            raise HTTPException(status_code=401,detail="Invalid or expired token")
+        return user
+    if credentials is None:
+        raise HTTPException(status_code=401,detail="Not authenticated",headers={"WWW-Authenticate":"Basic"})
+    user=await get_user(credentials.username)
+    if not user or not await acheck_credentials(credentials.username,credentials.password,user['password']):
+        raise HTTPException(status_code=401,detail="Invalid credentials")
     return {"username":user["username"],"role":user["role"]}
 
-def admin_check(user=Depends(authenticate)):
+# async so the role checks don't occupy a threadpool slot per request
+async def admin_check(user=Depends(authenticate)):
     if user["role"] != "admin":
         raise HTTPException(status_code=403, detail="Admins only")
     return user
 
-def user_check(user=Depends(authenticate)):
+async def user_check(user=Depends(authenticate)):
     if user["role"] != "user":
         raise HTTPException(status_code=403, detail="Users only")
     return user
@@ -43,62 +119,73 @@ def user_check(user=Depends(authenticate)):
 def health():
     return {"status":"ok"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    # Prometheus text format; unauthenticated like /health so a scraper can reach it
+    return PlainTextResponse(telemetry.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/")
 def home():
     return {"message": "Multimodal RAG Application"}
 
 
 @app.post("/signup")
-def signup(req:SignUp):
-    if users_collection.find_one({"username":req.username}):
-        raise HTTPException(status_code=400,details="User already exists")
-    users_collection.insert_one({
+async def signup(req:SignUp):
+    users = get_async_users_collection()
+    if await users.find_one({"username":req.username}):
+        raise HTTPException(status_code=400,detail="User already exists")
+    await users.insert_one({
         "username":req.username,
-        "password":hash_password(req.password),
+        "password":await asyncio.to_thread(hash_password, req.password),
         "role":req.role
     })
     return {"message":"User created successfully"}
 
 @app.get("/login")
-def login(user=Depends(authenticate)):
-    return {"message":f"Welcome {user['username']}","role":user["role"]}
+async def login(user=Depends(authenticate)):
+    response = {"message":f"Welcome {user['username']}","role":user["role"]}
+    if token_store.enabled:
+        token = await asyncio.to_thread(token_store.issue, user)
+        response.update(token=token, token_type="bearer", expires_in=int(token_store.ttl))
+    return response
+
+@app.post("/logout")
+async def logout(token:HTTPAuthorizationCredentials=Depends(bearer)):
+    if token is None or not await asyncio.to_thread(token_store.revoke, token.credentials):
+        raise HTTPException(status_code=401,detail="Invalid or expired token")
+    return {"message":"Logged out"}
 
 
 @app.post("/query", response_model=LLMResponse)
-def inference(query: QueryInput, user=Depends(user_check)):
+async def inference(query: QueryInput, user=Depends(user_check)):
     try:
         q = query.question.strip()
         if not q:
             raise HTTPException(status_code=400, detail="Question cannot be empty.")
 
-        # Retrieve both text and image-caption docs
-        related_docs = retrieve_docs(q)
-
-        # Separate into text + images
-        text_contexts = []
-        image_contexts = []
-        image_paths = []
+        cached, vector = await cached_answer(q)
+        if cached is not None:
+            return LLMResponse(response=cached["response"], images=cached["images"], pages=cited_pages(cached["sources"]))
 
-        for doc in related_docs:
-            if doc.get("type") == "image":
-                caption = doc["content"]
-                path = doc.get("image_path")
-                image_contexts.append(caption)
-                image_paths.append(path)
-            else:
-                text_contexts.append(doc["content"])
-
-        # Merge text + image contexts for the LLM
-        full_context = "\n\n".join(text_contexts + image_contexts)
+        # Retrieve both text and image-caption docs
+        related_docs = await aretrieve_docs(q)
+        with telemetry.span("context"):
+            full_context, figures = build_context(related_docs)
 
         # Pass to LLM
-        response = llm_inference(q, full_context)
+        response = await allm_inference(q, full_context)
+        await asyncio.to_thread(
+            answer_cache.put, q, vector, {"response": response.content, "images": figures, "sources": related_docs}
+        )
 
         return LLMResponse(
             response=response.content,
-            images=image_paths
+            images=figures,
+            pages=cited_pages(related_docs)
         )
 
+    except HTTPException:
+        raise
     except ValueError as e:
         logger.error(f"Vector store error: {e}")
         raise HTTPException(status_code=400, detail=str(e))
@@ -106,6 +193,74 @@ def inference(query: QueryInput, user=Depends(user_check)):
         logger.error(f"Error during inference: {e}")
         raise HTTPException(status_code=500, detail="Internal server error.")
 
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/query/stream")
+async def inference_stream(query: QueryInput, user=Depends(user_check)):
+    q = query.question.strip()
+    if not q:
+        raise HTTPException(status_code=400, detail="Question cannot be empty.")
+
+    try:
+        # Retrieval errors still surface as regular HTTP errors, before the stream starts
+        cached, vector = await cached_answer(q)
+        if cached is None:
+            related_docs = await aretrieve_docs(q)
+            with telemetry.span("context"):
+                full_context, figures = build_context(related_docs)
+    except ValueError as e:
+        logger.error(f"Vector store error: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error during retrieval: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error.")
+
+    async def cached_events():
+        yield sse_event("context", {"images": cached["images"], "sources": cached["sources"]})
+        yield sse_event("token", {"text": cached["response"]})
+        yield sse_event("done", {"cached": True})
+
+    async def events():
+        # Images and sources go first so the client can render them while the answer streams
+        yield sse_event("context", {"images": figures, "sources": related_docs})
+        try:
+            tokens = []
+            async for token in llm_astream(q, full_context):
+                tokens.append(token)
+                yield sse_event("token", {"text": token})
+            await asyncio.to_thread(
+                answer_cache.put, q, vector, {"response": "".join(tokens), "images": figures, "sources": related_docs}
+            )
+            yield sse_event("done", {})
+        except Exception as e:
+            logger.error(f"Error during streaming inference: {e}")
+            yield sse_event("error", {"detail": "Internal server error."})
+
+    return StreamingResponse(
+        cached_events() if cached is not None else events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/query/batch")
+async def inference_batch(query: BatchQueryInput, user=Depends(user_check)):
+    if not query.questions:
+        raise HTTPException(status_code=400, detail="No questions given.")
+    if len(query.questions) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_QUESTIONS} questions per batch.")
+
+    async def lines():
+        # One JSON object per line, in completion order; "index" ties it to its question
+        async for result in answer_batch(query.questions, cache=answer_cache):
+            yield json.dumps(result) + "\n"
+
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 
 
 @app.post("/uploadfile")
@@ -119,26 +274,93 @@ async def create_upload_file(file: UploadFile = File(...), user=Depends(admin_ch
         if not safe_filename or safe_filename == "." or safe_filename == "..":
             raise HTTPException(status_code=400, detail="Invalid filename.")
         
-        # Remove existing PDF if present
-        for f in os.listdir(UPLOAD_DIR):
-            if f.endswith(".pdf"):
-                os.remove(os.path.join(UPLOAD_DIR, f))
-
         file_path = os.path.join(UPLOAD_DIR, safe_filename)
 
-        # Save uploaded file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # Save uploaded file under a name of its own: a queued or running job for an earlier upload
+        # of the same file keeps reading its own copy, which the job moves to file_path once indexed
+        upload_path = os.path.join(UPLOAD_DIR, f".{safe_filename}.{uuid.uuid4().hex}.pdf")
+        try:
+            with open(upload_path, "wb") as buffer:
+                shutil.copyfileobj(file.file, buffer)
+        except BaseException:
+            if os.path.exists(upload_path):
+                os.remove(upload_path)
+            raise
 
-        # Process PDF
-        pdf_data = upload_pdf(file_path)
-        populate_db(pdf_data)
+        # Process PDF in the ingestion worker pool
+        job_id = submit_ingestion(upload_path, filename=safe_filename, keep_path=file_path)
 
-        logger.info(f"Successfully processed file: {safe_filename}")
-        return {"message": f"File ({safe_filename}) uploaded successfully"}
+        logger.info(f"Queued file for processing: {safe_filename}")
+        return {"message": f"File ({safe_filename}) uploaded, processing started", "job_id": job_id}
 
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Error uploading file: {e}")
         raise HTTPException(status_code=500, detail="Error processing file.")
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str, user=Depends(admin_check)):
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
+
+@app.get("/figures/{figure_id}")
+def get_figure(
+    figure_id: str,
+    variant: str = "original",
+    if_none_match: str | None = Header(None),
+    user=Depends(authenticate),
+):
+    # variant: original (as extracted), webp (full size) or thumb (downscaled WebP)
+    found = get_figure_store().path(figure_id, variant)
+    if found is None or not os.path.exists(found[0]):
+        raise HTTPException(status_code=404, detail="Figure not found.")
+    path, media_type = found
+    # Ids are content hashes, so a figure's bytes never change under its URL
+    etag = f'"{figure_id}-{os.path.basename(path)}"'
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=31536000, immutable"}
+    if if_none_match and (if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+    # Streamed from disk (sendfile where the server supports it), never read into memory
+    return FileResponse(path, media_type=media_type, headers=headers)
+
+@app.get("/documents")
+def list_documents(user=Depends(admin_check)):
+    return {"documents": registry.list()}
+
+@app.get("/stats/cache")
+def cache_stats(user=Depends(admin_check)):
+    return {
+        "answers": answer_cache.stats(),
+        "embeddings": embeddings.stats(),
+        "query_batcher": query_batcher.stats(),
+        "reranker": reranker.stats(),
+    }
+
+@app.delete("/documents/{doc_id}")
+def remove_document(doc_id: str, user=Depends(admin_check)):
+    doc = registry.get(doc_id)
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Document not found.")
+    # Deleting writes the index too, so it waits for a running ingestion (in any worker) to finish
+    lease = FileLock(INGEST_LOCK_PATH, purpose=f"delete {doc_id}")
+    if not lease.acquire(timeout=INGEST_LOCK_TIMEOUT):
+        raise HTTPException(status_code=409, detail="An ingestion is in progress, try again later.")
+    try:
+        delete_document(doc_id)
+
+        pdf_path = os.path.join(UPLOAD_DIR, doc["filename"])
+        if os.path.exists(pdf_path):
+            os.remove(pdf_path)
+        shutil.rmtree(os.path.join(FIGURE_DIR, doc_id), ignore_errors=True)
+        # Figures other documents share stay in the store
+        get_figure_store().release(doc_id)
+
+        return {"message": f"Document ({doc['filename']}) deleted successfully"}
+    except Exception as e:
+        logger.error(f"Error deleting document {doc_id}: {e}")
+        raise HTTPException(status_code=500, detail="Error deleting document.")
+    finally:
+        lease.release()
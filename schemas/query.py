@@ -1,4 +1,8 @@
 from pydantic import BaseModel, Field
+from typing import List
 
 class QueryInput(BaseModel):
     question: str = Field(..., description="User query")
+
+class BatchQueryInput(BaseModel):
+    questions: List[str] = Field(..., description="User queries, answered independently")
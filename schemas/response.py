@@ -1,6 +1,13 @@
 from pydantic import BaseModel, Field
-from typing import List
+from typing import List, Optional
+
+class FigureRef(BaseModel):
+    id: str = Field(..., description="Stable figure id (a hash of the image content)")
+    url: str = Field(..., description="Path of the full-size figure, relative to the API root")
+    thumbnail_url: str = Field(..., description="Path of the downscaled thumbnail, relative to the API root")
+    page_number: Optional[int] = Field(None, description="Page the figure was extracted from")
 
 class LLMResponse(BaseModel):
     response: str = Field(..., description="LLM-generated answer to the query")
-    images: List[str] = Field(..., description="List of image paths related to the query")
+    images: List[FigureRef] = Field(..., description="Figures related to the query")
+    pages: List[int] = Field(default_factory=list, description="Document pages the answer's context was drawn from")